@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+""" Measures how many container objects (dicts, lists, ...) are allocated,
+and how long it takes, to serialize an event the way the client API does.
+
+This compares serializing an event whose content has been frozen (as events
+loaded from the database are) against the old behaviour of deep copying
+the whole event on every serialization.
+
+Allocations are counted as the containers in the serialized result that are
+not shared with the event itself, as the gc module doesn't track every dict.
+
+Usage:
+    python experiments/bench_event_serialization.py [iterations]
+"""
+
+import copy
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from synapse.api.events import serialize_event
+from synapse.api.events.room import MessageEvent
+from synapse.util.frozenutils import freeze
+
+
+class FakeClock(object):
+    def time_msec(self):
+        return 2000000
+
+
+class FakeHomeServer(object):
+    def get_clock(self):
+        return FakeClock()
+
+
+def make_event(content_type=freeze):
+    return MessageEvent(
+        event_id="abcdef@example.com",
+        room_id="!room:example.com",
+        user_id="@user:example.com",
+        type=MessageEvent.TYPE,
+        age_ts=1000000,
+        content=content_type({
+            "msgtype": u"m.text",
+            "body": u"Hello world " * 10,
+            "formatted": {"html": u"<b>Hello</b>", "parts": [1, 2, 3]},
+        }),
+        depth=10,
+        prev_events=["a@example.com", "b@example.com"],
+    )
+
+
+def deepcopy_serialize(hs, e):
+    """ serialize_event as it was when get_dict deep copied everything. """
+    d = copy.deepcopy(e.get_dict())
+    if "age_ts" in d:
+        d["age"] = int(hs.get_clock().time_msec()) - d["age_ts"]
+        del d["age_ts"]
+    return d
+
+
+def _containers(o, seen):
+    if isinstance(o, (dict, list, tuple)) and id(o) not in seen:
+        seen[id(o)] = o
+        values = o.values() if isinstance(o, dict) else o
+        for v in values:
+            _containers(v, seen)
+    return seen
+
+
+def count_allocations(func, hs, event):
+    """ Returns the number of containers in the serialized event that aren't
+    shared with the event. """
+    existing = _containers(
+        [
+            getattr(event, k)
+            for k in event.valid_keys + event.internal_keys
+            if hasattr(event, k)
+        ] + [event.unrecognized_keys],
+        {}
+    )
+    result = _containers(func(hs, event), {})
+    return len([k for k in result if k not in existing])
+
+
+def time_calls(func, hs, event, iterations):
+    start = time.time()
+    for _ in xrange(iterations):
+        func(hs, event)
+    return (time.time() - start) / iterations * 1e6
+
+
+def main(iterations):
+    hs = FakeHomeServer()
+
+    for name, func, event in [
+        ("deepcopy", deepcopy_serialize, make_event(dict)),
+        ("frozen", serialize_event, make_event(freeze)),
+    ]:
+        print "%-10s %3d containers/event %8.2f us/event" % (
+            name,
+            count_allocations(func, hs, event),
+            time_calls(func, hs, event, iterations),
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
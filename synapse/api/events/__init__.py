@@ -14,7 +14,7 @@
 # limitations under the License.
 
 from synapse.api.errors import SynapseError, Codes
-from synapse.util.jsonobject import JsonEncodedObject
+from synapse.util.jsonobject import JsonEncodedObject, slots_for
 
 
 def serialize_event(hs, e):
@@ -77,6 +77,8 @@ class SynapseEvent(JsonEncodedObject):
         "content",
     ]
 
+    __slots__ = slots_for(JsonEncodedObject, valid_keys, internal_keys)
+
     def __init__(self, raises=True, **kwargs):
         super(SynapseEvent, self).__init__(**kwargs)
         if "content" in kwargs:
@@ -147,7 +149,7 @@ class SynapseEvent(JsonEncodedObject):
         Returns:
             str: An error message if the validation fails, else None.
         """
-        if type(content) != type(template):
+        if _json_type(content) != type(template):
             return "Mismatched types: %s" % template
 
         if type(template) == dict:
@@ -155,16 +157,16 @@ class SynapseEvent(JsonEncodedObject):
                 if key not in content:
                     return "Missing %s key" % key
 
-                if type(content[key]) != type(template[key]):
+                if _json_type(content[key]) != type(template[key]):
                     return "Key %s is of the wrong type (got %s, want %s)" % (
                         key, type(content[key]), type(template[key]))
 
-                if type(content[key]) == dict:
+                if _json_type(content[key]) == dict:
                     # we must go deeper
                     msg = self._check_json(content[key], template[key])
                     if msg:
                         return msg
-                elif type(content[key]) == list:
+                elif _json_type(content[key]) == list:
                     # make sure each item type in content matches the template
                     for entry in content[key]:
                         msg = self._check_json(entry, template[key][0])
@@ -172,8 +174,20 @@ class SynapseEvent(JsonEncodedObject):
                             return msg
 
 
+def _json_type(o):
+    """ Returns the type of the given JSON value, treating frozen dicts and
+    lists as plain ones. """
+    if isinstance(o, dict):
+        return dict
+    if isinstance(o, list):
+        return list
+    return type(o)
+
+
 class SynapseStateEvent(SynapseEvent):
 
+    __slots__ = []
+
     def __init__(self, **kwargs):
         if "state_key" not in kwargs:
             kwargs["state_key"] = ""
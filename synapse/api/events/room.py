@@ -15,10 +15,13 @@
 
 from synapse.api.constants import Feedback, Membership
 from synapse.api.errors import SynapseError
+from synapse.util.jsonobject import slots_for
 from . import SynapseEvent, SynapseStateEvent
 
 
 class GenericEvent(SynapseEvent):
+    __slots__ = []
+
     def get_content_template(self):
         return {}
 
@@ -30,6 +33,8 @@ class RoomTopicEvent(SynapseEvent):
         "topic",
     ]
 
+    __slots__ = slots_for(SynapseEvent, internal_keys)
+
     def __init__(self, **kwargs):
         kwargs["state_key"] = ""
         if "topic" in kwargs["content"]:
@@ -47,6 +52,8 @@ class RoomNameEvent(SynapseEvent):
         "name",
     ]
 
+    __slots__ = slots_for(SynapseEvent, internal_keys)
+
     def __init__(self, **kwargs):
         kwargs["state_key"] = ""
         if "name" in kwargs["content"]:
@@ -65,6 +72,8 @@ class RoomMemberEvent(SynapseEvent):
         "membership",  # action
     ]
 
+    __slots__ = slots_for(SynapseEvent, valid_keys)
+
     def __init__(self, **kwargs):
         if "membership" not in kwargs:
             kwargs["membership"] = kwargs.get("content", {}).get("membership")
@@ -83,6 +92,8 @@ class MessageEvent(SynapseEvent):
         "msg_id",  # unique per room + user combo
     ]
 
+    __slots__ = slots_for(SynapseEvent, valid_keys)
+
     def __init__(self, **kwargs):
         super(MessageEvent, self).__init__(**kwargs)
 
@@ -95,6 +106,8 @@ class FeedbackEvent(SynapseEvent):
 
     valid_keys = SynapseEvent.valid_keys
 
+    __slots__ = []
+
     def __init__(self, **kwargs):
         super(FeedbackEvent, self).__init__(**kwargs)
         if not kwargs["content"]["type"] in Feedback.LIST:
@@ -115,6 +128,8 @@ class InviteJoinEvent(SynapseEvent):
         "target_host",
     ]
 
+    __slots__ = slots_for(SynapseEvent, valid_keys)
+
     def __init__(self, **kwargs):
         super(InviteJoinEvent, self).__init__(**kwargs)
 
@@ -125,6 +140,8 @@ class InviteJoinEvent(SynapseEvent):
 class RoomConfigEvent(SynapseEvent):
     TYPE = "m.room.config"
 
+    __slots__ = []
+
     def __init__(self, **kwargs):
         kwargs["state_key"] = ""
         super(RoomConfigEvent, self).__init__(**kwargs)
@@ -136,6 +153,8 @@ class RoomConfigEvent(SynapseEvent):
 class RoomCreateEvent(SynapseStateEvent):
     TYPE = "m.room.create"
 
+    __slots__ = []
+
     def get_content_template(self):
         return {}
 
@@ -143,6 +162,8 @@ class RoomCreateEvent(SynapseStateEvent):
 class RoomJoinRulesEvent(SynapseStateEvent):
     TYPE = "m.room.join_rules"
 
+    __slots__ = []
+
     def get_content_template(self):
         return {}
 
@@ -150,6 +171,8 @@ class RoomJoinRulesEvent(SynapseStateEvent):
 class RoomPowerLevelsEvent(SynapseStateEvent):
     TYPE = "m.room.power_levels"
 
+    __slots__ = []
+
     def get_content_template(self):
         return {}
 
@@ -157,6 +180,8 @@ class RoomPowerLevelsEvent(SynapseStateEvent):
 class RoomAddStateLevelEvent(SynapseStateEvent):
     TYPE = "m.room.add_state_level"
 
+    __slots__ = []
+
     def get_content_template(self):
         return {}
 
@@ -164,6 +189,8 @@ class RoomAddStateLevelEvent(SynapseStateEvent):
 class RoomSendEventLevelEvent(SynapseStateEvent):
     TYPE = "m.room.send_event_level"
 
+    __slots__ = []
+
     def get_content_template(self):
         return {}
 
@@ -171,6 +198,8 @@ class RoomSendEventLevelEvent(SynapseStateEvent):
 class RoomOpsPowerLevelsEvent(SynapseStateEvent):
     TYPE = "m.room.ops_levels"
 
+    __slots__ = []
+
     def get_content_template(self):
         return {}
 
@@ -178,5 +207,7 @@ class RoomOpsPowerLevelsEvent(SynapseStateEvent):
 class RoomAliasesEvent(SynapseStateEvent):
     TYPE = "m.room.aliases"
 
+    __slots__ = []
+
     def get_content_template(self):
         return {}
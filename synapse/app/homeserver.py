@@ -14,12 +14,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from synapse.storage import prepare_database
+from synapse.storage import DataStore, prepare_database
+from synapse.storage.pool import ReadWriteConnectionPool
+from synapse.notifier import Notifier
+from synapse.handlers import Handlers
 
 from synapse.server import HomeServer
 
 from twisted.internet import reactor
-from twisted.enterprise import adbapi
 from twisted.web.resource import Resource
 from twisted.web.static import File
 from twisted.web.server import Site
@@ -64,11 +66,35 @@ class SynapseHomeServer(HomeServer):
         )
 
     def build_db_pool(self):
-        return adbapi.ConnectionPool(
-            "sqlite3", self.get_db_name(),
-            check_same_thread=False,
-            cp_min=1,
-            cp_max=1
+        return ReadWriteConnectionPool(
+            self.get_db_name(),
+            readers=self.config.database_readers,
+        )
+
+    def build_notifier(self):
+        return Notifier(
+            self,
+            coalesce_window=self.config.notifier_coalesce_window,
+        )
+
+    def build_handlers(self):
+        return Handlers(
+            self,
+            presence_args=dict(
+                idle_timeout=self.config.presence_idle_timeout,
+                offline_timeout=self.config.presence_offline_timeout,
+                idle_sweep_interval=self.config.presence_idle_sweep_interval,
+            ),
+        )
+
+    def build_datastore(self):
+        return DataStore(
+            self,
+            event_cache_size=self.config.event_cache_size,
+            event_cache_max_bytes=self.config.event_cache_max_bytes,
+            persist_batch_window=self.config.persist_batch_window,
+            persist_batch_size=self.config.persist_batch_size,
+            presence_flush_interval=self.config.presence_flush_interval,
         )
 
     def create_resource_tree(self, web_client, redirect_root_to_web_client):
@@ -220,11 +246,25 @@ def setup():
 
     hs.get_db_pool()
 
+    # Send or write out any events and presence states still held in memory
+    # before stopping.
+    reactor.addSystemEventTrigger(
+        "before", "shutdown", hs.get_datastore().flush_persist_queue
+    )
+    reactor.addSystemEventTrigger(
+        "before", "shutdown",
+        hs.get_handlers().presence_handler.flush_remote_pushes
+    )
+    reactor.addSystemEventTrigger(
+        "before", "shutdown", hs.get_datastore().flush_presence
+    )
+
     if config.manhole:
         f = twisted.manhole.telnet.ShellFactory()
         f.username = "matrix"
         f.password = "rabbithole"
         f.namespace['hs'] = hs
+        f.namespace['metrics'] = hs.get_metrics()
         reactor.listenTCP(config.manhole, f, interface='127.0.0.1')
 
     hs.start_listening(config.bind_port, config.unsecure_port)
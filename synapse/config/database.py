@@ -20,6 +20,12 @@ class DatabaseConfig(Config):
     def __init__(self, args):
         super(DatabaseConfig, self).__init__(args)
         self.database_path = self.abspath(args.database_path)
+        self.database_readers = args.database_readers
+        self.event_cache_size = args.event_cache_size
+        self.event_cache_max_bytes = args.event_cache_max_mb * 1024 * 1024
+        self.persist_batch_window = args.persist_batch_ms / 1000.
+        self.persist_batch_size = args.persist_batch_size
+        self.presence_flush_interval = args.presence_flush_ms / 1000.
 
     @classmethod
     def add_arguments(cls, parser):
@@ -29,6 +35,34 @@ class DatabaseConfig(Config):
             "-d", "--database-path", default="homeserver.db",
             help="The database name."
         )
+        db_group.add_argument(
+            "--database-readers", type=int, default=3,
+            help="Maximum number of connections used for read only queries."
+            " Set to 0 to run everything on the single writer connection."
+        )
+        db_group.add_argument(
+            "--event-cache-size", type=int, default=10000,
+            help="Maximum number of events to keep cached in memory."
+        )
+        db_group.add_argument(
+            "--event-cache-max-mb", type=int, default=50,
+            help="Rough upper bound on the memory used by the event cache."
+        )
+        db_group.add_argument(
+            "--persist-batch-ms", type=int, default=0,
+            help="If set, events persisted within this many milliseconds of"
+            " each other are written in a single transaction."
+        )
+        db_group.add_argument(
+            "--persist-batch-size", type=int, default=50,
+            help="Maximum number of events to write in a single transaction."
+        )
+        db_group.add_argument(
+            "--presence-flush-ms", type=int, default=1000,
+            help="Keep users' presence states in memory and write any that"
+            " have changed every this many milliseconds. Set to 0 to write"
+            " each one as it changes."
+        )
 
     @classmethod
     def generate_config(cls, args, config_dir_path):
@@ -31,6 +31,13 @@ class ServerConfig(Config):
         self.pid_file = self.abspath(args.pid_file)
         self.webclient = True
         self.manhole = args.manhole
+        self.notifier_coalesce_window = args.notifier_coalesce_ms / 1000.
+        self.presence_idle_timeout = args.presence_idle_ms / 1000.
+        self.presence_offline_timeout = args.presence_offline_ms / 1000.
+        self.presence_idle_sweep_interval = (
+            args.presence_idle_sweep_ms / 1000.
+        )
+        self.admin_users = args.admin_users or []
 
         if not args.content_addr:
             host = args.server_name
@@ -68,6 +75,34 @@ class ServerConfig(Config):
         server_group.add_argument("--content-addr", default=None,
                                   help="The host and scheme to use for the "
                                   "content repository")
+        server_group.add_argument("--notifier-coalesce-ms", type=int,
+                                  default=0,
+                                  help="If set, wait this many milliseconds"
+                                  " after a new event in a room before waking"
+                                  " up its listeners, so that a burst of"
+                                  " events is sent out as a single chunk.")
+        server_group.add_argument("--presence-idle-ms", type=int,
+                                  default=5 * 60 * 1000,
+                                  help="How long, in milliseconds, a user"
+                                  " can go without any activity before they"
+                                  " are marked as unavailable.")
+        server_group.add_argument("--presence-offline-ms", type=int,
+                                  default=30 * 60 * 1000,
+                                  help="How long, in milliseconds, a user"
+                                  " without an event stream open can go"
+                                  " without any activity before they are"
+                                  " marked as offline.")
+        server_group.add_argument("--presence-idle-sweep-ms", type=int,
+                                  default=30 * 1000,
+                                  help="Users going idle within this many"
+                                  " milliseconds of each other are marked"
+                                  " as such together.")
+        server_group.add_argument("--admin-user", metavar="USER_ID",
+                                  dest="admin_users", action="append",
+                                  help="A user allowed to read the server's"
+                                  " statistics from /admin/stats. May be"
+                                  " given more than once; if not given, no"
+                                  " one can.")
 
     def read_signing_key(self, signing_key_path):
         signing_key_base64 = self.read_file(signing_key_path, "signing_key")
@@ -17,7 +17,7 @@
 server protocol.
 """
 
-from synapse.util.jsonobject import JsonEncodedObject
+from synapse.util.jsonobject import JsonEncodedObject, slots_for
 
 import logging
 import json
@@ -87,6 +87,8 @@ class Pdu(JsonEncodedObject):
         "content",
     ]
 
+    __slots__ = slots_for(JsonEncodedObject, valid_keys, internal_keys)
+
     # TODO: We need to make this properly load content rather than
     # just leaving it as a dict. (OR DO WE?!)
 
@@ -134,10 +136,14 @@ class Pdu(JsonEncodedObject):
             return None
 
     def __str__(self):
-        return "(%s, %s)" % (self.__class__.__name__, repr(self.__dict__))
+        return "(%s, %s)" % (
+            self.__class__.__name__, repr(self.get_full_dict())
+        )
 
     def __repr__(self):
-        return "<%s, %s>" % (self.__class__.__name__, repr(self.__dict__))
+        return "<%s, %s>" % (
+            self.__class__.__name__, repr(self.get_full_dict())
+        )
 
 
 class Edu(JsonEncodedObject):
@@ -35,7 +35,13 @@ class Handlers(object):
     at construction time.
     """
 
-    def __init__(self, hs):
+    def __init__(self, hs, presence_args=None):
+        """
+        Args:
+            hs (synapse.server.HomeServer)
+            presence_args (dict): Extra keyword arguments for the
+                PresenceHandler.
+        """
         self.registration_handler = RegistrationHandler(hs)
         self.message_handler = MessageHandler(hs)
         self.room_creation_handler = RoomCreationHandler(hs)
@@ -44,7 +50,7 @@ class Handlers(object):
         self.event_handler = EventHandler(hs)
         self.federation_handler = FederationHandler(hs)
         self.profile_handler = ProfileHandler(hs)
-        self.presence_handler = PresenceHandler(hs)
+        self.presence_handler = PresenceHandler(hs, **(presence_args or {}))
         self.room_list_handler = RoomListHandler(hs)
         self.login_handler = LoginHandler(hs)
         self.directory_handler = DirectoryHandler(hs)
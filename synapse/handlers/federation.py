@@ -20,6 +20,7 @@ from ._base import BaseHandler
 from synapse.api.events.room import InviteJoinEvent, RoomMemberEvent
 from synapse.api.constants import Membership
 from synapse.util.logutils import log_function
+from synapse.util.frozenutils import unfreeze
 from synapse.federation.pdu_codec import PduCodec
 from synapse.api.errors import SynapseError
 
@@ -117,7 +118,7 @@ class FederationHandler(BaseHandler):
             # If we receive an invite/join event then we need to join the
             # sender to the given room.
             # TODO: We should probably auth this or some such
-            content = event.content
+            content = unfreeze(event.content)
             content.update({"membership": Membership.JOIN})
             new_event = self.event_factory.create_event(
                 etype=RoomMemberEvent.TYPE,
@@ -19,22 +19,72 @@ from synapse.api.constants import Membership
 from synapse.api.events.room import RoomTopicEvent
 from synapse.api.errors import RoomError
 from synapse.streams.config import PaginationConfig
+from synapse.util.async import concurrently
+from synapse.util.lrucache import LruCache
 from ._base import BaseHandler
 
+from collections import namedtuple
+
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# A room in a user's initialSync snapshot. `info` is the room's entry in the
+# response, without its messages or state. `messages` and `state` are None if
+# the user isn't joined to the room.
+_SnapshotRoom = namedtuple(
+    "_SnapshotRoom", ("info", "messages", "start_key", "state")
+)
+
+
+class _Snapshot(namedtuple(
+    "_Snapshot", ("room_key", "built_at", "rooms", "complete")
+)):
+    """ The rooms part of a user's initialSync response, as of the room
+    stream token `room_key`. `built_at` is when it was first built from
+    scratch, and `complete` is False if some of it couldn't be loaded.
+    """
+
+    @property
+    def size(self):
+        """ The number of events in the snapshot. """
+        return sum(
+            len(r.messages) + len(r.state)
+            for r in self.rooms
+            if r.messages is not None
+        ) or 1
+
 
 class MessageHandler(BaseHandler):
 
+    # How long, in seconds, a user's initialSync snapshot is kept up to date
+    # incrementally before being rebuilt from scratch.
+    SNAPSHOT_CACHE_TTL = 5 * 60
+
+    # The most snapshots to cache, and the most events to keep in them all.
+    SNAPSHOT_CACHE_SIZE = 1000
+    SNAPSHOT_CACHE_MAX_EVENTS = 200000
+
     def __init__(self, hs):
         super(MessageHandler, self).__init__(hs)
         self.hs = hs
         self.clock = hs.get_clock()
         self.event_factory = hs.get_event_factory()
 
+        # (user_id, limit) -> _Snapshot
+        self._snapshot_cache = LruCache(
+            max_entries=self.SNAPSHOT_CACHE_SIZE,
+            max_size=self.SNAPSHOT_CACHE_MAX_EVENTS,
+        )
+        hs.get_metrics().register(
+            "initial_sync_cache", self._snapshot_cache.get_stats
+        )
+
+        # (user_id, limit) -> list of deferreds waiting for the snapshot that
+        # is being worked out.
+        self._snapshot_waiters = {}
+
     @defer.inlineCallbacks
     def get_message(self, msg_id=None, room_id=None, sender_id=None,
                     user_id=None):
@@ -240,6 +290,10 @@ class MessageHandler(BaseHandler):
         This snapshot may include messages for all rooms where the user is
         joined, depending on the pagination config.
 
+        The rooms part of the snapshot is cached for each user and limit, and
+        brought up to date from the stream on the next request, so that a
+        client reconnecting over and over doesn't rebuild it every time.
+
         Args:
             user_id (str): The ID of the user making the request.
             pagin_config (synapse.api.streams.PaginationConfig): The pagination
@@ -251,16 +305,33 @@ class MessageHandler(BaseHandler):
             is joined on, may return a "messages" key with messages, depending
             on the specified PaginationConfig.
         """
-        room_list = yield self.store.get_rooms_for_user_where_membership_is(
-            user_id=user_id,
-            membership_list=[Membership.INVITE, Membership.JOIN]
-        )
-
         user = self.hs.parse_userid(user_id)
 
-        rooms_ret = []
+        limit = pagin_config.limit
+        if not limit:
+            limit = 10
 
-        now_token = yield self.hs.get_event_sources().get_current_token()
+        key = (user_id, limit)
+
+        # If the snapshot is already being worked out for someone else, wait
+        # for theirs rather than doing it all again.
+        if key in self._snapshot_waiters:
+            waiter = defer.Deferred()
+            self._snapshot_waiters[key].append(waiter)
+            snapshot, now_token = yield waiter
+        else:
+            self._snapshot_waiters[key] = []
+            try:
+                snapshot, now_token = yield self._get_snapshot(
+                    user_id, limit
+                )
+            except:
+                for waiter in self._snapshot_waiters.pop(key):
+                    waiter.errback()
+                raise
+
+            for waiter in self._snapshot_waiters.pop(key):
+                waiter.callback((snapshot, now_token))
 
         presence_stream = self.hs.get_event_sources().sources["presence"]
         pagination_config = PaginationConfig(from_token=now_token)
@@ -268,15 +339,94 @@ class MessageHandler(BaseHandler):
             user, pagination_config, None
         )
 
+        rooms_ret = []
+        for room in snapshot.rooms:
+            d = dict(room.info)
+
+            if room.messages is not None:
+                start_token = now_token.copy_and_replace(
+                    "room_key", room.start_key
+                )
+
+                d["messages"] = {
+                    "chunk": [
+                        self.hs.serialize_event(m) for m in room.messages
+                    ],
+                    "start": start_token.to_string(),
+                    "end": now_token.to_string(),
+                }
+
+                d["state"] = [self.hs.serialize_event(c) for c in room.state]
+
+            rooms_ret.append(d)
+
+        ret = {
+            "rooms": rooms_ret,
+            "presence": presence,
+            "end": now_token.to_string()
+        }
+
+        defer.returnValue(ret)
+
+    @defer.inlineCallbacks
+    def _get_snapshot(self, user_id, limit):
+        """ Gets the user's snapshot, from the cache if possible.
+
+        Returns:
+            Deferred: Results in a (_Snapshot, StreamToken) tuple, where the
+            token is the current one that the snapshot is correct as of.
+        """
+        key = (user_id, limit)
+
+        now_token = yield self.hs.get_event_sources().get_current_token()
+
+        snapshot = self._snapshot_cache.get(key)
+        if snapshot is not None:
+            age = self.clock.time() - snapshot.built_at
+            if age > self.SNAPSHOT_CACHE_TTL:
+                snapshot = None
+
+        if snapshot is not None:
+            try:
+                snapshot = yield self._update_snapshot(
+                    user_id, snapshot, now_token, limit
+                )
+            except:
+                logger.exception("Failed to update snapshot, rebuilding it")
+                snapshot = None
+
+        if snapshot is None:
+            snapshot = yield self._build_snapshot(user_id, now_token, limit)
+
+        if snapshot.complete:
+            self._snapshot_cache.set(key, snapshot, size=snapshot.size)
+
+        defer.returnValue((snapshot, now_token))
+
+    @defer.inlineCallbacks
+    def _build_snapshot(self, user_id, now_token, limit):
+        room_list = yield self.store.get_rooms_for_user_where_membership_is(
+            user_id=user_id,
+            membership_list=[Membership.INVITE, Membership.JOIN]
+        )
+
+        joined_room_ids = [
+            event.room_id for event in room_list
+            if event.membership == Membership.JOIN
+        ]
+
+        room_contents_d = self._get_room_contents(
+            joined_room_ids, now_token, limit
+        )
+
         public_rooms = yield self.store.get_rooms(is_public=True)
-        public_room_ids = [r["room_id"] for r in public_rooms]
+        public_room_ids = set(r["room_id"] for r in public_rooms)
 
-        limit = pagin_config.limit
-        if not limit:
-            limit = 10
+        room_contents = yield room_contents_d
 
+        rooms = []
         for event in room_list:
-            d = {
+            info = {
                 "room_id": event.room_id,
                 "membership": event.membership,
                 "visibility": ("public" if event.room_id in
@@ -284,41 +434,125 @@ class MessageHandler(BaseHandler):
             }
 
             if event.membership == Membership.INVITE:
-                d["inviter"] = event.user_id
+                info["inviter"] = event.user_id
 
-            rooms_ret.append(d)
+            messages, start_key, state = None, None, None
+            if event.room_id in room_contents:
+                messages, start_key, state = room_contents[event.room_id]
 
-            if event.membership != Membership.JOIN:
-                continue
-            try:
-                messages, token = yield self.store.get_recent_events_for_room(
-                    event.room_id,
-                    limit=limit,
-                    end_token=now_token.room_key,
+            rooms.append(_SnapshotRoom(info, messages, start_key, state))
+
+        defer.returnValue(_Snapshot(
+            room_key=now_token.room_key,
+            built_at=self.clock.time(),
+            rooms=rooms,
+            complete=all(
+                room_id in room_contents for room_id in joined_room_ids
+            ),
+        ))
+
+    @defer.inlineCallbacks
+    def _update_snapshot(self, user_id, snapshot, now_token, limit):
+        """ Brings a snapshot up to date by reloading just the rooms that have
+        had new events since it was made. Returns None if it needs to be
+        rebuilt from scratch instead, because the user's rooms have changed
+        or some of the rooms couldn't be reloaded.
+
+        Which rooms are public is looked up again every time, as changing it
+        doesn't count as a new event in the rooms.
+        """
+        if self.store.membership_may_have_changed(user_id, snapshot.room_key):
+            defer.returnValue(None)
+
+        joined_room_ids = [
+            r.info["room_id"] for r in snapshot.rooms
+            if r.messages is not None
+        ]
+        changed_room_ids = self.store.get_rooms_changed_since(
+            joined_room_ids, snapshot.room_key
+        )
+
+        room_contents = {}
+        if changed_room_ids:
+            room_contents = yield self._get_room_contents(
+                changed_room_ids, now_token, limit
+            )
+
+            if len(room_contents) < len(changed_room_ids):
+                defer.returnValue(None)
+
+        public_rooms = yield self.store.get_rooms(is_public=True)
+        public_room_ids = set(r["room_id"] for r in public_rooms)
+
+        rooms = []
+        for room in snapshot.rooms:
+            room_id = room.info["room_id"]
+
+            visibility = (
+                "public" if room_id in public_room_ids else "private"
+            )
+            if room.info["visibility"] != visibility:
+                room = room._replace(
+                    info=dict(room.info, visibility=visibility)
                 )
 
-                start_token = now_token.copy_and_replace("room_key", token[0])
-                end_token = now_token.copy_and_replace("room_key", token[1])
+            if room_id in room_contents:
+                room = _SnapshotRoom(room.info, *room_contents[room_id])
+            rooms.append(room)
 
-                d["messages"] = {
-                    "chunk": [self.hs.serialize_event(m) for m in messages],
-                    "start": start_token.to_string(),
-                    "end": end_token.to_string(),
-                }
+        defer.returnValue(snapshot._replace(
+            room_key=now_token.room_key,
+            rooms=rooms,
+        ))
+
+    @defer.inlineCallbacks
+    def _get_room_contents(self, room_ids, now_token, limit):
+        """ Loads the recent events and current state of the given rooms.
+
+        The recent events and state for all the rooms come back from one
+        query each, rather than two queries for every room. If that fails,
+        each room is loaded on its own instead, so that one bad room doesn't
+        take the rest down with it.
 
-                current_state = yield self.store.get_current_state(
-                    event.room_id
+        Returns:
+            Deferred: Results in a dict of room_id to (messages, start_key,
+            state) tuples. Rooms which couldn't be loaded are left out.
+        """
+        try:
+            recent_events, current_states = yield concurrently([
+                self.store.get_recent_events_for_rooms(
+                    room_ids, limit=limit, end_token=now_token.room_key,
+                ),
+                self.store.get_current_state_for_rooms(room_ids),
+            ])
+        except:
+            logger.exception(
+                "Failed to get snapshot of %d rooms, loading them one by one",
+                len(room_ids),
+            )
+        else:
+            defer.returnValue({
+                room_id: (
+                    recent_events[room_id][0],
+                    recent_events[room_id][1][0],
+                    current_states[room_id],
                 )
-                d["state"] = [self.hs.serialize_event(c) for c in current_state]
+                for room_id in room_ids
+            })
+
+        room_contents = {}
+        for room_id in room_ids:
+            try:
+                messages, token = yield self.store.get_recent_events_for_room(
+                    room_id, limit=limit, end_token=now_token.room_key,
+                )
+                current_state = yield self.store.get_current_state(room_id)
             except:
-                logger.exception("Failed to get snapshot")
+                logger.exception("Failed to get snapshot of %s", room_id)
+                continue
 
-        ret = {
-            "rooms": rooms_ret,
-            "presence": presence,
-            "end": now_token.to_string()
-        }
+            room_contents[room_id] = (messages, token[0], current_state)
 
-        defer.returnValue(ret)
+        defer.returnValue(room_contents)
 
 
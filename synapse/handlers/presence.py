@@ -19,9 +19,12 @@ from synapse.api.errors import SynapseError, AuthError
 from synapse.api.constants import PresenceState
 
 from synapse.util.logutils import log_function
+from synapse.util.wheeltimer import WheelTimer
 
 from ._base import BaseHandler
 
+from collections import OrderedDict
+
 import logging
 
 
@@ -59,9 +62,39 @@ class PresenceHandler(BaseHandler):
         PresenceState.FREE_FOR_CHAT: 3,
     }
 
-    def __init__(self, hs):
+    # How long, in seconds, to collect presence updates for a remote server
+    # before sending them all to it in one m.presence EDU.
+    REMOTE_PUSH_WINDOW = 0.05
+
+    # How long, in seconds, a local user can go without any activity before
+    # they are marked as unavailable if they were online, and as offline if
+    # they don't have an event stream open either.
+    IDLE_TIMEOUT = 5 * 60
+    OFFLINE_TIMEOUT = 30 * 60
+
+    # Users going idle within this many seconds of each other are swept up,
+    # and written out, together.
+    IDLE_SWEEP_INTERVAL = 30
+
+    def __init__(self, hs, idle_timeout=None, offline_timeout=None,
+                 idle_sweep_interval=None):
+        """
+        Args:
+            hs (synapse.server.HomeServer)
+            idle_timeout (float): If set, overrides IDLE_TIMEOUT.
+            offline_timeout (float): If set, overrides OFFLINE_TIMEOUT.
+            idle_sweep_interval (float): If set, overrides
+                IDLE_SWEEP_INTERVAL.
+        """
         super(PresenceHandler, self).__init__(hs)
 
+        if idle_timeout:
+            self.IDLE_TIMEOUT = idle_timeout
+        if offline_timeout:
+            self.OFFLINE_TIMEOUT = offline_timeout
+        if idle_sweep_interval:
+            self.IDLE_SWEEP_INTERVAL = idle_sweep_interval
+
         self.homeserver = hs
 
         self.clock = hs.get_clock()
@@ -129,12 +162,69 @@ class PresenceHandler(BaseHandler):
         self._user_cachemap = {}
         self._user_cachemap_latest_serial = 0
 
+        # map the users in _user_cachemap to the serial of their latest
+        # update, in order of serial, so that the event source can find the
+        # updates since a given serial without looking at everyone.
+        self._serial_index = OrderedDict()
+
+        # map remote domain names to the user states waiting to be pushed to
+        # them, keyed by user ID so that only the latest state for each user
+        # is sent.
+        self._remote_push_queue = {}
+        self._remote_push_timer = None
+
+        # local users with an event stream open, who aren't marked as
+        # offline however long they are idle.
+        self._streaming_users = set()
+        # local users who were marked as unavailable for being idle, and so
+        # come back online when they are next active.
+        self._idle_users = set()
+
+        # local users waiting to be checked for having gone idle
+        self._idle_timer = WheelTimer(
+            self.clock,
+            self._sweep_idle_users,
+            bucket_size=self.IDLE_SWEEP_INTERVAL,
+            batched=True,
+        )
+        hs.get_metrics().register(
+            "presence_idle_timer", self._idle_timer.get_stats
+        )
+
     def _get_or_make_usercache(self, user):
         """If the cache entry doesn't exist, initialise a new one."""
         if user not in self._user_cachemap:
             self._user_cachemap[user] = UserPresenceCache()
         return self._user_cachemap[user]
 
+    def _update_usercache(self, user, statuscache, state):
+        """Apply an update to a user's cache entry under a new serial."""
+        self._user_cachemap_latest_serial += 1
+        statuscache.update(state, serial=self._user_cachemap_latest_serial)
+
+        self._serial_index.pop(user, None)
+        self._serial_index[user] = statuscache.serial
+
+        if user.is_mine:
+            self._schedule_idle_check(user, statuscache)
+
+    def _remove_usercache(self, user):
+        del self._user_cachemap[user]
+        self._serial_index.pop(user, None)
+
+    def get_updated_users(self, from_serial, to_serial=None):
+        """Get the users whose latest update has a serial after
+        `from_serial`, and up to and including `to_serial` if given, newest
+        first. Only the updates in that range are looked at.
+        """
+        for user in reversed(self._serial_index):
+            serial = self._serial_index[user]
+            if serial <= from_serial:
+                break
+            if to_serial is not None and serial > to_serial:
+                continue
+            yield user
+
     def _get_or_offline_usercache(self, user):
         """If the cache entry doesn't exist, return an OFFLINE one but do not
         store it into the cache."""
@@ -209,6 +299,8 @@ class PresenceHandler(BaseHandler):
         if target_user != auth_user:
             raise AuthError(400, "Cannot set another user's presence")
 
+        self._idle_users.discard(target_user)
+
         if "status_msg" not in state:
             state["status_msg"] = None
 
@@ -263,21 +355,132 @@ class PresenceHandler(BaseHandler):
 
         self.changed_presencelike_data(user, {"last_active": now})
 
+        if user in self._idle_users:
+            status_msg = self._user_cachemap[user].state.get("status_msg")
+            return self.set_state(user, user, {
+                "presence": PresenceState.ONLINE,
+                "status_msg": status_msg,
+            })
+
+    def _schedule_idle_check(self, user, statuscache):
+        """Arrange for the user to be checked for having gone idle once they
+        could have."""
+        presence = statuscache.state.get("presence")
+        last_active = statuscache.state.get("last_active")
+
+        if presence in (None, PresenceState.OFFLINE) or last_active is None:
+            self._idle_timer.remove(user)
+            return
+
+        if self.STATE_LEVELS[presence] > self.STATE_LEVELS[
+            PresenceState.UNAVAILABLE
+        ]:
+            timeout = self.IDLE_TIMEOUT
+        elif user not in self._streaming_users:
+            timeout = self.OFFLINE_TIMEOUT
+        else:
+            self._idle_timer.remove(user)
+            return
+
+        delay = (last_active - self.clock.time_msec()) / 1000. + timeout
+        self._idle_timer.insert(user, max(delay, 0))
+
+    def _get_idle_presence(self, user, statuscache, now):
+        """Returns the presence state the user should now have for being
+        idle, or None if they should keep the one they have."""
+        presence = statuscache.state.get("presence")
+        last_active = statuscache.state.get("last_active")
+
+        if presence in (None, PresenceState.OFFLINE) or last_active is None:
+            return None
+
+        idle = now - last_active
+
+        if (idle >= self.OFFLINE_TIMEOUT * 1000 and
+                user not in self._streaming_users):
+            return PresenceState.OFFLINE
+
+        if (idle >= self.IDLE_TIMEOUT * 1000 and
+                self.STATE_LEVELS[presence] > self.STATE_LEVELS[
+                    PresenceState.UNAVAILABLE
+                ]):
+            return PresenceState.UNAVAILABLE
+
+        return None
+
+    def _sweep_idle_users(self, users):
+        """Marks the users that have gone idle as unavailable or offline,
+        storing all of their new states in a single transaction.
+
+        Unlike set_state, this doesn't fire collect_presencelike_data: every
+        user swept already has a cache entry holding what was collected when
+        they came online, and only their presence is changed here.
+        """
+        now = self.clock.time_msec()
+
+        updates = []
+        for user in users:
+            statuscache = self._user_cachemap.get(user)
+            if statuscache is None:
+                continue
+
+            presence = self._get_idle_presence(user, statuscache, now)
+            if presence is None:
+                self._schedule_idle_check(user, statuscache)
+            else:
+                updates.append((user, statuscache, presence))
+
+        if not updates:
+            return defer.succeed(None)
+
+        logger.debug("Marking %d users as idle", len(updates))
+
+        states_to_store = [
+            (user.localpart, {
+                "state": presence,
+                "status_msg": statuscache.state.get("status_msg"),
+            })
+            for user, statuscache, presence in updates
+        ]
+
+        for user, _, presence in updates:
+            if presence == PresenceState.OFFLINE:
+                self._idle_users.discard(user)
+                self.stop_polling_presence(user)
+            else:
+                self._idle_users.add(user)
+
+            self.changed_presencelike_data(user, {"presence": presence})
+
+        def on_failure(f):
+            # Nothing waits on the sweep, so don't leave this unhandled.
+            logger.error(
+                "Failed to store idle presence for %d users: %s",
+                len(states_to_store), f.getErrorMessage(),
+            )
+
+        d = self.store.set_presence_states(states_to_store)
+        d.addErrback(on_failure)
+        return d
+
     def changed_presencelike_data(self, user, state):
         statuscache = self._get_or_make_usercache(user)
 
-        self._user_cachemap_latest_serial += 1
-        statuscache.update(state, serial=self._user_cachemap_latest_serial)
+        self._update_usercache(user, statuscache, state)
 
         self.push_presence(user, statuscache=statuscache)
 
     @log_function
     def started_user_eventstream(self, user):
+        self._streaming_users.add(user)
+
         # TODO(paul): Use "last online" state
-        self.set_state(user, user, {"presence": PresenceState.ONLINE})
+        return self.set_state(user, user, {"presence": PresenceState.ONLINE})
 
     @log_function
     def stopped_user_eventstream(self, user):
+        self._streaming_users.discard(user)
+
         # TODO(paul): Save current state as "last online" state
         self.set_state(user, user, {"presence": PresenceState.OFFLINE})
 
@@ -288,8 +491,7 @@ class PresenceHandler(BaseHandler):
 
             # No actual update but we need to bump the serial anyway for the
             # event source
-            self._user_cachemap_latest_serial += 1
-            statuscache.update({}, serial=self._user_cachemap_latest_serial)
+            self._update_usercache(user, statuscache, {})
 
             self.push_update_to_local_and_remote(
                 observed_user=user,
@@ -618,15 +820,61 @@ class PresenceHandler(BaseHandler):
         }
         user_state.update(**state)
 
-        yield self.federation.send_edu(
-            destination=destination,
-            edu_type="m.presence",
-            content={
-                "push": [
-                    user_state,
-                ],
-            }
+        self._queue_remote_push(destination, user_state)
+
+    def _queue_remote_push(self, destination, user_state):
+        """Queue a user's state to be pushed to a remote server along with
+        everything else queued for it in the next REMOTE_PUSH_WINDOW."""
+        pending = self._remote_push_queue.setdefault(
+            destination, OrderedDict()
         )
+        pending[user_state["user_id"]] = user_state
+
+        if self._remote_push_timer is None:
+            self._remote_push_timer = self.clock.call_later(
+                self.REMOTE_PUSH_WINDOW, self._send_remote_pushes
+            )
+
+    def _send_remote_pushes(self):
+        self._remote_push_timer = None
+        self.flush_remote_pushes()
+
+    def flush_remote_pushes(self):
+        """Sends everything queued for remote servers now, rather than waiting
+        for the end of the REMOTE_PUSH_WINDOW.
+
+        Returns:
+            Deferred: Fires once every push has been sent or has failed.
+        """
+        if self._remote_push_timer is not None:
+            self.clock.cancel_call_later(self._remote_push_timer)
+            self._remote_push_timer = None
+
+        queue = self._remote_push_queue
+        self._remote_push_queue = {}
+
+        def on_failure(f, destination, count):
+            logger.error(
+                "Failed to push %d presence updates to %s: %s",
+                count, destination, f.getErrorMessage(),
+            )
+
+        deferreds = []
+        for destination, pending in queue.items():
+            logger.debug(
+                "Pushing %d presence updates to %s", len(pending), destination
+            )
+            d = self.federation.send_edu(
+                destination=destination,
+                edu_type="m.presence",
+                content={
+                    "push": pending.values(),
+                }
+            )
+            d.addErrback(on_failure, destination, len(pending))
+            deferreds.append(d)
+
+        return defer.DeferredList(deferreds)
 
     @defer.inlineCallbacks
     def incoming_presence(self, origin, content):
@@ -661,8 +909,7 @@ class PresenceHandler(BaseHandler):
 
             statuscache = self._get_or_make_usercache(user)
 
-            self._user_cachemap_latest_serial += 1
-            statuscache.update(state, serial=self._user_cachemap_latest_serial)
+            self._update_usercache(user, statuscache, state)
 
             self.push_update_to_clients(
                 observed_user=user,
@@ -672,7 +919,7 @@ class PresenceHandler(BaseHandler):
             )
 
             if state["presence"] == PresenceState.OFFLINE:
-                del self._user_cachemap[user]
+                self._remove_usercache(user)
 
         for poll in content.get("poll", []):
             user = self.hs.parse_userid(poll)
@@ -758,32 +1005,47 @@ class PresenceEventSource(object):
         self.clock = hs.get_clock()
 
     @defer.inlineCallbacks
-    def is_visible(self, observer_user, observed_user):
-        if observer_user == observed_user:
-            defer.returnValue(True)
-
+    def _filter_visible(self, observer_user, updates):
+        """ Filters a list of (observed_user, statuscache) updates down to
+        those the observer is allowed to see.
+
+        Someone can see their own presence, the presence of anyone they
+        share a room with, and that of anyone they are polling. Everyone the
+        observer shares a room with is looked up once, rather than checking
+        each observed user against them.
+        """
         presence = self.hs.get_handlers().presence_handler
 
-        if (yield presence.store.user_rooms_intersect(
-            [u.to_string() for u in observer_user, observed_user]
-        )):
-            defer.returnValue(True)
+        pushmap = presence._local_pushmap
+        recvmap = presence._remote_recvmap
 
-        if observed_user.is_mine:
-            pushmap = presence._local_pushmap
+        def is_polling(observed_user):
+            if observed_user.is_mine:
+                observers = pushmap.get(observed_user.localpart, ())
+            else:
+                observers = recvmap.get(observed_user, ())
+            return observer_user in observers
+
+        visible = []
+        to_check = []
+        for observed_user, cached in updates:
+            if observed_user == observer_user or is_polling(observed_user):
+                visible.append((observed_user, cached))
+            else:
+                to_check.append((observed_user, cached))
 
-            defer.returnValue(
-                observed_user.localpart in pushmap and
-                observer_user in pushmap[observed_user.localpart]
+        if to_check:
+            sharing = yield presence.store.get_users_sharing_room_with(
+                observer_user.to_string()
             )
-        else:
-            recvmap = presence._remote_recvmap
 
-            defer.returnValue(
-                observed_user in recvmap and
-                observer_user in recvmap[observed_user]
+            visible.extend(
+                (observed_user, cached) for observed_user, cached in to_check
+                if observed_user.to_string() in sharing
             )
 
+        defer.returnValue(visible)
+
     @defer.inlineCallbacks
     def get_new_events_for_user(self, user, from_key, limit):
         from_key = int(from_key)
@@ -793,15 +1055,14 @@ class PresenceEventSource(object):
         presence = self.hs.get_handlers().presence_handler
         cachemap = presence._user_cachemap
 
-        updates = []
-        # TODO(paul): use a DeferredList ? How to limit concurrency.
-        for observed_user in cachemap.keys():
-            cached = cachemap[observed_user]
-            if not (from_key < cached.serial):
-                continue
+        # Take the updates before yielding, as users going offline are
+        # removed from the cachemap.
+        updates = [
+            (observed_user, cachemap[observed_user])
+            for observed_user in presence.get_updated_users(from_key)
+        ]
 
-            if (yield self.is_visible(observer_user, observed_user)):
-                updates.append((observed_user, cached))
+        updates = yield self._filter_visible(observer_user, updates)
 
         # TODO(paul): limit
 
@@ -838,20 +1099,17 @@ class PresenceEventSource(object):
         presence = self.hs.get_handlers().presence_handler
         cachemap = presence._user_cachemap
 
-        updates = []
-        # TODO(paul): use a DeferredList ? How to limit concurrency.
-        for observed_user in cachemap.keys():
-            if not (to_key < cachemap[observed_user].serial < from_key):
-                continue
+        updates = [
+            (observed_user, cachemap[observed_user])
+            for observed_user in presence.get_updated_users(
+                to_key, from_key - 1
+            )
+        ]
 
-            if (yield self.is_visible(observer_user, observed_user)):
-                updates.append((observed_user, cachemap[observed_user]))
+        updates = yield self._filter_visible(observer_user, updates)
 
         # TODO(paul): limit
 
-        updates = [(k, cachemap[k]) for k in cachemap
-                   if to_key < cachemap[k].serial < from_key]
-
         if updates:
             clock = self.clock
 
@@ -285,6 +285,10 @@ class RoomMemberHandler(BaseHandler):
     def get_room_members(self, room_id, membership=Membership.JOIN):
         hs = self.hs
 
+        if membership == Membership.JOIN:
+            user_ids = yield self.store.get_users_in_room(room_id)
+            defer.returnValue([hs.parse_userid(u) for u in user_ids])
+
         memberships = yield self.store.get_room_members(
             room_id=room_id, membership=membership
         )
@@ -562,6 +566,10 @@ class RoomMemberHandler(BaseHandler):
     def get_rooms_for_user(self, user, membership_list=[Membership.JOIN]):
         """Returns a list of roomids that the user has any of the given
         membership states in."""
+        if membership_list == [Membership.JOIN]:
+            room_ids = yield self.store.get_rooms_for_user(user.to_string())
+            defer.returnValue(list(room_ids))
+
         rooms = yield self.store.get_rooms_for_user_where_membership_is(
             user_id=user.to_string(), membership_list=membership_list
         )
@@ -623,6 +631,40 @@ class RoomEventSource(object):
 
         defer.returnValue((events, end_key))
 
+    @defer.inlineCallbacks
+    def get_new_events_for_users(self, requests):
+        """ Like get_new_events_for_user, but for several users at once. The
+        new events are only fetched from the database once.
+
+        Args:
+            requests (list): (user, room_ids, from_key, limit) tuples, where
+                `room_ids` is the set of rooms the user is in.
+        Returns:
+            Deferred: A list of (events, end_key), one for each request.
+        """
+        to_key = yield self.get_current_key()
+
+        results = yield self.store.get_room_events_stream_for_many(
+            [
+                (
+                    user.to_string(), from_key, limit,
+                    _visible_to(user, room_ids),
+                )
+                for user, room_ids, from_key, limit in requests
+            ],
+            to_key=to_key,
+        )
+
+        defer.returnValue(results)
+
+    def may_have_new_events_for_user(self, user, from_key, room_ids):
+        """ Returns False if we know, without going to the database, that
+        there are no new events for the user in the given rooms since
+        from_key. """
+        return self.store.room_events_may_have_changed(
+            user.to_string(), from_key, room_ids
+        )
+
     def get_current_key(self):
         return self.store.get_room_events_max_id()
 
@@ -647,3 +689,21 @@ class RoomEventSource(object):
         next_token = from_token.copy_and_replace("room_key", next_key)
 
         defer.returnValue((events, next_token))
+
+
+def _visible_to(user, room_ids):
+    """ Returns a function which checks whether an event should be streamed
+    to the given user: either it is in one of their rooms, or it is about
+    their membership of some other room, e.g. an invite.
+    """
+    user_id = user.to_string()
+
+    def is_visible(event):
+        if event.room_id in room_ids:
+            return True
+        return (
+            event.type == RoomMemberEvent.TYPE and
+            event.state_key == user_id
+        )
+
+    return is_visible
@@ -13,9 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from twisted.internet import defer, reactor
+from twisted.internet import defer
 
+from synapse.util.async import concurrently
 from synapse.util.logutils import log_function
+from synapse.util.wheeltimer import WheelTimer
 
 import logging
 
@@ -40,7 +42,7 @@ class _NotificationListener(object):
         self.timeout = timeout
         self.deferred = deferred
 
-        self.rooms = rooms
+        self.rooms = set(rooms)
 
         self.pending_notifications = []
 
@@ -57,11 +59,7 @@ class _NotificationListener(object):
         except defer.AlreadyCalledError:
             pass
 
-        for room in self.rooms:
-            lst = notifier.rooms_to_listeners.get(room, set())
-            lst.discard(self)
-
-        notifier.user_to_listeners.get(self.user, set()).discard(self)
+        notifier._remove_listener(self)
 
 
 class Notifier(object):
@@ -71,20 +69,45 @@ class Notifier(object):
     Primarily used from the /events stream.
     """
 
-    def __init__(self, hs):
+    # How late, in seconds, listeners may be timed out.
+    TIMEOUT_BUCKET_SIZE = 1.
+
+    def __init__(self, hs, coalesce_window=0):
+        """
+        Args:
+            hs (synapse.server.HomeServer)
+            coalesce_window (float): If set, the number of seconds to wait
+                after a new event in a room before waking up its listeners,
+                so that they get all the events sent during that time in one
+                go rather than one at a time.
+        """
         self.hs = hs
+        self.clock = hs.get_clock()
+
+        self.coalesce_window = coalesce_window
+
+        # room_id -> set of extra users to wake, for rooms with a wake up
+        # scheduled.
+        self._pending_rooms = {}
 
         self.rooms_to_listeners = {}
         self.user_to_listeners = {}
 
         self.event_sources = hs.get_event_sources()
 
+        self._timeouts = WheelTimer(
+            self.clock,
+            self._timeout_listener,
+            bucket_size=self.TIMEOUT_BUCKET_SIZE,
+        )
+
+        hs.get_metrics().register("notifier", self.get_stats)
+
         hs.get_distributor().observe(
             "user_joined_room", self._user_joined_room
         )
 
     @log_function
-    @defer.inlineCallbacks
     def on_new_room_event(self, event, extra_users=[]):
         """ Used by handlers to inform the notifier something has happened
         in the room, room event wise.
@@ -92,9 +115,34 @@ class Notifier(object):
         This triggers the notifier to wake up any listeners that are
         listening to the room, and any listeners for the users in the
         `extra_users` param.
+
+        If a coalescing window is configured the listeners are woken up once
+        it has passed, along with the listeners for any other events in the
+        room during the window.
         """
         room_id = event.room_id
 
+        if not self.coalesce_window:
+            return self._notify_room(room_id, extra_users)
+
+        pending = self._pending_rooms.get(room_id)
+        if pending is None:
+            pending = self._pending_rooms[room_id] = set()
+            self.clock.call_later(
+                self.coalesce_window,
+                lambda: self._flush_room(room_id),
+            )
+
+        pending.update(extra_users)
+
+        return defer.succeed(None)
+
+    def _flush_room(self, room_id):
+        extra_users = self._pending_rooms.pop(room_id, set())
+        self._notify_room(room_id, extra_users)
+
+    @defer.inlineCallbacks
+    def _notify_room(self, room_id, extra_users):
         room_source = self.event_sources.sources["room"]
 
         listeners = self.rooms_to_listeners.get(room_id, set()).copy()
@@ -104,17 +152,28 @@ class Notifier(object):
 
         logger.debug("on_new_room_event listeners %s", listeners)
 
-        # TODO (erikj): Can we make this more efficient by hitting the
-        # db once?
+        if not listeners:
+            return
 
-        @defer.inlineCallbacks
-        def notify(listener):
-            events, end_key = yield room_source.get_new_events_for_user(
-                listener.user,
-                listener.from_token.room_key,
-                listener.limit,
-            )
+        # Fetch the new events for all the listeners in one go, rather than
+        # running the stream query once for each of them.
+        listeners = list(listeners)
+
+        try:
+            results = yield room_source.get_new_events_for_users([
+                (
+                    listener.user,
+                    listener.rooms,
+                    listener.from_token.room_key,
+                    listener.limit,
+                )
+                for listener in listeners
+            ])
+        except:
+            logger.exception("Failed to get new events for listeners")
+            return
 
+        for listener, (events, end_key) in zip(listeners, results):
             if events:
                 end_token = listener.from_token.copy_and_replace(
                     "room_key", end_key
@@ -124,13 +183,6 @@ class Notifier(object):
                     self, events, listener.from_token, end_token
                 )
 
-        def eb(failure):
-            logger.exception("Failed to notify listener", failure)
-
-        yield defer.DeferredList(
-            [notify(l).addErrback(eb) for l in listeners]
-        )
-
     @defer.inlineCallbacks
     @log_function
     def on_new_user_event(self, users=[], rooms=[]):
@@ -207,7 +259,7 @@ class Notifier(object):
         )
 
         if timeout:
-            reactor.callLater(timeout/1000, self._timeout_listener, listener)
+            self._timeouts.insert(listener, timeout / 1000.)
 
             self._register_with_keys(listener)
 
@@ -236,30 +288,68 @@ class Notifier(object):
 
         self.user_to_listeners.setdefault(listener.user, set()).add(listener)
 
+    def _remove_listener(self, listener):
+        """ Removes the listener from the indexes, and stops it timing out.
+        """
+        self._timeouts.remove(listener)
+
+        for room in listener.rooms:
+            _discard_from_index(self.rooms_to_listeners, room, listener)
+
+        _discard_from_index(self.user_to_listeners, listener.user, listener)
+
+    def get_stats(self):
+        return {
+            "listeners": len(self._timeouts),
+            "rooms": len(self.rooms_to_listeners),
+            "users": len(self.user_to_listeners),
+        }
+
     @defer.inlineCallbacks
     @log_function
     def _check_for_updates(self, listener):
-        # TODO (erikj): We need to think about limits across multiple sources
-        events = []
-
         from_token = listener.from_token
-        limit = listener.limit
 
-        # TODO (erikj): DeferredList?
+        # Ask all the sources at once, so that we only wait as long as the
+        # slowest of them.
+        names = []
+        deferreds = []
         for name, source in self.event_sources.sources.items():
             keyname = "%s_key" % name
 
-            stuff, new_key = yield source.get_new_events_for_user(
+            if name == "room" and not source.may_have_new_events_for_user(
+                listener.user, getattr(from_token, keyname), listener.rooms
+            ):
+                continue
+
+            names.append(name)
+            deferreds.append(defer.maybeDeferred(
+                source.get_new_events_for_user,
                 listener.user,
                 getattr(from_token, keyname),
-                limit,
-            )
-
-            events.extend(stuff)
+                listener.limit,
+            ))
 
-            from_token = from_token.copy_and_replace(keyname, new_key)
+        results = yield concurrently(deferreds)
 
+        # Events from different sources have no common ordering, and a
+        # source's key can only be moved past all of the events it returned,
+        # so each source's events are sent all together or not at all. Taking
+        # the smallest first fits in as many sources as the limit allows, so
+        # a busy room can't hold back presence and typing. Whatever doesn't
+        # fit is left at its old key, for the next poll.
+        events = []
         end_token = from_token
+        results = sorted(
+            zip(names, results), key=lambda (_, result): len(result[0])
+        )
+        for name, (stuff, new_key) in results:
+            if listener.limit and events:
+                if len(events) + len(stuff) > listener.limit:
+                    break
+
+            events.extend(stuff)
+            end_token = end_token.copy_and_replace("%s_key" % name, new_key)
 
         if events:
             listener.notify(self, events, listener.from_token, end_token)
@@ -267,7 +357,24 @@ class Notifier(object):
         defer.returnValue(listener)
 
     def _user_joined_room(self, user, room_id):
-        new_listeners = self.user_to_listeners.get(user, set())
+        new_listeners = self.user_to_listeners.get(user)
+        if not new_listeners:
+            return
 
         listeners = self.rooms_to_listeners.setdefault(room_id, set())
         listeners |= new_listeners
+
+        for listener in new_listeners:
+            listener.rooms.add(room_id)
+
+
+def _discard_from_index(index, key, listener):
+    """ Removes the listener from the set stored under the key, removing the
+    set altogether once it is empty so that the indexes don't grow without
+    bound. """
+    listeners = index.get(key)
+    if listeners is not None:
+        listeners.discard(listener)
+        if not listeners:
+            del index[key]
+
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" This module contains REST servlets for inspecting the running server. """
+from twisted.internet import defer
+
+from synapse.api.errors import AuthError
+
+from base import RestServlet, client_path_pattern
+
+
+class AdminStatsRestServlet(RestServlet):
+    """ Returns the statistics collected by the homeserver's Metrics, e.g.
+    per-statement SQL timings.
+
+    None of these contain any event content or SQL parameter values, but
+    they do show how busy the server is, so only the users listed as admins
+    in the config may read them.
+    """
+    PATTERN = client_path_pattern("/admin/stats$")
+
+    def __init__(self, hs):
+        super(AdminStatsRestServlet, self).__init__(hs)
+        self.metrics = hs.get_metrics()
+
+    @defer.inlineCallbacks
+    def on_GET(self, request):
+        user = yield self.auth.get_user_by_req(request)
+
+        if user.to_string() not in self.hs.config.admin_users:
+            raise AuthError(403, "You are not a server admin")
+
+        defer.returnValue((200, self.metrics.collect()))
+
+
+def register_servlets(hs, http_server):
+    AdminStatsRestServlet(hs).register(http_server)
@@ -32,6 +32,7 @@ from synapse.types import UserID, RoomAlias, RoomID
 from synapse.util import Clock
 from synapse.util.distributor import Distributor
 from synapse.util.lockutils import LockManager
+from synapse.util.metrics import Metrics
 from synapse.streams.events import EventSources
 from synapse.api.ratelimiting import Ratelimiter
 
@@ -77,6 +78,7 @@ class BaseHomeServer(object):
         'resource_for_content_repo',
         'event_sources',
         'ratelimiter',
+        'metrics',
     ]
 
     def __init__(self, hostname, **kwargs):
@@ -200,6 +202,9 @@ class HomeServer(BaseHomeServer):
     def build_ratelimiter(self):
         return Ratelimiter()
 
+    def build_metrics(self):
+        return Metrics()
+
     def register_servlets(self):
         """ Register all servlets associated with this HomeServer.
         """
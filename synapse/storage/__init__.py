@@ -28,6 +28,12 @@ from synapse.api.events.room import (
 
 from synapse.util.logutils import log_function
 
+from synapse.util.lrucache import LruCache
+from synapse.util.membershipgraph import MembershipGraph
+from synapse.util.streamchangecache import StreamChangeCache
+
+from ._base import read_only, _event_row_size, MAX_SQL_VARIABLES
+
 from .directory import DirectoryStore
 from .feedback import FeedbackStore
 from .presence import PresenceStore
@@ -61,7 +67,7 @@ SCHEMAS = [
 
 # Remember to update this number every time an incompatible change is made to
 # database schema files, so the users will be informed on server restarts.
-SCHEMA_VERSION = 3
+SCHEMA_VERSION = 4
 
 
 class _RollbackButIsFineException(Exception):
@@ -75,11 +81,90 @@ class DataStore(RoomMemberStore, RoomStore,
                 PresenceStore, PduStore, StatePduStore, TransactionStore,
                 DirectoryStore, KeyStore):
 
-    def __init__(self, hs):
+    def __init__(self, hs, event_cache_size=10000,
+                 event_cache_max_bytes=50 * 1024 * 1024,
+                 persist_batch_window=None, persist_batch_size=50,
+                 stream_change_cache_size=10000,
+                 joined_rooms_cache_size=10000,
+                 room_members_cache_size=10000,
+                 room_members_cache_max_members=500000,
+                 membership_graph=True,
+                 presence_flush_interval=None):
+        """
+        Args:
+            hs: The HomeServer.
+            event_cache_size (int): Maximum number of events to cache.
+            event_cache_max_bytes (int): Rough maximum memory used by the
+                event cache.
+            persist_batch_window (float): If set, persist_event calls made
+                within this many seconds of each other are written in a
+                single transaction.
+            persist_batch_size (int): The most persist_event calls to write
+                in a single transaction.
+            stream_change_cache_size (int): The number of rooms, and of users,
+                to remember the latest stream change for.
+            joined_rooms_cache_size (int): The number of users to cache the
+                joined rooms of.
+            room_members_cache_size (int): The number of rooms to cache the
+                joined members and hosts of.
+            room_members_cache_max_members (int): The most members, summed
+                over all the rooms, to keep in the room members cache.
+            membership_graph (bool): Whether to keep every user's room
+                memberships in memory, to answer which users share rooms.
+            presence_flush_interval (float): If set, presence states are
+                kept in memory and written out in a single transaction every
+                this many seconds, rather than as each one is set.
+        """
         super(DataStore, self).__init__(hs)
         self.event_factory = hs.get_event_factory()
         self.hs = hs
 
+        self._event_cache = LruCache(
+            max_entries=event_cache_size,
+            max_size=event_cache_max_bytes,
+        )
+        hs.get_metrics().register("event_cache", self._event_cache.get_stats)
+
+        self._persist_batch_window = persist_batch_window
+        self._persist_batch_size = persist_batch_size
+        self._persist_queue = []
+        self._persist_timer = None
+
+        self._presence_flush_interval = presence_flush_interval
+
+        self._room_stream_changes = StreamChangeCache(
+            stream_change_cache_size
+        )
+        self._membership_stream_changes = StreamChangeCache(
+            stream_change_cache_size
+        )
+        hs.get_metrics().register(
+            "room_stream_changes", self._room_stream_changes.get_stats
+        )
+        self._init_stream_change_caches()
+
+        self._joined_rooms_cache = LruCache(
+            max_entries=joined_rooms_cache_size
+        )
+        hs.get_metrics().register(
+            "joined_rooms_cache", self._joined_rooms_cache.get_stats
+        )
+
+        self._room_members_cache = LruCache(
+            max_entries=room_members_cache_size,
+            max_size=room_members_cache_max_members,
+        )
+        hs.get_metrics().register(
+            "room_members_cache", self._room_members_cache.get_stats
+        )
+
+        if membership_graph:
+            self._membership_graph = MembershipGraph()
+            hs.get_metrics().register(
+                "membership_graph", self._membership_graph.get_stats
+            )
+            self._load_membership_graph()
+
         self.min_token_deferred = self._get_min_token()
         self.min_token = None
 
@@ -94,20 +179,100 @@ class DataStore(RoomMemberStore, RoomStore,
             self.min_token -= 1
             stream_ordering = self.min_token
 
+        kwargs = dict(
+            pdu=pdu,
+            event=event,
+            backfilled=backfilled,
+            stream_ordering=stream_ordering,
+            is_new_state=is_new_state,
+        )
+
         try:
-            yield self.runInteraction(
-                self._persist_pdu_event_txn,
-                pdu=pdu,
-                event=event,
-                backfilled=backfilled,
-                stream_ordering=stream_ordering,
-                is_new_state=is_new_state,
-            )
+            if self._persist_batch_window:
+                yield self._queue_persist(kwargs)
+            else:
+                yield self.runInteraction(
+                    self._persist_pdu_event_txn, **kwargs
+                )
         except _RollbackButIsFineException as e:
             pass
 
+    def _queue_persist(self, kwargs):
+        """ Queues up a call to _persist_pdu_event_txn to be written along
+        with any others that arrive within the batch window.
+
+        Returns:
+            Deferred: Fires once the event has been committed.
+        """
+        d = defer.Deferred()
+        self._persist_queue.append((kwargs, d))
+
+        if len(self._persist_queue) >= self._persist_batch_size:
+            self.flush_persist_queue()
+        elif not self._persist_timer:
+            def flush():
+                self._persist_timer = None
+                self.flush_persist_queue()
+
+            self._persist_timer = self._clock.call_later(
+                self._persist_batch_window, flush
+            )
+
+        return d
+
+    def flush_persist_queue(self):
+        """ Writes out every queued event now, rather than waiting for the
+        batch window to end.
+
+        Returns:
+            Deferred: Fires once they have all been written or have failed.
+        """
+        if self._persist_timer:
+            self._clock.cancel_call_later(self._persist_timer)
+            self._persist_timer = None
+
+        batch, self._persist_queue = self._persist_queue, []
+
+        if not batch:
+            return defer.succeed(None)
+
+        def persist_batch_txn(txn):
+            for kwargs, _ in batch:
+                self._persist_pdu_event_txn(txn, **kwargs)
+
+        def on_success(_):
+            for _, d in batch:
+                d.callback(None)
+
+        def on_failure(f):
+            # Something in the batch failed, which rolled back the whole
+            # transaction. That is usually just a duplicate event, so replay
+            # each event in its own transaction so that only the ones that
+            # actually failed see the failure.
+            logger.debug(
+                "Batch of %d events failed, persisting individually: %s",
+                len(batch), f.getErrorMessage(),
+            )
+            replays = []
+            for kwargs, d in batch:
+                replay = self.runInteraction(
+                    self._persist_pdu_event_txn, **kwargs
+                )
+                replay.chainDeferred(d)
+                replays.append(replay)
+
+            return defer.DeferredList(replays)
+
+        return self.runInteraction(persist_batch_txn).addCallbacks(
+            on_success, on_failure
+        )
+
     @defer.inlineCallbacks
     def get_event(self, event_id, allow_none=False):
+        event = self._event_cache.get(event_id)
+        if event is not None:
+            defer.returnValue(event)
+
         events_dict = yield self._simple_select_one(
             "events",
             {"event_id": event_id},
@@ -116,7 +281,8 @@ class DataStore(RoomMemberStore, RoomStore,
                 "type",
                 "room_id",
                 "content",
-                "unrecognized_keys"
+                "unrecognized_keys",
+                "outlier",
             ],
             allow_none=allow_none,
         )
@@ -124,7 +290,11 @@ class DataStore(RoomMemberStore, RoomStore,
         if not events_dict:
             defer.returnValue(None)
 
-        event = self._parse_event_from_row(events_dict)
+        # We've already missed the cache, so don't look in it again.
+        event = self._decode_event_row(events_dict)
+        self._event_cache.set(
+            event_id, event, size=_event_row_size(events_dict)
+        )
         defer.returnValue(event)
 
     def _persist_pdu_event_txn(self, txn, pdu=None, event=None,
@@ -139,7 +309,7 @@ class DataStore(RoomMemberStore, RoomStore,
             )
 
     def _persist_event_pdu_txn(self, txn, pdu):
-        cols = dict(pdu.__dict__)
+        cols = pdu.get_full_dict()
         unrec_keys = dict(pdu.unrecognized_keys)
         del cols["content"]
         del cols["prev_pdus"]
@@ -200,15 +370,16 @@ class DataStore(RoomMemberStore, RoomStore,
         else:
             vals["outlier"] = False
 
+        full_dict = event.get_full_dict()
         unrec = {
             k: v
-            for k, v in event.get_full_dict().items()
+            for k, v in full_dict.items()
             if k not in vals.keys()
         }
         vals["unrecognized_keys"] = json.dumps(unrec)
 
         try:
-            self._simple_insert_txn(txn, "events", vals)
+            stream_ordering = self._simple_insert_txn(txn, "events", vals)
         except:
             logger.warn(
                 "Failed to persist, probably duplicate: %s",
@@ -217,6 +388,21 @@ class DataStore(RoomMemberStore, RoomStore,
             )
             raise _RollbackButIsFineException("_persist_event")
 
+        # The event we were given may still be changed by the caller, so
+        # cache the event as it will be read back from the database instead.
+        txn.call_after(
+            self._event_cache.set,
+            event.event_id,
+            self._decode_event_row(
+                vals,
+                content=full_dict["content"],
+                unrecognized_keys=unrec,
+            ),
+            size=_event_row_size(vals),
+        )
+
+        self._stream_changed_txn(txn, event, stream_ordering)
+
         if is_new_state and hasattr(event, "state_key"):
             vals = {
                 "event_id": event.event_id,
@@ -241,6 +427,11 @@ class DataStore(RoomMemberStore, RoomStore,
                 }
             )
 
+            # Backfilled events, and those that lost state resolution, don't
+            # change who is in the room now.
+            if event.type == RoomMemberEvent.TYPE and not backfilled:
+                self._current_membership_changed_txn(txn, event)
+
     @defer.inlineCallbacks
     def get_current_state(self, room_id, event_type=None, state_key=""):
         sql = (
@@ -261,6 +452,42 @@ class DataStore(RoomMemberStore, RoomStore,
         events = yield self._parse_events(results)
         defer.returnValue(events)
 
+    def get_current_state_for_rooms(self, room_ids):
+        """ Get the current state of many rooms in one interaction.
+
+        Args:
+            room_ids (list): The rooms to get the state of.
+        Returns:
+            Deferred: Results in a dict of room_id to the list of current
+            state events for the room.
+        """
+        return self.runInteraction(
+            self._get_current_state_for_rooms_txn, room_ids
+        )
+
+    @read_only
+    def _get_current_state_for_rooms_txn(self, txn, room_ids):
+        room_ids = list(room_ids)
+        rows = []
+        for i in range(0, len(room_ids), MAX_SQL_VARIABLES):
+            chunk = room_ids[i:i + MAX_SQL_VARIABLES]
+            sql = (
+                "SELECT e.* FROM events as e "
+                "INNER JOIN current_state_events as c "
+                "ON e.event_id = c.event_id "
+                "INNER JOIN state_events as s ON e.event_id = s.event_id "
+                "WHERE c.room_id IN (%s)"
+            ) % (", ".join("?" for _ in chunk),)
+
+            txn.execute(sql, chunk)
+            rows.extend(self.cursor_to_rows(txn))
+
+        results = {room_id: [] for room_id in room_ids}
+        for event in self._parse_events_txn(txn, rows):
+            results[event.room_id].append(event)
+
+        return results
+
     @defer.inlineCallbacks
     def _get_min_token(self):
         row = yield self._execute(
@@ -285,6 +512,7 @@ class DataStore(RoomMemberStore, RoomStore,
         Returns:
             synapse.storage.Snapshot: A snapshot of the state of the room.
         """
+        @read_only
         def _snapshot(txn):
             membership_state = self._get_room_member(txn, user_id, room_id)
             prev_pdus = self._get_latest_pdus_in_context(
@@ -18,28 +18,232 @@ from twisted.internet import defer
 
 from synapse.api.errors import StoreError
 from synapse.util.logutils import log_function
+from synapse.util.frozenutils import freeze
+from synapse.util.metrics import LatencyHistogram
 
 import collections
-import copy
+import functools
 import json
+import re
+import sqlite3
+import sys
+import threading
+import time
 
 
 logger = logging.getLogger(__name__)
 
 sql_logger = logging.getLogger("synapse.storage.SQL")
 
+# sqlite won't accept more than 999 bound variables in a single statement,
+# so anything using long "IN (...)" lists has to be split up.
+MAX_SQL_VARIABLES = 500
+
+
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL_RE = re.compile(r"\b\d+\b")
+_PARAM_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+_fingerprint_cache = {}
+
+
+def fingerprint_sql(sql):
+    """ Normalises an SQL statement so that statements which only differ in
+    their literal values, or in the number of parameters in an IN (...) list,
+    map to the same string.
+    """
+    fingerprint = _fingerprint_cache.get(sql)
+    if fingerprint is None:
+        fingerprint = _WHITESPACE_RE.sub(" ", sql).strip()
+        fingerprint = _STRING_LITERAL_RE.sub("?", fingerprint)
+        fingerprint = _NUMBER_LITERAL_RE.sub("?", fingerprint)
+        fingerprint = _PARAM_LIST_RE.sub("(...)", fingerprint)
+
+        # Nearly all of our SQL is made up of a fixed set of strings, but
+        # don't let anything that isn't grow this without bound.
+        if len(_fingerprint_cache) > 5000:
+            _fingerprint_cache.clear()
+        _fingerprint_cache[sql] = fingerprint
+
+    return fingerprint
+
+
+def _cached_sql(build):
+    """ Decorates a function which builds an SQL statement from a table name
+    and tuples of column names, so that each statement is only built once.
+
+    The set of statements built this way is small and fixed, so the cache
+    isn't bounded.
+    """
+    cache = {}
+
+    @functools.wraps(build)
+    def get(*args):
+        sql = cache.get(args)
+        if sql is None:
+            sql = build(*args)
+            cache[args] = sql
+        return sql
+
+    return get
+
+
+def _where_clause(keys):
+    return " AND ".join("%s = ?" % (k,) for k in keys)
+
+
+@_cached_sql
+def _insert_sql(table, keys, or_replace):
+    return "%s INTO %s (%s) VALUES(%s)" % (
+        ("INSERT OR REPLACE" if or_replace else "INSERT"),
+        table,
+        ", ".join(keys),
+        ", ".join("?" for _ in keys)
+    )
+
+
+@_cached_sql
+def _select_sql(table, retcols, keys):
+    return "SELECT %s FROM %s WHERE %s" % (
+        ", ".join(retcols),
+        table,
+        _where_clause(keys),
+    )
+
+
+@_cached_sql
+def _update_sql(table, updatekeys, keys):
+    return "UPDATE %s SET %s WHERE %s" % (
+        table,
+        ", ".join("%s = ?" % (k,) for k in updatekeys),
+        _where_clause(keys),
+    )
+
+
+@_cached_sql
+def _delete_sql(table, keys):
+    return "DELETE FROM %s WHERE %s" % (
+        table,
+        _where_clause(keys),
+    )
+
+
+def _sqlite_cursor(cursor):
+    """ Finds the sqlite3 cursor underneath the given transaction, looking
+    through any LoggingTransaction and adbapi Transaction wrapping it. Returns
+    None if it isn't a sqlite3 cursor.
+    """
+    if isinstance(cursor, LoggingTransaction):
+        cursor = object.__getattribute__(cursor, "txn")
+
+    # adbapi's Transaction keeps the real cursor in _cursor
+    cursor = getattr(cursor, "_cursor", cursor)
+
+    if isinstance(cursor, sqlite3.Cursor):
+        return cursor
+    return None
+
+
+def _get_interaction_caller():
+    """ Returns the name of the first function up the stack that lives
+    outside of this module, i.e. the store method that started the current
+    interaction rather than one of the generic helpers below.
+    """
+    f = sys._getframe(1)
+    this_file = f.f_code.co_filename
+    while f is not None and f.f_code.co_filename == this_file:
+        f = f.f_back
+
+    if f is None:
+        return "unknown"
+    return f.f_code.co_name
+
+
+def read_only(func):
+    """ Marks a function given to runInteraction as one that never writes to
+    the database, so may be run on one of the reader connections.
+    """
+    func.read_only = True
+    return func
+
+
+class SQLStats(object):
+    """ Keeps timing statistics for every statement and interaction that goes
+    through a SQLBaseStore.
+
+    Statements are aggregated by their fingerprint (see `fingerprint_sql`),
+    interactions by the name of the store method that started them. Any
+    statement taking longer than `slow_statement_secs` gets logged along with
+    its caller.
+
+    This is updated from the database thread(s), so is guarded by a lock.
+    """
+
+    slow_statement_secs = 0.5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.statements = {}
+            self.interactions = {}
+            self.queue_wait = LatencyHistogram()
+
+    def record_statement(self, sql, duration, caller):
+        fingerprint = fingerprint_sql(sql)
+
+        with self._lock:
+            hist = self.statements.get(fingerprint)
+            if hist is None:
+                hist = self.statements[fingerprint] = LatencyHistogram()
+            hist.add(duration)
+
+        if duration > self.slow_statement_secs:
+            sql_logger.warn(
+                "[SQL] Slow statement in %s took %.3fs: %s",
+                caller, duration, fingerprint,
+            )
+
+    def record_interaction(self, caller, duration, queue_wait):
+        with self._lock:
+            hist = self.interactions.get(caller)
+            if hist is None:
+                hist = self.interactions[caller] = LatencyHistogram()
+            hist.add(duration)
+            self.queue_wait.add(queue_wait)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "statements": {
+                    k: v.get_stats() for k, v in self.statements.items()
+                },
+                "interactions": {
+                    k: v.get_stats() for k, v in self.interactions.items()
+                },
+                "queue_wait": self.queue_wait.get_stats(),
+            }
+
 
 class LoggingTransaction(object):
     """An object that almost-transparently proxies for the 'txn' object
-    passed to the constructor. Adds logging to the .execute() method."""
-    __slots__ = ["txn"]
+    passed to the constructor. Adds logging and timing to the .execute()
+    method, and lets callers queue up work to do once the transaction has
+    been committed with .call_after()."""
+    __slots__ = ["txn", "name", "stats", "after_callbacks"]
 
-    def __init__(self, txn):
+    def __init__(self, txn, name, stats, after_callbacks=None):
         object.__setattr__(self, "txn", txn)
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "stats", stats)
+        object.__setattr__(self, "after_callbacks", after_callbacks)
 
     def __getattribute__(self, name):
-        if name == "execute":
-            return object.__getattribute__(self, "execute")
+        if name in ("execute", "executemany", "call_after"):
+            return object.__getattribute__(self, name)
 
         return getattr(object.__getattribute__(self, "txn"), name)
 
@@ -58,27 +262,98 @@ class LoggingTransaction(object):
             # Don't let logging failures stop SQL from working
             pass
 
-        # TODO(paul): Here would be an excellent place to put some timing
-        #   measurements, and log (warning?) slow queries.
-        return object.__getattribute__(self, "txn").execute(
-            sql, *args, **kwargs
+        start = time.time()
+        try:
+            return object.__getattribute__(self, "txn").execute(
+                sql, *args, **kwargs
+            )
+        finally:
+            object.__getattribute__(self, "stats").record_statement(
+                sql,
+                time.time() - start,
+                object.__getattribute__(self, "name"),
+            )
+
+    def executemany(self, sql, *args, **kwargs):
+        sql_logger.debug("[SQL] %s", sql)
+
+        start = time.time()
+        try:
+            return object.__getattribute__(self, "txn").executemany(
+                sql, *args, **kwargs
+            )
+        finally:
+            object.__getattribute__(self, "stats").record_statement(
+                sql,
+                time.time() - start,
+                object.__getattribute__(self, "name"),
+            )
+
+    def call_after(self, callback, *args, **kwargs):
+        """Call the given callback on the reactor thread once the transaction
+        has been successfully committed. Nothing is called if the transaction
+        fails.
+        """
+        object.__getattribute__(self, "after_callbacks").append(
+            (callback, args, kwargs)
         )
 
 
 class SQLBaseStore(object):
 
+    # An LruCache of event_id to parsed event, if the store has one.
+    _event_cache = None
+
     def __init__(self, hs):
         self.hs = hs
         self._db_pool = hs.get_db_pool()
         self.event_factory = hs.get_event_factory()
         self._clock = hs.get_clock()
 
+        self._sql_stats = SQLStats()
+        hs.get_metrics().register("sql", self._sql_stats.get_stats)
+
     def runInteraction(self, func, *args, **kwargs):
-        """Wraps the .runInteraction() method on the underlying db_pool."""
+        """Wraps the .runInteraction() method on the underlying db_pool.
+
+        If `func` has been marked with `read_only` and the db_pool supports
+        it, the interaction is run on a reader connection rather than the
+        writer.
+        """
+        caller = _get_interaction_caller()
+        queued = time.time()
+        after_callbacks = []
+
         def inner_func(txn, *args, **kwargs):
-            return func(LoggingTransaction(txn), *args, **kwargs)
+            start = time.time()
+            try:
+                return func(
+                    LoggingTransaction(
+                        txn, caller, self._sql_stats, after_callbacks
+                    ),
+                    *args, **kwargs
+                )
+            finally:
+                self._sql_stats.record_interaction(
+                    caller, time.time() - start, start - queued
+                )
+
+        if getattr(func, "read_only", False):
+            run = getattr(
+                self._db_pool, "runReadInteraction",
+                self._db_pool.runInteraction
+            )
+        else:
+            run = self._db_pool.runInteraction
+
+        def run_after_callbacks(result):
+            for callback, args, kwargs in after_callbacks:
+                callback(*args, **kwargs)
+            return result
 
-        return self._db_pool.runInteraction(inner_func, *args, **kwargs)
+        d = run(inner_func, *args, **kwargs)
+        d.addCallback(run_after_callbacks)
+        return d
 
     def cursor_to_dict(self, cursor):
         """Converts a SQL cursor into an list of dicts.
@@ -94,6 +369,31 @@ class SQLBaseStore(object):
         )
         return results
 
+    def cursor_to_rows(self, cursor):
+        """Converts a SQL cursor into a list of rows which can be indexed by
+        column name, like the dicts returned by cursor_to_dict.
+
+        The rows are read-only, and only support `row[column]` and `keys()`,
+        but are built by sqlite itself so are a lot cheaper to make. Falls
+        back to cursor_to_dict if the cursor isn't a sqlite3 one.
+
+        Args:
+            cursor : The DBAPI cursor which has executed a query.
+        Returns:
+            A list of sqlite3.Row
+        """
+        sqlite_cursor = _sqlite_cursor(cursor)
+        if sqlite_cursor is None:
+            return self.cursor_to_dict(cursor)
+
+        # The cursor gets reused for the rest of the transaction, so put
+        # it back how we found it.
+        sqlite_cursor.row_factory = sqlite3.Row
+        try:
+            return sqlite_cursor.fetchall()
+        finally:
+            sqlite_cursor.row_factory = None
+
     def _execute(self, decoder, query, *args):
         """Runs a single query for a result set.
 
@@ -105,6 +405,7 @@ class SQLBaseStore(object):
         Returns:
             The result of decoder(results)
         """
+        @read_only
         def interaction(txn):
             cursor = txn.execute(query, args)
             if decoder:
@@ -115,7 +416,7 @@ class SQLBaseStore(object):
         return self.runInteraction(interaction)
 
     def _execute_and_decode(self, query, *args):
-        return self._execute(self.cursor_to_dict, query, *args)
+        return self._execute(self.cursor_to_rows, query, *args)
 
     # "Simple" SQL API methods that operate on a single table with no JOINs,
     # no complex WHERE clauses, just a dict of values for columns.
@@ -134,21 +435,36 @@ class SQLBaseStore(object):
 
     @log_function
     def _simple_insert_txn(self, txn, table, values, or_replace=False):
-        sql = "%s INTO %s (%s) VALUES(%s)" % (
-            ("INSERT OR REPLACE" if or_replace else "INSERT"),
-            table,
-            ", ".join(k for k in values),
-            ", ".join("?" for k in values)
-        )
+        sql = _insert_sql(table, tuple(values), or_replace)
 
         logger.debug(
-            "[SQL] %s  Args=%s Func=%s",
+            "[SQL] %s  Args=%s",
             sql, values.values(),
         )
 
         txn.execute(sql, values.values())
         return txn.lastrowid
 
+    def _simple_insert_many_txn(self, txn, table, values, or_replace=False):
+        """Inserts several rows into the named table with a single
+        executemany.
+
+        Args:
+            table : string giving the table name
+            values : list of dicts of column names to values, one per row.
+                Every dict must have the same set of columns.
+            or_replace : bool; if True performs an INSERT OR REPLACE
+        """
+        if not values:
+            return
+
+        keys = tuple(values[0])
+        sql = _insert_sql(table, keys, or_replace)
+
+        logger.debug("[SQL] %s  Rows=%d", sql, len(values))
+
+        txn.executemany(sql, [[row[k] for k in keys] for row in values])
+
     def _simple_select_one(self, table, keyvalues, retcols,
                            allow_none=False):
         """Executes a SELECT query on the named table, which is expected to
@@ -202,12 +518,9 @@ class SQLBaseStore(object):
         Returns:
             Deferred: Results in a list
         """
-        sql = "SELECT %(retcol)s FROM %(table)s WHERE %(where)s" % {
-            "retcol": retcol,
-            "table": table,
-            "where": " AND ".join("%s = ?" % k for k in keyvalues.keys()),
-        }
+        sql = _select_sql(table, (retcol,), tuple(keyvalues))
 
+        @read_only
         def func(txn):
             txn.execute(sql, keyvalues.values())
             return txn.fetchall()
@@ -225,12 +538,9 @@ class SQLBaseStore(object):
             keyvalues : dict of column names and values to select the rows with
             retcols : list of strings giving the names of the columns to return
         """
-        sql = "SELECT %s FROM %s WHERE %s" % (
-            ", ".join(retcols),
-            table,
-            " AND ".join("%s = ?" % (k) for k in keyvalues)
-        )
+        sql = _select_sql(table, tuple(retcols), tuple(keyvalues))
 
+        @read_only
         def func(txn):
             txn.execute(sql, keyvalues.values())
             return self.cursor_to_dict(txn)
@@ -263,17 +573,11 @@ class SQLBaseStore(object):
                                  retcols=None, allow_none=False):
         """ Combined SELECT then UPDATE."""
         if retcols:
-            select_sql = "SELECT %s FROM %s WHERE %s" % (
-                ", ".join(retcols),
-                table,
-                " AND ".join("%s = ?" % (k) for k in keyvalues)
-            )
+            select_sql = _select_sql(table, tuple(retcols), tuple(keyvalues))
 
         if updatevalues:
-            update_sql = "UPDATE %s SET %s WHERE %s" % (
-                table,
-                ", ".join("%s = ?" % (k) for k in updatevalues),
-                " AND ".join("%s = ?" % (k) for k in keyvalues)
+            update_sql = _update_sql(
+                table, tuple(updatevalues), tuple(keyvalues)
             )
 
         def func(txn):
@@ -303,6 +607,10 @@ class SQLBaseStore(object):
                     raise StoreError(500, "More than one row matched")
 
             return ret
+
+        if not updatevalues:
+            func = read_only(func)
+
         return self.runInteraction(func)
 
     def _simple_delete_one(self, table, keyvalues):
@@ -313,10 +621,7 @@ class SQLBaseStore(object):
             table : string giving the table name
             keyvalues : dict of column names and values to select the row with
         """
-        sql = "DELETE FROM %s WHERE %s" % (
-            table,
-            " AND ".join("%s = ?" % (k) for k in keyvalues)
-        )
+        sql = _delete_sql(table, tuple(keyvalues))
 
         def func(txn):
             txn.execute(sql, keyvalues.values())
@@ -335,6 +640,7 @@ class SQLBaseStore(object):
         """
         sql = "SELECT MAX(id) AS id FROM %s" % table
 
+        @read_only
         def func(txn):
             txn.execute(sql)
             max_id = self.cursor_to_dict(txn)[0]["id"]
@@ -345,14 +651,43 @@ class SQLBaseStore(object):
         return self.runInteraction(func)
 
     def _parse_event_from_row(self, row_dict):
-        d = copy.deepcopy({k: v for k, v in row_dict.items() if v})
+        if self._event_cache is not None:
+            event = self._event_cache.get(row_dict["event_id"])
+            if event is not None:
+                return event
+
+        event = self._decode_event_row(row_dict)
+
+        if self._event_cache is not None:
+            self._event_cache.set(
+                row_dict["event_id"], event, size=_event_row_size(row_dict)
+            )
+
+        return event
+
+    def _decode_event_row(self, row_dict, content=None,
+                          unrecognized_keys=None):
+        """ Builds an event from a row of the events table. The decoded
+        `content` and `unrecognized_keys` columns can be given if the caller
+        already has them, to save decoding them again.
+        """
+        # The columns are all strings and numbers, so there is nothing here
+        # that needs copying.
+        d = {k: row_dict[k] for k in row_dict.keys() if row_dict[k]}
 
         d.pop("stream_ordering", None)
         d.pop("topological_ordering", None)
         d.pop("processed", None)
 
-        d.update(json.loads(row_dict["unrecognized_keys"]))
-        d["content"] = json.loads(d["content"])
+        if unrecognized_keys is None:
+            unrecognized_keys = json.loads(row_dict["unrecognized_keys"])
+        if content is None:
+            content = json.loads(d["content"])
+
+        # Parsed events get cached and shared, so make sure nothing can
+        # change them underneath everyone else.
+        d.update((k, freeze(v)) for k, v in unrecognized_keys.items())
+        d["content"] = freeze(content)
         del d["unrecognized_keys"]
 
         if "age_ts" not in d:
@@ -367,23 +702,72 @@ class SQLBaseStore(object):
     def _parse_events(self, rows):
         return self.runInteraction(self._parse_events_txn, rows)
 
+    @read_only
     def _parse_events_txn(self, txn, rows):
         events = [self._parse_event_from_row(r) for r in rows]
 
-        sql = "SELECT * FROM events WHERE event_id = ?"
+        # Load the content of the previous state for any state events, all in
+        # one go rather than one query per event.
+        prev_ids = set(
+            ev.prev_state for ev in events
+            if hasattr(ev, "prev_state") and not hasattr(ev, "prev_content")
+        )
 
-        for ev in events:
-           if hasattr(ev, "prev_state"):
-                # Load previous state_content. 
-                # TODO: Should we be pulling this out above?
-                cursor = txn.execute(sql, (ev.prev_state,))
-                prevs = self.cursor_to_dict(cursor)
-                if prevs:
-                    prev = self._parse_event_from_row(prevs[0])
-                    ev.prev_content = prev.content
+        if prev_ids:
+            prevs = self._get_events_txn(txn, prev_ids)
+            for ev in events:
+                if hasattr(ev, "prev_state") and ev.prev_state in prevs:
+                    ev.prev_content = prevs[ev.prev_state].content
 
         return events
 
+    def _get_events_txn(self, txn, event_ids):
+        """ Fetch the given events, from the event cache if possible.
+
+        Args:
+            event_ids (iterable): The event_ids to fetch.
+        Returns:
+            dict: event_id to event, for each of the events that we have.
+        """
+        results = {}
+        missing = []
+        for event_id in event_ids:
+            event = None
+            if self._event_cache is not None:
+                event = self._event_cache.get(event_id)
+
+            if event is not None:
+                results[event_id] = event
+            else:
+                missing.append(event_id)
+
+        for i in range(0, len(missing), MAX_SQL_VARIABLES):
+            chunk = missing[i:i + MAX_SQL_VARIABLES]
+            sql = "SELECT * FROM events WHERE event_id IN (%s)" % (
+                ", ".join("?" for _ in chunk),
+            )
+
+            for row in self.cursor_to_rows(txn.execute(sql, chunk)):
+                event = self._decode_event_row(row)
+                if self._event_cache is not None:
+                    self._event_cache.set(
+                        row["event_id"], event, size=_event_row_size(row)
+                    )
+                results[row["event_id"]] = event
+
+        return results
+
+
+def _event_row_size(row_dict):
+    """ A rough estimate of how much memory the event parsed from the given
+    events row will take up, in bytes. """
+    return (
+        256 +
+        len(row_dict["content"] or "") +
+        len(row_dict["unrecognized_keys"] or "")
+    )
+
+
 class Table(object):
     """ A base class used to store information about a particular table.
     """
@@ -411,17 +795,7 @@ class Table(object):
             str: An SQL statement to select rows from the table with the given
             WHERE clause.
         """
-        if where_clause:
-            return cls._select_where_clause % (
-                ", ".join(cls.fields),
-                cls.table_name,
-                where_clause
-            )
-        else:
-            return cls._select_clause % (
-                ", ".join(cls.fields),
-                cls.table_name,
-            )
+        return _table_select_sql(cls, where_clause)
 
     @classmethod
     def insert_statement(cls):
@@ -467,6 +841,21 @@ class Table(object):
         return ", ".join(to_join)
 
 
+@_cached_sql
+def _table_select_sql(table, where_clause):
+    if where_clause:
+        return table._select_where_clause % (
+            ", ".join(table.fields),
+            table.table_name,
+            where_clause
+        )
+    else:
+        return table._select_clause % (
+            ", ".join(table.fields),
+            table.table_name,
+        )
+
+
 class JoinHelper(object):
     """ Used to help do joins on tables by looking at the tables' fields and
     creating a list of unique fields to use with SELECTs and a namedtuple
@@ -486,6 +875,8 @@ class JoinHelper(object):
 
         self.EntryType = collections.namedtuple("JoinHelperEntry", res)
 
+        self._fields_cache = {}
+
     def get_fields(self, **prefixes):
         """Get a string representing a list of fields for use in SELECT
         statements with the given prefixes applied to each.
@@ -497,6 +888,11 @@ class JoinHelper(object):
                 StateTable="state"
             )
         """
+        cache_key = tuple(sorted(prefixes.items()))
+        fields = self._fields_cache.get(cache_key)
+        if fields is not None:
+            return fields
+
         res = []
         for field in self.EntryType._fields:
             for table in self.tables:
@@ -504,7 +900,9 @@ class JoinHelper(object):
                     res.append("%s.%s" % (prefixes[table.__name__], field))
                     break
 
-        return ", ".join(res)
+        fields = ", ".join(res)
+        self._fields_cache[cache_key] = fields
+        return fields
 
     def decode_results(self, rows):
         return [self.EntryType(*row) for row in rows]
@@ -15,7 +15,7 @@
 
 from twisted.internet import defer
 
-from ._base import SQLBaseStore, Table, JoinHelper
+from ._base import SQLBaseStore, Table, JoinHelper, read_only
 
 from synapse.federation.units import Pdu
 from synapse.util.logutils import log_function
@@ -47,6 +47,7 @@ class PduStore(SQLBaseStore):
             self._get_pdu_tuple, pdu_id, origin
         )
 
+    @read_only
     def _get_pdu_tuple(self, txn, pdu_id, origin):
         res = self._get_pdu_tuples(txn, [(pdu_id, origin)])
         return res[0] if res else None
@@ -100,6 +101,7 @@ class PduStore(SQLBaseStore):
             context
         )
 
+    @read_only
     def _get_current_state_for_context(self, txn, context):
         query = (
             "SELECT pdu_id, origin FROM %s WHERE context = ?"
@@ -156,6 +158,7 @@ class PduStore(SQLBaseStore):
             self._get_all_pdus_from_context, context,
         )
 
+    @read_only
     def _get_all_pdus_from_context(self, txn, context):
         query = (
             "SELECT pdu_id, origin FROM %s "
@@ -183,6 +186,7 @@ class PduStore(SQLBaseStore):
             self._get_backfill, context, pdu_list, limit
         )
 
+    @read_only
     def _get_backfill(self, txn, context, pdu_list, limit):
         logger.debug(
             "backfill: %s, %s, %s",
@@ -244,6 +248,7 @@ class PduStore(SQLBaseStore):
             self._get_min_depth_for_context, context
         )
 
+    @read_only
     def _get_min_depth_for_context(self, txn, context):
         return self._get_min_depth_interaction(txn, context)
 
@@ -407,13 +412,23 @@ class PduStore(SQLBaseStore):
         # FINE THEN. It's probably old.
         return False
 
-    @staticmethod
     @log_function
-    def _handle_prev_pdus(txn, outlier, pdu_id, origin, prev_pdus,
+    def _handle_prev_pdus(self, txn, outlier, pdu_id, origin, prev_pdus,
                           context):
-        txn.executemany(
-            PduEdgesTable.insert_statement(),
-            [(pdu_id, origin, p[0], p[1], context) for p in prev_pdus]
+        self._simple_insert_many_txn(
+            txn,
+            PduEdgesTable.table_name,
+            [
+                {
+                    "pdu_id": pdu_id,
+                    "origin": origin,
+                    "prev_pdu_id": p[0],
+                    "prev_origin": p[1],
+                    "context": context,
+                }
+                for p in prev_pdus
+            ],
+            or_replace=True,
         )
 
         # Update the extremities table if this is not an outlier.
@@ -445,9 +460,14 @@ class PduStore(SQLBaseStore):
 
             # Insert all the prev_pdus as a backwards thing, they'll get
             # deleted in a second if they're incorrect anyway.
-            txn.executemany(
-                PduBackwardExtremitiesTable.insert_statement(),
-                [(i, o, context) for i, o in prev_pdus]
+            self._simple_insert_many_txn(
+                txn,
+                PduBackwardExtremitiesTable.table_name,
+                [
+                    {"pdu_id": i, "origin": o, "context": context}
+                    for i, o in prev_pdus
+                ],
+                or_replace=True,
             )
 
             # Also delete from the backwards extremities table all ones that
@@ -503,6 +523,7 @@ class StatePduStore(SQLBaseStore):
             self._get_unresolved_state_tree, new_state_pdu
         )
 
+    @read_only
     @log_function
     def _get_unresolved_state_tree(self, txn, new_pdu):
         current = self._get_current_interaction(
@@ -699,7 +720,7 @@ class StatePduStore(SQLBaseStore):
                     "qs": ", ".join(["?"] * len(CurrentStateTable.fields))
                 },
                 CurrentStateTable.EntryType(
-                    *(new_pdu.__dict__[k] for k in CurrentStateTable.fields)
+                    *(getattr(new_pdu, k) for k in CurrentStateTable.fields)
                 )
             )
         else:
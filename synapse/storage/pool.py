@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.enterprise import adbapi
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def _open_writer(conn):
+    # WAL lets readers carry on against the last committed state while the
+    # writer has a transaction open, rather than queuing behind it. The
+    # journal mode is persistent, so this only really does anything the
+    # first time it is run against a database.
+    mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()
+    logger.debug("Opened writer connection, journal_mode=%s", mode)
+
+
+def _open_reader(conn):
+    # Catch anything that has been wrongly marked as read only rather than
+    # letting it fight with the writer for the database lock.
+    conn.execute("PRAGMA query_only = ON")
+
+
+class ReadWriteConnectionPool(object):
+    """ A sqlite connection pool made up of a single writer connection and a
+    pool of reader connections.
+
+    Anything going through `runInteraction` is run on the writer, so this can
+    be used anywhere an adbapi.ConnectionPool can. Interactions that are known
+    to only read can instead be given to `runReadInteraction`, which runs them
+    on one of the readers.
+
+    Args:
+        database (str): Path to the sqlite database.
+        readers (int): The maximum number of reader connections. If this is
+            zero, or the database is in memory (and so can't be shared between
+            connections), read interactions are run on the writer too.
+    """
+
+    def __init__(self, database, readers=3):
+        self.writer = adbapi.ConnectionPool(
+            "sqlite3", database,
+            check_same_thread=False,
+            cp_min=1,
+            cp_max=1,
+            cp_openfun=_open_writer,
+        )
+
+        if readers and database != ":memory:":
+            self.readers = adbapi.ConnectionPool(
+                "sqlite3", database,
+                check_same_thread=False,
+                cp_min=1,
+                cp_max=readers,
+                cp_openfun=_open_reader,
+            )
+        else:
+            self.readers = self.writer
+
+    def runInteraction(self, interaction, *args, **kwargs):
+        return self.writer.runInteraction(interaction, *args, **kwargs)
+
+    def runReadInteraction(self, interaction, *args, **kwargs):
+        return self.readers.runInteraction(interaction, *args, **kwargs)
+
+    def runWithConnection(self, func, *args, **kwargs):
+        return self.writer.runWithConnection(func, *args, **kwargs)
+
+    def close(self):
+        if self.readers is not self.writer:
+            self.readers.close()
+        self.writer.close()
@@ -13,10 +13,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from twisted.internet import defer
+
+from synapse.api.errors import StoreError
+
 from ._base import SQLBaseStore
 
+import logging
+
+logger = logging.getLogger(__name__)
+
 
 class PresenceStore(SQLBaseStore):
+
+    # If set, presence states are kept in memory and written out every this
+    # many seconds, rather than each one being written as it is set. Set up
+    # by the DataStore.
+    _presence_flush_interval = None
+
+    # user_localpart -> (state, status_msg, mtime) for every presence state
+    # not yet written to the database.
+    _presence_pending = None
+    _presence_flush_timer = None
+
+    # As above, for states being written by a flush that hasn't committed
+    # yet. They are still read from here until it has.
+    _presence_flushing = None
+
     def create_presence(self, user_localpart):
         return self._simple_insert(
             table="presence",
@@ -31,7 +54,19 @@ class PresenceStore(SQLBaseStore):
             allow_none=True,
         )
 
+    def _get_unflushed_presence(self, user_localpart):
+        for rows in (self._presence_pending, self._presence_flushing):
+            if rows and user_localpart in rows:
+                return rows[user_localpart]
+        return None
+
     def get_presence_state(self, user_localpart):
+        unflushed = self._get_unflushed_presence(user_localpart)
+        if unflushed is not None:
+            return defer.succeed(
+                dict(zip(("state", "status_msg", "mtime"), unflushed))
+            )
+
         return self._simple_select_one(
             table="presence",
             keyvalues={"user_id": user_localpart},
@@ -39,6 +74,9 @@ class PresenceStore(SQLBaseStore):
         )
 
     def set_presence_state(self, user_localpart, new_state):
+        if self._presence_flush_interval:
+            return self._queue_presence_state(user_localpart, new_state)
+
         return self._simple_update_one(
             table="presence",
             keyvalues={"user_id": user_localpart},
@@ -48,6 +86,117 @@ class PresenceStore(SQLBaseStore):
             retcols=["state"],
         )
 
+    @defer.inlineCallbacks
+    def _queue_presence_state(self, user_localpart, new_state):
+        # The batched UPDATE can't tell us about unknown users, so check for
+        # them here, unless they already have a state waiting to be written.
+        if self._get_unflushed_presence(user_localpart) is None:
+            row = yield self.has_presence_state(user_localpart)
+            if not row:
+                raise StoreError(404, "No row found")
+
+        yield self.set_presence_states([(user_localpart, new_state)])
+
+    def set_presence_states(self, states):
+        """ Sets the presence state of many users in one transaction.
+
+        If there is a flush interval the states are only queued up, to be
+        written along with any others set before the next flush, and the
+        returned deferred fires straight away.
+
+        Unlike set_presence_state, users without a presence row are silently
+        skipped rather than raising.
+
+        Args:
+            states (list): A list of (user_localpart, new_state) pairs, where
+                each new_state is as for set_presence_state.
+        """
+        mtime = self._clock.time_msec()
+        rows = dict(
+            (localpart, (state["state"], state["status_msg"], mtime))
+            for localpart, state in states
+        )
+
+        if not self._presence_flush_interval:
+            return self.runInteraction(self._set_presence_states_txn, rows)
+
+        if self._presence_pending is None:
+            self._presence_pending = {}
+        self._presence_pending.update(rows)
+
+        self._schedule_presence_flush()
+
+        return defer.succeed(None)
+
+    def _schedule_presence_flush(self):
+        if self._presence_flush_timer is not None:
+            return
+
+        def flush():
+            self._presence_flush_timer = None
+            self.flush_presence()
+
+        self._presence_flush_timer = self._clock.call_later(
+            self._presence_flush_interval, flush
+        )
+
+    def flush_presence(self):
+        """ Writes out every queued presence state in one transaction.
+
+        Returns:
+            Deferred: Fires once they have been written.
+        """
+        if self._presence_flush_timer is not None:
+            self._clock.cancel_call_later(self._presence_flush_timer)
+            self._presence_flush_timer = None
+
+        rows = self._presence_pending
+        self._presence_pending = None
+
+        if not rows:
+            return defer.succeed(None)
+
+        if self._presence_flushing is None:
+            self._presence_flushing = {}
+        self._presence_flushing.update(rows)
+
+        def on_failure(f):
+            logger.error(
+                "Failed to write %d presence states: %s",
+                len(rows), f.getErrorMessage(),
+            )
+
+            # Try again with the next flush, unless they've been replaced
+            # since.
+            if self._presence_pending is None:
+                self._presence_pending = {}
+            for localpart, row in rows.items():
+                self._presence_pending.setdefault(localpart, row)
+
+            self._schedule_presence_flush()
+
+        def finished(result):
+            # Leave anything a later flush has taken over since.
+            for localpart, row in rows.items():
+                if self._presence_flushing.get(localpart) is row:
+                    del self._presence_flushing[localpart]
+            return result
+
+        d = self.runInteraction(self._set_presence_states_txn, rows)
+        d.addErrback(on_failure)
+        d.addBoth(finished)
+        return d
+
+    def _set_presence_states_txn(self, txn, rows):
+        txn.executemany(
+            "UPDATE presence SET state = ?, status_msg = ?, mtime = ?"
+            " WHERE user_id = ?",
+            [
+                (state, status_msg, mtime, localpart)
+                for localpart, (state, status_msg, mtime) in rows.items()
+            ]
+        )
+
     def allow_presence_visible(self, observed_localpart, observer_userid):
         return self._simple_insert(
             table="presence_allow_inbound",
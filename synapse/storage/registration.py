@@ -19,7 +19,7 @@ from sqlite3 import IntegrityError
 
 from synapse.api.errors import StoreError, Codes
 
-from ._base import SQLBaseStore
+from ._base import SQLBaseStore, read_only
 
 
 class RegistrationStore(SQLBaseStore):
@@ -103,6 +103,7 @@ class RegistrationStore(SQLBaseStore):
                                                      token)
         defer.returnValue(user_id)
 
+    @read_only
     def _query_for_auth(self, txn, token):
         txn.execute("SELECT users.name FROM access_tokens LEFT JOIN users" +
                     " ON users.id = access_tokens.user_id WHERE token = ?",
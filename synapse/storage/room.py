@@ -19,7 +19,7 @@ from sqlite3 import IntegrityError
 
 from synapse.api.errors import StoreError
 
-from ._base import SQLBaseStore, Table
+from ._base import SQLBaseStore, Table, read_only
 
 import collections
 import logging
@@ -154,6 +154,7 @@ class RoomStore(SQLBaseStore):
             room_id, user_id,
         )
 
+    @read_only
     def _get_power_level(self, txn, room_id, user_id):
         sql = (
             "SELECT level FROM room_power_levels as r "
@@ -187,6 +188,7 @@ class RoomStore(SQLBaseStore):
             room_id,
         )
 
+    @read_only
     def _get_ops_levels(self, txn, room_id):
         sql = (
             "SELECT ban_level, kick_level FROM room_ops_levels as r "
@@ -258,28 +260,31 @@ class RoomStore(SQLBaseStore):
         )
 
     def _store_power_levels(self, txn, event):
-        for user_id, level in event.content.items():
-            if user_id == "default":
-                self._simple_insert_txn(
-                    txn,
-                    "room_default_levels",
-                    {
-                        "event_id": event.event_id,
-                        "room_id": event.room_id,
-                        "level": level,
-                    },
-                )
-            else:
-                self._simple_insert_txn(
-                    txn,
-                    "room_power_levels",
-                    {
-                        "event_id": event.event_id,
-                        "room_id": event.room_id,
-                        "user_id": user_id,
-                        "level": level
-                    },
-                )
+        if "default" in event.content:
+            self._simple_insert_txn(
+                txn,
+                "room_default_levels",
+                {
+                    "event_id": event.event_id,
+                    "room_id": event.room_id,
+                    "level": event.content["default"],
+                },
+            )
+
+        self._simple_insert_many_txn(
+            txn,
+            "room_power_levels",
+            [
+                {
+                    "event_id": event.event_id,
+                    "room_id": event.room_id,
+                    "user_id": user_id,
+                    "level": level
+                }
+                for user_id, level in event.content.items()
+                if user_id != "default"
+            ],
+        )
 
     def _store_default_level(self, txn, event):
         self._simple_insert_txn(
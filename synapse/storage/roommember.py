@@ -15,24 +15,46 @@
 
 from twisted.internet import defer
 
-from ._base import SQLBaseStore
+from ._base import SQLBaseStore, read_only
 
 from synapse.api.constants import Membership
 from synapse.util.logutils import log_function
 
+from collections import namedtuple
+
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# The users joined to a room, and the hosts they are on.
+_JoinedMembers = namedtuple("_JoinedMembers", ("user_ids", "hosts"))
+
+
 class RoomMemberStore(SQLBaseStore):
 
+    # user_id -> frozenset of the IDs of the rooms the user is joined to.
+    # Set up by the DataStore.
+    _joined_rooms_cache = None
+
+    # room_id -> _JoinedMembers. Set up by the DataStore.
+    _room_members_cache = None
+
+    # Bumped every time the membership caches are invalidated, so that
+    # lookups that were already running at the time don't put stale results
+    # back in them.
+    _membership_cache_sequence = 0
+
+    # A MembershipGraph of who is joined to which rooms. Set up by the
+    # DataStore.
+    _membership_graph = None
+
     def _store_room_member_txn(self, txn, event):
         """Store a room member in the database.
         """
         try:
             target_user_id = event.state_key
-            domain = self.hs.parse_userid(target_user_id).domain
+            self.hs.parse_userid(target_user_id)
         except:
             logger.exception("Failed to parse target_user_id=%s", target_user_id)
             raise
@@ -55,37 +77,20 @@ class RoomMemberStore(SQLBaseStore):
             }
         )
 
-        # Update room hosts table
-        if event.membership == Membership.JOIN:
-            sql = (
-                "INSERT OR IGNORE INTO room_hosts (room_id, host) "
-                "VALUES (?, ?)"
-            )
-            txn.execute(sql, (event.room_id, domain))
-        elif event.membership != Membership.INVITE:
-            # Check if this was the last person to have left.
-            member_events = self._get_members_query_txn(
-                txn,
-                where_clause="c.room_id = ? AND m.membership = ? AND m.user_id != ?",
-                where_values=(event.room_id, Membership.JOIN, target_user_id,)
-            )
-
-            joined_domains = set()
-            for e in member_events:
-                try:
-                    joined_domains.add(
-                        self.hs.parse_userid(e.state_key).domain
-                    )
-                except:
-                    # FIXME: How do we deal with invalid user ids in the db?
-                    logger.exception("Invalid user_id: %s", event.state_key)
-
-            if domain not in joined_domains:
-                sql = (
-                    "DELETE FROM room_hosts WHERE room_id = ? AND host = ?"
-                )
+        txn.call_after(
+            self._invalidate_membership_caches, target_user_id, event.room_id
+        )
 
-                txn.execute(sql, (event.room_id, domain))
+    def _current_membership_changed_txn(self, txn, event):
+        """Updates the membership graph for a member event that has become
+        the current state of the room, once the transaction commits.
+        """
+        if self._membership_graph is not None:
+            txn.call_after(
+                self._membership_graph.membership_changed,
+                event.state_key, event.room_id,
+                event.membership == Membership.JOIN,
+            )
 
     @defer.inlineCallbacks
     def get_room_member(self, user_id, room_id):
@@ -115,7 +120,7 @@ class RoomMemberStore(SQLBaseStore):
             " LIMIT 1"
         )
         txn.execute(sql, (user_id, room_id))
-        rows = self.cursor_to_dict(txn)
+        rows = self.cursor_to_rows(txn)
         if rows:
             return self._parse_events_txn(txn, rows)[0]
         else:
@@ -163,24 +168,129 @@ class RoomMemberStore(SQLBaseStore):
 
         return self._get_members_query(where_clause, args)
 
+    def get_rooms_for_user(self, user_id):
+        """ Get the IDs of the rooms the user is currently joined to. Unlike
+        get_rooms_for_user_where_membership_is, this doesn't fetch or parse
+        any events, and the answer is cached until the user's membership of
+        a room next changes.
+
+        Args:
+            user_id (str): The user ID.
+        Returns:
+            Deferred: Results in a frozenset of room IDs.
+        """
+        room_ids = self._joined_rooms_cache.get(user_id)
+        if room_ids is not None:
+            return defer.succeed(room_ids)
+
+        sequence = self._membership_cache_sequence
+
+        def cache_result(room_ids):
+            room_ids = frozenset(room_ids)
+            if sequence == self._membership_cache_sequence:
+                self._joined_rooms_cache.set(user_id, room_ids)
+            return room_ids
+
+        d = self.runInteraction(self._get_rooms_for_user_txn, user_id)
+        d.addCallback(cache_result)
+        return d
+
+    @read_only
+    def _get_rooms_for_user_txn(self, txn, user_id):
+        sql = (
+            "SELECT m.room_id FROM room_memberships as m "
+            "INNER JOIN current_state_events as c "
+            "ON m.event_id = c.event_id "
+            "WHERE m.user_id = ? AND m.membership = ?"
+        )
+
+        txn.execute(sql, (user_id, Membership.JOIN))
+        return [r[0] for r in txn.fetchall()]
+
+    def get_users_in_room(self, room_id):
+        """ Get the IDs of the users currently joined to the room. The answer
+        is cached, along with the room's hosts, until someone's membership of
+        the room next changes.
+
+        Args:
+            room_id (str): The room ID.
+        Returns:
+            Deferred: Results in a frozenset of user IDs.
+        """
+        d = self._get_joined_members(room_id)
+        d.addCallback(lambda members: members.user_ids)
+        return d
+
     def get_joined_hosts_for_room(self, room_id):
-        return self._simple_select_onecol(
-            "room_hosts",
-            {"room_id": room_id},
-            "host"
+        """ Get the hosts of the users currently joined to the room.
+
+        Returns:
+            Deferred: Results in a list of server names.
+        """
+        d = self._get_joined_members(room_id)
+        d.addCallback(lambda members: list(members.hosts))
+        return d
+
+    def _get_joined_members(self, room_id):
+        members = self._room_members_cache.get(room_id)
+        if members is not None:
+            return defer.succeed(members)
+
+        sequence = self._membership_cache_sequence
+
+        def cache_result(user_ids):
+            members = _JoinedMembers(
+                user_ids=frozenset(user_ids),
+                hosts=frozenset(self._hosts_for_users(user_ids)),
+            )
+            if sequence == self._membership_cache_sequence:
+                # Big rooms count for more towards the size of the cache.
+                self._room_members_cache.set(
+                    room_id, members, size=max(1, len(user_ids))
+                )
+            return members
+
+        d = self.runInteraction(self._get_users_in_room_txn, room_id)
+        d.addCallback(cache_result)
+        return d
+
+    @read_only
+    def _get_users_in_room_txn(self, txn, room_id):
+        sql = (
+            "SELECT m.user_id FROM room_memberships as m "
+            "INNER JOIN current_state_events as c "
+            "ON m.event_id = c.event_id "
+            "WHERE m.room_id = ? AND m.membership = ?"
         )
 
+        txn.execute(sql, (room_id, Membership.JOIN))
+        return [r[0] for r in txn.fetchall()]
+
+    def _hosts_for_users(self, user_ids):
+        for user_id in user_ids:
+            try:
+                yield self.hs.parse_userid(user_id).domain
+            except:
+                # FIXME: How do we deal with invalid user ids in the db?
+                logger.exception("Invalid user_id: %s", user_id)
+
+    def _invalidate_membership_caches(self, user_id, room_id):
+        self._membership_cache_sequence += 1
+        self._joined_rooms_cache.pop(user_id)
+        self._room_members_cache.pop(room_id)
+
     def _get_members_by_dict(self, where_dict):
         clause = " AND ".join("%s = ?" % k for k in where_dict.keys())
         vals = where_dict.values()
         return self._get_members_query(clause, vals)
 
     def _get_members_query(self, where_clause, where_values):
-        return self._db_pool.runInteraction(
+        return self.runInteraction(
             self._get_members_query_txn,
             where_clause, where_values
         )
 
+    @read_only
     def _get_members_query_txn(self, txn, where_clause, where_values):
         sql = (
             "SELECT e.* FROM events as e "
@@ -192,16 +302,84 @@ class RoomMemberStore(SQLBaseStore):
         ) % (where_clause,)
 
         txn.execute(sql, where_values)
-        rows = self.cursor_to_dict(txn)
+        rows = self.cursor_to_rows(txn)
 
         results = self._parse_events_txn(txn, rows)
         return results
 
+    def _load_membership_graph(self):
+        """ Loads every current membership into the membership graph. Until
+        this has finished the methods using the graph go to the database.
+        """
+        def loaded(memberships):
+            self._membership_graph.load(memberships)
+            logger.info(
+                "Loaded membership graph: %r",
+                self._membership_graph.get_stats()
+            )
+
+        def failed(failure):
+            logger.error(
+                "Failed to load membership graph: %s",
+                failure.getErrorMessage(),
+            )
+            self._membership_graph.load_failed()
+
+        d = self.runInteraction(self._get_all_joined_memberships_txn)
+        d.addCallbacks(loaded, failed)
+        return d
+
+    def _membership_graph_loaded(self):
+        graph = self._membership_graph
+        return graph is not None and graph.loaded
+
+    @read_only
+    def _get_all_joined_memberships_txn(self, txn):
+        sql = (
+            "SELECT m.user_id, m.room_id FROM room_memberships as m "
+            "INNER JOIN current_state_events as c "
+            "ON m.event_id = c.event_id "
+            "WHERE m.membership = ?"
+        )
+
+        txn.execute(sql, (Membership.JOIN,))
+        return txn.fetchall()
+
+    def get_users_sharing_room_with(self, user_id):
+        """ Get the IDs of the users who share at least one room with the
+        given user, including the user if they are joined to any room.
+
+        Returns:
+            Deferred: Results in a set of user IDs.
+        """
+        if self._membership_graph_loaded():
+            return defer.succeed(
+                self._membership_graph.get_users_sharing_room_with(user_id)
+            )
+
+        return self._get_users_sharing_room_with(user_id)
+
     @defer.inlineCallbacks
+    def _get_users_sharing_room_with(self, user_id):
+        users = set()
+        for room_id in (yield self.get_rooms_for_user(user_id)):
+            users.update((yield self.get_users_in_room(room_id)))
+
+        defer.returnValue(users)
+
     def user_rooms_intersect(self, user_id_list):
         """ Checks whether all the users whose IDs are given in a list share a
         room.
         """
+        if self._membership_graph_loaded():
+            return defer.succeed(
+                self._membership_graph.users_share_room(user_id_list)
+            )
+
+        return self._user_rooms_intersect_query(user_id_list)
+
+    @defer.inlineCallbacks
+    def _user_rooms_intersect_query(self, user_id_list):
         user_list_clause = " OR ".join(["m.user_id = ?"] * len(user_id_list))
         sql = (
             "SELECT m.room_id FROM room_memberships as m "
@@ -0,0 +1,39 @@
+/* Copyright 2014 OpenMarket Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+
+
+CREATE INDEX IF NOT EXISTS events_order_room ON events (room_id, topological_ordering, stream_ordering);
+
+-- Superseded by events_order_room, and otherwise the query planner prefers it
+-- for paginating since it lets it bound stream_ordering, which then needs a
+-- temporary b-tree to sort by topological_ordering.
+DROP INDEX IF EXISTS events_room_id;
+
+CREATE INDEX IF NOT EXISTS room_memberships_user_room ON room_memberships (user_id, room_id);
+CREATE INDEX IF NOT EXISTS room_memberships_room_user ON room_memberships (room_id, user_id);
+
+-- Superseded by the two indexes above, which lead with the same columns.
+DROP INDEX IF EXISTS room_memberships_room_id;
+DROP INDEX IF EXISTS room_memberships_user_id;
+
+CREATE INDEX IF NOT EXISTS state_pdus_key ON state_pdus(context, pdu_type, state_key);
+
+-- Nothing reads this any more: the joined hosts of a room are worked out from
+-- its joined members.
+DROP INDEX IF EXISTS room_hosts_room_id;
+DROP TABLE IF EXISTS room_hosts;
+
+PRAGMA user_version = 4;
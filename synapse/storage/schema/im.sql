@@ -29,7 +29,7 @@ CREATE TABLE IF NOT EXISTS events(
 CREATE INDEX IF NOT EXISTS events_event_id ON events (event_id);
 CREATE INDEX IF NOT EXISTS events_stream_ordering ON events (stream_ordering);
 CREATE INDEX IF NOT EXISTS events_topological_ordering ON events (topological_ordering);
-CREATE INDEX IF NOT EXISTS events_room_id ON events (room_id);
+CREATE INDEX IF NOT EXISTS events_order_room ON events (room_id, topological_ordering, stream_ordering);
 
 CREATE TABLE IF NOT EXISTS state_events(
     event_id TEXT NOT NULL,
@@ -67,8 +67,8 @@ CREATE TABLE IF NOT EXISTS room_memberships(
 );
 
 CREATE INDEX IF NOT EXISTS room_memberships_event_id ON room_memberships (event_id);
-CREATE INDEX IF NOT EXISTS room_memberships_room_id ON room_memberships (room_id);
-CREATE INDEX IF NOT EXISTS room_memberships_user_id ON room_memberships (user_id);
+CREATE INDEX IF NOT EXISTS room_memberships_user_room ON room_memberships (user_id, room_id);
+CREATE INDEX IF NOT EXISTS room_memberships_room_user ON room_memberships (room_id, user_id);
 
 CREATE TABLE IF NOT EXISTS feedback(
     event_id TEXT NOT NULL,
@@ -156,11 +156,3 @@ CREATE TABLE IF NOT EXISTS room_ops_levels(
 CREATE INDEX IF NOT EXISTS room_ops_levels_event_id ON room_ops_levels(event_id);
 CREATE INDEX IF NOT EXISTS room_ops_levels_room_id ON room_ops_levels(room_id);
 
-
-CREATE TABLE IF NOT EXISTS room_hosts(
-    room_id TEXT NOT NULL,
-    host TEXT NOT NULL,
-    CONSTRAINT room_hosts_uniq UNIQUE (room_id, host) ON CONFLICT IGNORE
-);
-
-CREATE INDEX IF NOT EXISTS room_hosts_room_id ON room_hosts (room_id);
@@ -95,6 +95,8 @@ CREATE INDEX IF NOT EXISTS context_depth_context ON context_depth(context);
 
 CREATE INDEX IF NOT EXISTS pdu_id ON pdus(pdu_id, origin);
 
+CREATE INDEX IF NOT EXISTS state_pdus_key ON state_pdus(context, pdu_type, state_key);
+
 CREATE INDEX IF NOT EXISTS dests_id ON pdu_destinations (pdu_id, origin);
 -- CREATE INDEX IF NOT EXISTS dests ON pdu_destinations (destination);
 
@@ -35,8 +35,9 @@ what sort order was used:
 
 from twisted.internet import defer
 
-from ._base import SQLBaseStore
+from ._base import SQLBaseStore, read_only, MAX_SQL_VARIABLES
 from synapse.api.errors import SynapseError
+from synapse.api.events.room import RoomMemberEvent
 from synapse.util.logutils import log_function
 
 import logging
@@ -48,6 +49,13 @@ logger = logging.getLogger(__name__)
 MAX_STREAM_SIZE = 1000
 
 
+# Each room in a get_recent_events_for_rooms query takes three variables.
+_ROOMS_PER_RECENT_EVENTS_QUERY = MAX_SQL_VARIABLES // 3
+
+# Each user in a get_room_events_stream_for_many query takes two variables.
+_USERS_PER_STREAM_QUERY = (MAX_SQL_VARIABLES - 3) // 2
+
+
 _STREAM_TOKEN = "stream"
 _TOPOLOGICAL_TOKEN = "topological"
 
@@ -107,6 +115,128 @@ def _get_token_bound(token, comparison):
 
 
 class StreamStore(SQLBaseStore):
+
+    # StreamChangeCaches of the latest stream_ordering at which each room got
+    # a new event, and at which each user's membership of any room changed.
+    _room_stream_changes = None
+    _membership_stream_changes = None
+
+    # The highest stream_ordering of any committed event. We are the only
+    # writer to the events table, so once it has been read at startup this
+    # is kept up to date by _stream_changed_txn.
+    _max_stream_ordering = None
+    _max_stream_ordering_known = False
+
+    def _init_stream_change_caches(self):
+        """ Finds the current end of the stream, and tells the stream change
+        caches that they will see every change after it. """
+        def set_position(max_key):
+            position = _parse_stream_token(max_key)
+            self._advance_max_stream_ordering(position)
+            self._max_stream_ordering_known = True
+            self._room_stream_changes.set_earliest_known_position(position)
+            self._membership_stream_changes.set_earliest_known_position(
+                position
+            )
+
+        return self.get_room_events_max_id().addCallback(set_position)
+
+    def _advance_max_stream_ordering(self, stream_ordering):
+        if (self._max_stream_ordering is None or
+                stream_ordering > self._max_stream_ordering):
+            self._max_stream_ordering = stream_ordering
+
+    def _stream_changed_txn(self, txn, event, stream_ordering):
+        """ Records the stream change caused by persisting the event, once the
+        transaction has been committed. """
+        txn.call_after(self._advance_max_stream_ordering, stream_ordering)
+
+        if self._room_stream_changes is None:
+            return
+
+        txn.call_after(
+            self._room_stream_changes.entity_has_changed,
+            event.room_id, stream_ordering
+        )
+
+        if event.type == RoomMemberEvent.TYPE:
+            txn.call_after(
+                self._membership_stream_changes.entity_has_changed,
+                event.state_key, stream_ordering
+            )
+
+    def room_events_may_have_changed(self, user_id, from_key, room_ids=None):
+        """ Checks, without going to the database, whether there may be new
+        events in the stream for the user after the given token.
+
+        Args:
+            user_id (str): The user to check for.
+            from_key (str): The stream token to check from.
+            room_ids (set): The rooms the user is in, if known. Otherwise
+                we can only say nothing has changed if no room has.
+        Returns:
+            bool: False if there are definitely no new events.
+        """
+        if self._room_stream_changes is None:
+            return True
+
+        try:
+            from_id = _parse_stream_token(from_key)
+        except SynapseError:
+            return True
+
+        if not self._room_stream_changes.has_any_entity_changed(from_id):
+            return False
+
+        if room_ids is None:
+            return True
+
+        if self._membership_stream_changes.has_entity_changed(
+            user_id, from_id
+        ):
+            return True
+
+        return any(
+            self._room_stream_changes.has_entity_changed(room_id, from_id)
+            for room_id in room_ids
+        )
+
+    def membership_may_have_changed(self, user_id, from_key):
+        """ Checks, without going to the database, whether the user's
+        membership of any room may have changed after the given token.
+        """
+        if self._membership_stream_changes is None:
+            return True
+
+        try:
+            from_id = _parse_stream_token(from_key)
+        except SynapseError:
+            return True
+
+        return self._membership_stream_changes.has_entity_changed(
+            user_id, from_id
+        )
+
+    def get_rooms_changed_since(self, room_ids, from_key):
+        """ Works out, without going to the database, which of the given
+        rooms may have had new events after the given token.
+
+        Returns:
+            set: The IDs of the rooms that may have changed.
+        """
+        if self._room_stream_changes is None:
+            return set(room_ids)
+
+        try:
+            from_id = _parse_stream_token(from_key)
+        except SynapseError:
+            return set(room_ids)
+
+        return set(
+            room_id for room_id in room_ids
+            if self._room_stream_changes.has_entity_changed(room_id, from_id)
+        )
+
     @log_function
     def get_room_events(self, user_id, from_key, to_key, room_id, limit=0,
                         direction='f', with_feedback=False):
@@ -170,6 +300,9 @@ class StreamStore(SQLBaseStore):
             defer.returnValue(([], to_key))
             return
 
+        if not self.room_events_may_have_changed(user_id, from_key):
+            defer.returnValue(([], from_key))
+
         sql = (
             "SELECT * FROM events as e WHERE "
             "((room_id IN (%(current)s)) OR "
@@ -198,6 +331,135 @@ class StreamStore(SQLBaseStore):
 
         defer.returnValue((ret, key))
 
+    @defer.inlineCallbacks
+    @log_function
+    def get_room_events_stream_for_many(self, requests, to_key):
+        """ Like get_room_events_stream, but for several requests at once,
+        each for the events after its own stream token. The new events are
+        fetched from the database once for the requests sharing a token, and
+        then filtered for each request.
+
+        Args:
+            requests (list): (user_id, from_key, limit, is_visible) tuples,
+                where `is_visible` is a function which is given an event and
+                returns whether it should be included in the results for the
+                request. Only events in the user's current rooms, or about
+                their membership, are given to it.
+            to_key (str): The stream token to fetch events up to.
+        Returns:
+            Deferred: A list of (events, end_key), one for each request.
+        """
+        to_id = _parse_stream_token(to_key)
+
+        from_ids = []
+        limits = []
+        for _, from_key, limit, _ in requests:
+            try:
+                from_ids.append(_parse_stream_token(from_key))
+            except SynapseError:
+                logger.debug("Ignoring invalid stream token %r", from_key)
+                from_ids.append(None)
+
+            if limit:
+                limits.append(max(limit, MAX_STREAM_SIZE))
+            else:
+                limits.append(MAX_STREAM_SIZE)
+
+        # Requests from the same token share a query, as many as fit in one.
+        # Requests from different tokens each get their own, as one query
+        # from the oldest token could fill up with events the newer ones
+        # have already seen.
+        indexes_by_from_id = {}
+        for i, from_id in enumerate(from_ids):
+            if from_id is not None and from_id < to_id:
+                indexes_by_from_id.setdefault(from_id, []).append(i)
+
+        groups = []
+        for from_id, indexes in indexes_by_from_id.items():
+            chunk = []
+            chunk_users = set()
+            for i in indexes:
+                user_id = requests[i][0]
+                if (user_id not in chunk_users and
+                        len(chunk_users) >= _USERS_PER_STREAM_QUERY):
+                    groups.append((from_id, chunk, chunk_users))
+                    chunk = []
+                    chunk_users = set()
+
+                chunk.append(i)
+                chunk_users.add(user_id)
+
+            groups.append((from_id, chunk, chunk_users))
+
+        results = [([], from_key) for _, from_key, _, _ in requests]
+        for from_id, indexes, user_ids in groups:
+            fetch_limit = max(limits[i] for i in indexes)
+            rows, fetched_to_key = yield self._get_stream_rows_for_users(
+                user_ids, from_id, to_id, to_key, fetch_limit
+            )
+
+            for i in indexes:
+                _, _, _, is_visible = requests[i]
+
+                ret = []
+                end_key = fetched_to_key
+                for ordering, event in rows:
+                    if not is_visible(event):
+                        continue
+
+                    ret.append(event)
+                    if len(ret) >= limits[i]:
+                        end_key = "s%d" % (ordering,)
+                        break
+
+                results[i] = (ret, end_key)
+
+        defer.returnValue(results)
+
+    @defer.inlineCallbacks
+    def _get_stream_rows_for_users(self, user_ids, from_id, to_id, to_key,
+                                   limit):
+        """ Fetches the events after from_id in the given users' current
+        rooms, or about their membership, e.g. invites.
+
+        Returns:
+            Deferred: A pair of a list of (stream_ordering, event), and the
+            stream token they go up to.
+        """
+        user_ids = list(user_ids)
+        users_sql = ", ".join("?" for _ in user_ids)
+
+        # As for get_room_events_stream, but for all the users at once, so
+        # that events in other rooms don't take up the query's limit.
+        sql = (
+            "SELECT * FROM events WHERE "
+            "(room_id IN ("
+            "SELECT m.room_id FROM room_memberships as m "
+            "INNER JOIN current_state_events as c ON m.event_id = c.event_id "
+            "WHERE m.user_id IN (%(users)s)"
+            ") OR event_id IN ("
+            "SELECT event_id FROM room_memberships "
+            "WHERE user_id IN (%(users)s)"
+            ")) "
+            "AND stream_ordering > ? AND stream_ordering <= ? "
+            "AND outlier = 0 "
+            "ORDER BY stream_ordering ASC LIMIT ?"
+        ) % {"users": users_sql}
+
+        args = user_ids + user_ids + [from_id, to_id, limit]
+        rows = yield self._execute_and_decode(sql, *args)
+        events = yield self._parse_events(rows)
+        orderings = [r["stream_ordering"] for r in rows]
+
+        # If we didn't get everything up to to_key then the requests can
+        # only be told about the events up to the last one we did get.
+        if len(rows) < limit:
+            fetched_to_key = to_key
+        else:
+            fetched_to_key = "s%d" % (orderings[-1],)
+
+        defer.returnValue((zip(orderings, events), fetched_to_key))
+
     @defer.inlineCallbacks
     @log_function
     def paginate_room_events(self, room_id, from_key, to_key=None,
@@ -257,37 +519,95 @@ class StreamStore(SQLBaseStore):
                                    with_feedback=False):
         # TODO (erikj): Handle compressed feedback
 
-        sql = (
+        results = yield self.get_recent_events_for_rooms(
+            [room_id], limit, end_token
+        )
+
+        defer.returnValue(results[room_id])
+
+    def get_recent_events_for_rooms(self, room_ids, limit, end_token):
+        """ Like get_recent_events_for_room, but for many rooms at once. All
+        the rooms are loaded in a single interaction, with one query per
+        `_ROOMS_PER_RECENT_EVENTS_QUERY` rooms.
+
+        Args:
+            room_ids (list): The rooms to get the recent events of.
+            limit (int): The most events to get for each room.
+            end_token (str): The stream token to get the events before.
+        Returns:
+            Deferred: Results in a dict of room_id to (events, token) tuples,
+            where token is the (start, end) pair of stream tokens.
+        """
+        return self.runInteraction(
+            self._get_recent_events_for_rooms_txn, room_ids, limit, end_token
+        )
+
+    @read_only
+    def _get_recent_events_for_rooms_txn(self, txn, room_ids, limit,
+                                         end_token):
+        # Each room gets its own ORDER BY ... LIMIT, which sqlite answers
+        # from the events_order_room index, and the rooms are glued together
+        # with UNION ALL.
+        sub_sql = (
+            "SELECT * FROM ("
             "SELECT * FROM events "
             "WHERE room_id = ? AND stream_ordering <= ? "
-            "ORDER BY topological_ordering DESC, stream_ordering DESC LIMIT ? "
+            "ORDER BY topological_ordering DESC, stream_ordering DESC LIMIT ?"
+            ")"
         )
 
-        rows = yield self._execute_and_decode(
-            sql,
-            room_id, end_token, limit
-        )
+        room_ids = list(room_ids)
+        rows_by_room = {room_id: [] for room_id in room_ids}
+        all_rows = []
+        for i in range(0, len(room_ids), _ROOMS_PER_RECENT_EVENTS_QUERY):
+            chunk = room_ids[i:i + _ROOMS_PER_RECENT_EVENTS_QUERY]
+
+            sql = " UNION ALL ".join(sub_sql for _ in chunk)
+            args = []
+            for room_id in chunk:
+                args.extend((room_id, end_token, limit))
+
+            txn.execute(sql, args)
+            for row in self.cursor_to_rows(txn):
+                rows_by_room[row["room_id"]].append(row)
+                all_rows.append(row)
+
+        # Parse all the events together, so that any previous state they
+        # need is fetched in one go.
+        events_by_id = {
+            e.event_id: e for e in self._parse_events_txn(txn, all_rows)
+        }
 
-        rows.reverse()  # As we selected with reverse ordering
+        results = {}
+        for room_id, rows in rows_by_room.items():
+            # UNION ALL doesn't promise to keep each room's ORDER BY, only
+            # which rows its LIMIT picked.
+            rows.sort(key=lambda r: (
+                r["topological_ordering"], r["stream_ordering"]
+            ))
 
-        if rows:
-            topo = rows[0]["topological_ordering"]
-            toke = rows[0]["stream_ordering"]
-            start_token = "t%s-%s" % (topo, toke)
+            if rows:
+                topo = rows[0]["topological_ordering"]
+                toke = rows[0]["stream_ordering"]
+                start_token = "t%s-%s" % (topo, toke)
 
-            token = (start_token, end_token)
-        else:
-            token = (end_token, end_token)
+                token = (start_token, end_token)
+            else:
+                token = (end_token, end_token)
 
-        events = yield self._parse_events(rows)
+            events = [events_by_id[r["event_id"]] for r in rows]
 
-        ret = (events, token)
+            results[room_id] = (events, token)
 
-        defer.returnValue(ret)
+        return results
 
     def get_room_events_max_id(self):
+        if self._max_stream_ordering_known:
+            return defer.succeed("s%d" % (self._max_stream_ordering or 0,))
+
         return self.runInteraction(self._get_room_events_max_id_txn)
 
+    @read_only
     def _get_room_events_max_id_txn(self, txn):
         txn.execute(
             "SELECT MAX(stream_ordering) as m FROM events"
@@ -13,7 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from ._base import SQLBaseStore, Table
+from ._base import SQLBaseStore, Table, read_only
 from .pdu import PdusTable
 
 from collections import namedtuple
@@ -45,6 +45,7 @@ class TransactionStore(SQLBaseStore):
             self._get_received_txn_response, transaction_id, origin
         )
 
+    @read_only
     def _get_received_txn_response(self, txn, transaction_id, origin):
         where_clause = "transaction_id = ? AND origin = ?"
         query = ReceivedTransactionsTable.select_statement(where_clause)
@@ -139,14 +140,20 @@ class TransactionStore(SQLBaseStore):
         # Update the tx id -> pdu id mapping
 
         values = [
-            (transaction_id, destination, pdu[0], pdu[1])
+            {
+                "transaction_id": transaction_id,
+                "destination": destination,
+                "pdu_id": pdu[0],
+                "pdu_origin": pdu[1],
+            }
             for pdu in pdu_list
         ]
 
         logger.debug("Inserting: %s", repr(values))
 
-        query = TransactionsToPduTable.insert_statement()
-        txn.executemany(query, values)
+        self._simple_insert_many_txn(
+            txn, TransactionsToPduTable.table_name, values, or_replace=True
+        )
 
         return prev_txns
 
@@ -188,6 +195,7 @@ class TransactionStore(SQLBaseStore):
             self._get_transactions_after, transaction_id, destination
         )
 
+    @read_only
     def _get_transactions_after(cls, txn, transaction_id, destination):
         where = (
             "destination = ? AND id > (select id FROM %s WHERE "
@@ -219,6 +227,7 @@ class TransactionStore(SQLBaseStore):
             transaction_id, destination
         )
 
+    @read_only
     def _get_pdus_after_transaction(self, txn, transaction_id, destination):
 
         # Query that first get's all transaction_ids with an id greater than
@@ -16,6 +16,7 @@
 from twisted.internet import defer
 
 from synapse.types import StreamToken
+from synapse.util.async import concurrently
 
 from synapse.handlers.presence import PresenceEventSource
 from synapse.handlers.room import RoomEventSource
@@ -31,6 +32,9 @@ class NullSource(object):
     def get_new_events_for_user(self, user, from_key, limit):
         return defer.succeed(([], from_key))
 
+    def may_have_new_events_for_user(self, user, from_key, room_ids):
+        return False
+
     def get_current_key(self):
         return defer.succeed(0)
 
@@ -53,17 +57,17 @@ class EventSources(object):
 
     @defer.inlineCallbacks
     def get_current_token(self):
-        token = StreamToken(
-            room_key=(
-                yield self.sources["room"].get_current_key()
-            ),
-            presence_key=(
-                yield self.sources["presence"].get_current_key()
-            ),
-            typing_key=(
-                yield self.sources["typing"].get_current_key()
-            )
-        )
+        names = ["room", "presence", "typing"]
+
+        # Ask all the sources at once, rather than one after the other.
+        keys = yield concurrently([
+            defer.maybeDeferred(self.sources[name].get_current_key)
+            for name in names
+        ])
+
+        token = StreamToken(**{
+            "%s_key" % name: key for name, key in zip(names, keys)
+        })
         defer.returnValue(token)
 
 
@@ -72,6 +76,11 @@ class StreamSource(object):
         """from_key is the key within this event source."""
         raise NotImplementedError("get_new_events_for_user")
 
+    def may_have_new_events_for_user(self, user, from_key, room_ids):
+        """Returns False if it is known, without doing any work, that
+        get_new_events_for_user would return nothing."""
+        return True
+
     def get_current_key(self):
         raise NotImplementedError("get_current_key")
 
@@ -21,3 +21,18 @@ def sleep(seconds):
     d = defer.Deferred()
     reactor.callLater(seconds, d.callback, seconds)
     return d
+
+
+def concurrently(deferreds):
+    """ Like defer.gatherResults, waits for all the deferreds and returns a
+    list of their results. If any of them fail, fails with the first failure
+    itself, rather than wrapped up in a FirstError, so that the caller sees
+    the same errors as it would by yielding on each deferred in turn.
+    """
+    def unwrap(failure):
+        failure.trap(defer.FirstError)
+        return failure.value.subFailure
+
+    return defer.gatherResults(
+        deferreds, consumeErrors=True
+    ).addErrback(unwrap)
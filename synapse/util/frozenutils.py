@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Immutable versions of dict and list.
+
+These let parsed JSON be shared between everything that reads it rather than
+each reader taking its own deep copy. They are subclasses of dict and list,
+so they compare equal to, and encode to JSON the same as, the originals.
+"""
+
+
+def _immutable(self, *args, **kwargs):
+    raise TypeError("%s is immutable" % (type(self).__name__,))
+
+
+class FrozenDict(dict):
+    __slots__ = []
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+class FrozenList(list):
+    __slots__ = []
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _immutable
+    __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = reverse = sort = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (FrozenList, (list(self),))
+
+
+def freeze(o):
+    """ Returns an immutable version of the given JSON-like object. Things
+    that are already frozen are returned as they are, without copying.
+    """
+    if isinstance(o, (FrozenDict, FrozenList)):
+        return o
+
+    if isinstance(o, dict):
+        return FrozenDict((k, freeze(v)) for k, v in o.items())
+
+    if isinstance(o, list):
+        return FrozenList(freeze(v) for v in o)
+
+    if isinstance(o, tuple):
+        return tuple(freeze(v) for v in o)
+
+    return o
+
+
+def unfreeze(o):
+    """ Returns a mutable deep copy of the given, possibly frozen, JSON-like
+    object.
+    """
+    if isinstance(o, dict):
+        return {k: unfreeze(v) for k, v in o.items()}
+
+    if isinstance(o, list):
+        return [unfreeze(v) for v in o]
+
+    if isinstance(o, tuple):
+        return tuple(unfreeze(v) for v in o)
+
+    return o
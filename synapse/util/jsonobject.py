@@ -14,17 +14,39 @@
 # limitations under the License.
 
 
-import copy
+from synapse.util.frozenutils import freeze
+
+
+def slots_for(base, *key_lists):
+    """ Returns the `__slots__` a JsonEncodedObject subclass needs to hold the
+    given keys, i.e. those keys that `base` doesn't already have a slot for.
+
+    Subclasses that don't define `__slots__` still work, but each instance
+    then carries a `__dict__` as well.
+    """
+    slots = []
+    for keys in key_lists:
+        for k in keys:
+            if k not in slots and not hasattr(base, k):
+                slots.append(k)
+    return slots
+
 
 class JsonEncodedObject(object):
     """ A common base class for defining protocol units that are represented
     as JSON.
 
+    Known keys are stored as attributes, which subclasses should declare with
+    `__slots__` (see `slots_for`) to keep instances small. A key that hasn't
+    been given is simply not set, so `hasattr` can be used to test for it.
+
     Attributes:
         unrecognized_keys (dict): A dict containing all the key/value pairs we
             don't recognize.
     """
 
+    __slots__ = ["unrecognized_keys"]
+
     valid_keys = []  # keys we will store
     """A list of strings that represent keys we know about
     and can handle. If we have values for these keys they will be
@@ -58,7 +80,7 @@ class JsonEncodedObject(object):
         self.unrecognized_keys = {}  # Keys we were given not listed as valid
         for k, v in kwargs.items():
             if k in self.valid_keys or k in self.internal_keys:
-                self.__dict__[k] = v
+                setattr(self, k, v)
             else:
                 self.unrecognized_keys[k] = v
 
@@ -68,26 +90,54 @@ class JsonEncodedObject(object):
 
         The keys it encodes are: `valid_keys` - `internal_keys`
 
+        The returned dict is new, but the values in it are frozen (see
+        `synapse.util.frozenutils`) so that they can be shared with this
+        object rather than copied.
+
         Returns
             dict
         """
         d = {
-            k: _encode(v) for (k, v) in self.__dict__.items()
-            if k in self.valid_keys and k not in self.internal_keys
+            k: _encode(v) for (k, v) in self._get_items()
+            if k not in self.internal_keys
         }
-        d.update(self.unrecognized_keys)
-        return copy.deepcopy(d)
+        d.update(
+            (k, freeze(v)) for k, v in self.unrecognized_keys.items()
+        )
+        return d
 
     def get_full_dict(self):
         d = {
-            k: v for (k, v) in self.__dict__.items()
-            if k in self.valid_keys or k in self.internal_keys
+            k: freeze(v) for (k, v) in self._get_items(with_internal=True)
         }
-        d.update(self.unrecognized_keys)
-        return copy.deepcopy(d)
+        d.update(
+            (k, freeze(v)) for k, v in self.unrecognized_keys.items()
+        )
+        return d
+
+    def _get_items(self, with_internal=False):
+        """ Yields (key, value) for each of the known keys that are set. """
+        keys = self.valid_keys
+        if with_internal:
+            keys = keys + self.internal_keys
+
+        seen = set()
+        for k in keys:
+            if k in seen:
+                continue
+            seen.add(k)
+
+            v = getattr(self, k, _MISSING)
+            if v is not _MISSING:
+                yield k, v
 
     def __str__(self):
-        return "(%s, %s)" % (self.__class__.__name__, repr(self.__dict__))
+        return "(%s, %s)" % (
+            self.__class__.__name__, repr(self.get_full_dict())
+        )
+
+
+_MISSING = object()
 
 def _encode(obj):
     if type(obj) is list:
@@ -96,4 +146,4 @@ def _encode(obj):
     if isinstance(obj, JsonEncodedObject):
         return obj.get_dict()
 
-    return obj
+    return freeze(obj)
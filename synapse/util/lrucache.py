@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+
+import threading
+
+
+class LruCache(object):
+    """ A bounded least recently used cache.
+
+    Entries are evicted once there are more than `max_entries` of them, or
+    once the sum of their sizes goes over `max_size`. What a size means is up
+    to the caller; by default every entry has a size of 1.
+
+    The cache is safe to use from both the reactor and the database threads.
+
+    Args:
+        max_entries (int): The maximum number of entries to keep.
+        max_size (int): Optional maximum total size of the entries.
+    """
+
+    def __init__(self, max_entries, max_size=None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+
+        # key -> (value, size), least recently used first.
+        self._cache = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                entry = self._cache.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._cache[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, size=1):
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+
+            self._cache[key] = (value, size)
+            self._size += size
+
+            self._evict()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._cache.pop(key, None)
+            if entry is None:
+                return default
+
+            self._size -= entry[1]
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._size = 0
+
+    def _evict(self):
+        while self._cache and (
+            len(self._cache) > self.max_entries or
+            (self.max_size is not None and self._size > self.max_size)
+        ):
+            _, (_, size) = self._cache.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._cache),
+            "size": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": float(self.hits) / lookups if lookups else 0.,
+        }
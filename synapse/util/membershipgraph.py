@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+
+
+class MembershipGraph(object):
+    """ An in-memory index of which users are joined to which rooms, kept in
+    both directions, so that questions like "do these users share a room"
+    and "who shares a room with this user" are answered with set operations
+    rather than by the database.
+
+    The graph knows nothing until `load` is called with every current
+    membership. Changes made before then are queued and replayed on top of
+    the loaded memberships, in order, so changes that raced with the load
+    aren't lost. Until it is loaded, `loaded` is False and the graph
+    shouldn't be asked anything.
+    """
+
+    def __init__(self):
+        # user_id -> set of room_ids, and room_id -> set of user_ids. Users
+        # and rooms with no memberships are removed.
+        self._rooms_by_user = {}
+        self._users_by_room = {}
+        self._memberships = 0
+
+        self.loaded = False
+
+        # (user_id, room_id, joined) changes seen before the load finished,
+        # or None if the load failed and changes are no longer kept.
+        self._pending = []
+
+    def load(self, memberships):
+        """ Populates the graph.
+
+        Args:
+            memberships: An iterable of (user_id, room_id) for every user
+                currently joined to a room.
+        """
+        for user_id, room_id in memberships:
+            self._add(user_id, room_id)
+
+        for change in self._pending:
+            self._apply(*change)
+        self._pending = []
+
+        self.loaded = True
+
+    def load_failed(self):
+        """ Stops queuing changes for a load that isn't going to happen. """
+        self._pending = None
+
+    def membership_changed(self, user_id, room_id, joined):
+        if self.loaded:
+            self._apply(user_id, room_id, joined)
+        elif self._pending is not None:
+            self._pending.append((user_id, room_id, joined))
+
+    def _apply(self, user_id, room_id, joined):
+        if joined:
+            self._add(user_id, room_id)
+        else:
+            self._remove(user_id, room_id)
+
+    def _add(self, user_id, room_id):
+        rooms = self._rooms_by_user.setdefault(user_id, set())
+        if room_id in rooms:
+            return
+
+        rooms.add(room_id)
+        self._users_by_room.setdefault(room_id, set()).add(user_id)
+        self._memberships += 1
+
+    def _remove(self, user_id, room_id):
+        rooms = self._rooms_by_user.get(user_id)
+        if not rooms or room_id not in rooms:
+            return
+
+        rooms.discard(room_id)
+        if not rooms:
+            del self._rooms_by_user[user_id]
+
+        users = self._users_by_room[room_id]
+        users.discard(user_id)
+        if not users:
+            del self._users_by_room[room_id]
+
+        self._memberships -= 1
+
+    def get_rooms_for_user(self, user_id):
+        return frozenset(self._rooms_by_user.get(user_id, ()))
+
+    def get_users_in_room(self, room_id):
+        return frozenset(self._users_by_room.get(room_id, ()))
+
+    def users_share_room(self, user_ids):
+        """ Returns whether there is a room all of the given users are
+        joined to. """
+        room_sets = [self._rooms_by_user.get(u) for u in set(user_ids)]
+        if not room_sets or not all(room_sets):
+            return False
+
+        # Start from whoever is in the fewest rooms.
+        room_sets.sort(key=len)
+        shared = set(room_sets[0])
+        for rooms in room_sets[1:]:
+            shared.intersection_update(rooms)
+            if not shared:
+                return False
+
+        return True
+
+    def get_users_sharing_room_with(self, user_id):
+        """ Returns the set of users sharing at least one room with the given
+        user, including the user themselves if they are in any rooms. """
+        users = set()
+        for room_id in self._rooms_by_user.get(user_id, ()):
+            users.update(self._users_by_room[room_id])
+        return users
+
+    def get_stats(self):
+        # The user and room ID strings are shared with the rest of the
+        # server, so only the containers themselves are counted.
+        size = sys.getsizeof(self._rooms_by_user)
+        size += sys.getsizeof(self._users_by_room)
+        for sets in (self._rooms_by_user, self._users_by_room):
+            size += sum(sys.getsizeof(s) for s in sets.itervalues())
+
+        return {
+            "loaded": self.loaded,
+            "users": len(self._rooms_by_user),
+            "rooms": len(self._users_by_room),
+            "memberships": self._memberships,
+            "size_bytes": size,
+        }
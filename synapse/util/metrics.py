@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics(object):
+    """ A registry of named statistics providers.
+
+    Components register a callback under a name, and `collect` calls each of
+    them in turn to build a snapshot of the whole server. This is what backs
+    the admin stats endpoint and is handy from the manhole.
+    """
+
+    def __init__(self):
+        self._sources = {}
+
+    def register(self, name, callback):
+        """ Register a source of statistics.
+
+        Args:
+            name (str): The key the statistics will be returned under.
+            callback (function): Called with no arguments, must return
+                something JSON serializable.
+        """
+        self._sources[name] = callback
+
+    def collect(self):
+        """ Returns a dict of name to the current statistics for that name.
+        """
+        ret = {}
+        for name, callback in self._sources.items():
+            try:
+                ret[name] = callback()
+            except:
+                logger.exception("Failed to collect metrics for %s", name)
+        return ret
+
+
+class LatencyHistogram(object):
+    """ A fixed bucket histogram of durations, used to give cheap estimates
+    of percentiles without having to keep every sample.
+
+    Durations are given in seconds, but are reported in milliseconds.
+    """
+
+    # Upper bounds of each bucket, in milliseconds.
+    BUCKETS = [
+        0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500,
+        5000, 10000,
+    ]
+
+    __slots__ = ["counts", "count", "total", "max"]
+
+    def __init__(self):
+        # The extra bucket on the end is for anything over the largest bound.
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, duration):
+        ms = duration * 1000
+        self.counts[bisect.bisect_left(self.BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, q):
+        """ Estimate the q-th percentile (0 < q <= 100), in milliseconds.
+
+        The estimate is the upper bound of the bucket the percentile falls
+        in, capped at the largest duration seen.
+        """
+        if not self.count:
+            return 0.
+
+        target = self.count * q / 100.
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                if i < len(self.BUCKETS):
+                    return min(self.BUCKETS[i], self.max)
+                break
+
+        return self.max
+
+    def get_stats(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total,
+            "max_ms": self.max,
+            "p50_ms": self.percentile(50),
+            "p99_ms": self.percentile(99),
+        }
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+
+
+class StreamChangeCache(object):
+    """ Remembers the latest stream position at which each of a bounded
+    number of entities (e.g. rooms) changed, so that we can tell without
+    going to the database that an entity hasn't changed since a position.
+
+    The cache can only answer for positions at or after its earliest known
+    position: the point from which it has been told about every change.
+    This is unknown until `set_earliest_known_position` is called, and moves
+    forward as entities are evicted. Anything older is reported as having
+    (possibly) changed.
+
+    Args:
+        max_size (int): The maximum number of entities to remember.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+
+        # entity -> position, roughly in order of position.
+        self._entity_to_position = OrderedDict()
+        self._earliest_known_position = None
+        self._max_position = None
+
+    def set_earliest_known_position(self, position):
+        """ Tells the cache that it will be told about every change after the
+        given position. Does nothing if it already knew that. """
+        if self._earliest_known_position is None:
+            self._earliest_known_position = position
+
+    def entity_has_changed(self, entity, position):
+        if (self._earliest_known_position is not None and
+                position <= self._earliest_known_position):
+            return
+
+        old = self._entity_to_position.pop(entity, None)
+        if old is not None:
+            position = max(old, position)
+        self._entity_to_position[entity] = position
+
+        if self._max_position is None or position > self._max_position:
+            self._max_position = position
+
+        while len(self._entity_to_position) > self.max_size:
+            _, evicted = self._entity_to_position.popitem(last=False)
+            if self._earliest_known_position is not None:
+                self._earliest_known_position = max(
+                    self._earliest_known_position, evicted
+                )
+
+    def _knows_about(self, position):
+        return (
+            self._earliest_known_position is not None and
+            position >= self._earliest_known_position
+        )
+
+    def has_entity_changed(self, entity, position):
+        """ Returns whether the entity may have changed after the given
+        position. """
+        if not self._knows_about(position):
+            return True
+
+        changed = self._entity_to_position.get(entity)
+        return changed is not None and changed > position
+
+    def has_any_entity_changed(self, position):
+        """ Returns whether any entity may have changed after the given
+        position. """
+        if not self._knows_about(position):
+            return True
+
+        return self._max_position is not None and self._max_position > position
+
+    def get_stats(self):
+        return {
+            "entities": len(self._entity_to_position),
+            "earliest_known_position": self._earliest_known_position,
+            "max_position": self._max_position,
+        }
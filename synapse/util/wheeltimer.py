@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import math
+
+
+logger = logging.getLogger(__name__)
+
+
+class WheelTimer(object):
+    """ Expires objects after a delay, using one delayed call per bucket of
+    `bucket_size` seconds rather than one per object. Objects can be removed
+    again in constant time, without cancelling anything with the reactor.
+
+    Objects expire up to `bucket_size` seconds after their delay, but never
+    before.
+
+    Args:
+        clock (synapse.util.Clock)
+        callback (callable): Called with each object as it expires.
+        bucket_size (float): The width of each bucket, in seconds.
+        batched (bool): If True, `callback` is instead called once per
+            bucket, with the list of objects expiring together.
+    """
+
+    def __init__(self, clock, callback, bucket_size=1., batched=False):
+        self.clock = clock
+        self.callback = callback
+        self.bucket_size = bucket_size
+        self.batched = batched
+
+        # bucket index -> set of objects, for every bucket with a pending
+        # delayed call.
+        self._buckets = {}
+        self._object_to_bucket = {}
+
+    def insert(self, obj, delay):
+        """ Expire the object after `delay` seconds, unless it is removed
+        first. """
+        self.remove(obj)
+
+        now = self.clock.time()
+        index = int(math.ceil((now + delay) / self.bucket_size))
+
+        bucket = self._buckets.get(index)
+        if bucket is None:
+            bucket = self._buckets[index] = set()
+            self.clock.call_later(
+                index * self.bucket_size - now,
+                lambda: self._expire_bucket(index),
+            )
+
+        bucket.add(obj)
+        self._object_to_bucket[obj] = index
+
+    def remove(self, obj):
+        """ Stops the object from expiring. Returns whether it was waiting
+        to. """
+        index = self._object_to_bucket.pop(obj, None)
+        if index is None:
+            return False
+
+        self._buckets[index].discard(obj)
+        return True
+
+    def _expire_bucket(self, index):
+        bucket = self._buckets.pop(index, ())
+
+        for obj in bucket:
+            del self._object_to_bucket[obj]
+
+        if self.batched:
+            if bucket:
+                try:
+                    self.callback(list(bucket))
+                except:
+                    logger.exception(
+                        "Failed to expire %d objects", len(bucket)
+                    )
+            return
+
+        for obj in bucket:
+            try:
+                self.callback(obj)
+            except:
+                logger.exception("Failed to expire %r", obj)
+
+    def __len__(self):
+        return len(self._object_to_bucket)
+
+    def __contains__(self, obj):
+        return obj in self._object_to_bucket
+
+    def get_stats(self):
+        return {
+            "waiting": len(self._object_to_bucket),
+            "buckets": len(self._buckets),
+        }
@@ -14,6 +14,7 @@
 # limitations under the License.
 
 from synapse.api.events import SynapseEvent
+from synapse.api.events.room import MessageEvent
 
 from tests import unittest
 
@@ -176,6 +177,27 @@ class SynapseTemplateCheckTestCase(unittest.TestCase):
         self.assertFalse(event.check_json(content, raises=False))
 
 
+class SynapseEventSlotsTestCase(unittest.TestCase):
+
+    def test_keys(self):
+        event = MessageEvent(
+            event_id="a@test",
+            room_id="!r:test",
+            content={"msgtype": u"m.text"},
+            depth=1,
+            something="else",
+        )
+
+        self.assertFalse(hasattr(event, "__dict__"))
+        self.assertEquals(1, event.depth)
+        self.assertFalse(hasattr(event, "prev_state"))
+        self.assertEquals({"something": "else"}, event.unrecognized_keys)
+
+        event.prev_state = "b@test"
+        self.assertEquals("b@test", event.get_full_dict()["prev_state"])
+        self.assertFalse("prev_state" in event.get_dict())
+
+
 class MockSynapseEvent(SynapseEvent):
 
     def __init__(self, template):
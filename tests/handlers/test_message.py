@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from mock import Mock, NonCallableMock
+
+from synapse.api.constants import Membership
+from synapse.handlers.message import MessageHandler
+from synapse.server import HomeServer
+from synapse.streams.config import PaginationConfig
+from synapse.types import StreamToken
+
+from tests.utils import MockClock
+
+
+class InitialSyncCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = MockClock()
+
+        self.event_sources = NonCallableMock(spec_set=[
+            "get_current_token",
+            "sources",
+        ])
+        self.event_sources.sources = {
+            "presence": NonCallableMock(spec_set=["get_pagination_rows"]),
+        }
+        self.event_sources.sources["presence"].get_pagination_rows = Mock(
+            side_effect=lambda *args: defer.succeed(([], None))
+        )
+
+        hs = HomeServer(
+            "test",
+            db_pool=None,
+            clock=self.clock,
+            datastore=NonCallableMock(spec_set=[
+                "get_rooms_for_user_where_membership_is",
+                "get_rooms",
+                "get_recent_events_for_rooms",
+                "get_current_state_for_rooms",
+                "get_recent_events_for_room",
+                "get_current_state",
+                "membership_may_have_changed",
+                "get_rooms_changed_since",
+            ]),
+            event_sources=self.event_sources,
+            handlers=None,
+            resource_for_federation=Mock(),
+            http_client=None,
+        )
+
+        self.datastore = hs.get_datastore()
+        self.handler = MessageHandler(hs)
+
+        self.user_id = "@alice:test"
+        self.room_a = "!a:test"
+        self.room_b = "!b:test"
+
+        self.datastore.get_rooms_for_user_where_membership_is = Mock(
+            side_effect=lambda **kwargs: defer.succeed([
+                Mock(room_id=self.room_a, membership=Membership.JOIN),
+                Mock(room_id=self.room_b, membership=Membership.JOIN),
+            ])
+        )
+        self.datastore.get_rooms = Mock(
+            side_effect=lambda **kwargs: defer.succeed([])
+        )
+
+        self.messages = {self.room_a: ["a1"], self.room_b: ["b1"]}
+
+        def get_recent_events_for_rooms(room_ids, limit, end_token):
+            return defer.succeed({
+                room_id: (self.messages[room_id], ("t1-1", end_token))
+                for room_id in room_ids
+            })
+        self.datastore.get_recent_events_for_rooms = Mock(
+            side_effect=get_recent_events_for_rooms
+        )
+        self.datastore.get_current_state_for_rooms = Mock(
+            side_effect=lambda room_ids: defer.succeed(
+                {room_id: [] for room_id in room_ids}
+            )
+        )
+
+        def get_recent_events_for_room(room_id, limit, end_token):
+            return defer.succeed(
+                (self.messages[room_id], ("t1-1", end_token))
+            )
+        self.datastore.get_recent_events_for_room = Mock(
+            side_effect=get_recent_events_for_room
+        )
+        self.datastore.get_current_state = Mock(
+            side_effect=lambda room_id: defer.succeed([])
+        )
+
+        self.datastore.membership_may_have_changed = Mock(return_value=False)
+        self.datastore.get_rooms_changed_since = Mock(return_value=set())
+
+        self.set_token("s1")
+
+    def set_token(self, room_key):
+        self.event_sources.get_current_token = Mock(
+            side_effect=lambda: defer.succeed(
+                StreamToken(room_key, "0", "0")
+            )
+        )
+
+    def snapshot(self):
+        return self.handler.snapshot_all_rooms(
+            user_id=self.user_id,
+            pagin_config=PaginationConfig(limit=10),
+        )
+
+    def messages_by_room(self, snapshot):
+        return {
+            r["room_id"]: r["messages"]["chunk"] for r in snapshot["rooms"]
+        }
+
+    @defer.inlineCallbacks
+    def test_cached(self):
+        first = yield self.snapshot()
+        second = yield self.snapshot()
+
+        self.assertEquals(first, second)
+        self.assertEquals(
+            1, self.datastore.get_rooms_for_user_where_membership_is.call_count
+        )
+        self.assertEquals(
+            1, self.datastore.get_recent_events_for_rooms.call_count
+        )
+
+    @defer.inlineCallbacks
+    def test_updated_incrementally(self):
+        yield self.snapshot()
+
+        self.set_token("s2")
+        self.messages[self.room_a] = ["a1", "a2"]
+        self.datastore.get_rooms_changed_since.return_value = set([
+            self.room_a
+        ])
+
+        snapshot = yield self.snapshot()
+
+        self.assertEquals(
+            {self.room_a: ["a1", "a2"], self.room_b: ["b1"]},
+            self.messages_by_room(snapshot)
+        )
+        self.assertEquals("s2_0_0", snapshot["end"])
+
+        # Only the room with new events was loaded again
+        self.datastore.get_recent_events_for_rooms.assert_called_with(
+            set([self.room_a]), limit=10, end_token="s2"
+        )
+        self.assertEquals(
+            1, self.datastore.get_rooms_for_user_where_membership_is.call_count
+        )
+
+    @defer.inlineCallbacks
+    def test_rebuilt_on_membership_change(self):
+        yield self.snapshot()
+
+        self.set_token("s2")
+        self.datastore.membership_may_have_changed.return_value = True
+
+        yield self.snapshot()
+
+        self.assertEquals(
+            2, self.datastore.get_rooms_for_user_where_membership_is.call_count
+        )
+
+    @defer.inlineCallbacks
+    def test_rebuilt_after_ttl(self):
+        yield self.snapshot()
+
+        self.clock.advance_time(MessageHandler.SNAPSHOT_CACHE_TTL + 1)
+
+        yield self.snapshot()
+
+        self.assertEquals(
+            2, self.datastore.get_rooms_for_user_where_membership_is.call_count
+        )
+
+    def test_concurrent_requests_share_build(self):
+        token_d = defer.Deferred()
+        self.event_sources.get_current_token = Mock(return_value=token_d)
+
+        first = self.snapshot()
+        second = self.snapshot()
+
+        self.assertEquals(1, self.event_sources.get_current_token.call_count)
+
+        token_d.callback(StreamToken("s1", "0", "0"))
+
+        self.assertEquals(first.result, second.result)
+        self.assertEquals(
+            1, self.datastore.get_rooms_for_user_where_membership_is.call_count
+        )
+
+    @defer.inlineCallbacks
+    def test_batch_failure_falls_back_per_room(self):
+        self.datastore.get_recent_events_for_rooms.side_effect = (
+            lambda *args, **kwargs: defer.fail(Exception("Batch failed"))
+        )
+
+        def get_recent_events_for_room(room_id, limit, end_token):
+            if room_id == self.room_b:
+                return defer.fail(Exception("Room failed"))
+            return defer.succeed(
+                (self.messages[room_id], ("t1-1", end_token))
+            )
+        self.datastore.get_recent_events_for_room.side_effect = (
+            get_recent_events_for_room
+        )
+
+        snapshot = yield self.snapshot()
+
+        # Only the room that failed on its own is missing its messages
+        rooms = {r["room_id"]: r for r in snapshot["rooms"]}
+        self.assertEquals(["a1"], rooms[self.room_a]["messages"]["chunk"])
+        self.assertNotIn("messages", rooms[self.room_b])
+
+        # An incomplete snapshot isn't cached
+        yield self.snapshot()
+        self.assertEquals(
+            2, self.datastore.get_rooms_for_user_where_membership_is.call_count
+        )
+
+    @defer.inlineCallbacks
+    def test_rebuilt_if_update_fails(self):
+        yield self.snapshot()
+
+        self.set_token("s2")
+        self.datastore.get_rooms_changed_since.side_effect = (
+            Exception("Oh no")
+        )
+
+        snapshot = yield self.snapshot()
+
+        self.assertEquals(
+            {self.room_a: ["a1"], self.room_b: ["b1"]},
+            self.messages_by_room(snapshot)
+        )
+        self.assertEquals(
+            2, self.datastore.get_rooms_for_user_where_membership_is.call_count
+        )
+
+    @defer.inlineCallbacks
+    def test_rebuilt_if_changed_room_fails(self):
+        yield self.snapshot()
+
+        self.set_token("s2")
+        self.datastore.get_rooms_changed_since.return_value = set([
+            self.room_a
+        ])
+        self.datastore.get_recent_events_for_rooms.side_effect = (
+            lambda *args, **kwargs: defer.fail(Exception("Batch failed"))
+        )
+        self.datastore.get_recent_events_for_room.side_effect = (
+            lambda *args, **kwargs: defer.fail(Exception("Room failed"))
+        )
+
+        snapshot = yield self.snapshot()
+
+        # Rather than keeping the stale messages, the rebuild leaves them out
+        self.assertNotIn("messages", snapshot["rooms"][0])
+        self.assertEquals(
+            2, self.datastore.get_rooms_for_user_where_membership_is.call_count
+        )
+
+    @defer.inlineCallbacks
+    def test_visibility_updated(self):
+        first = yield self.snapshot()
+        self.assertEquals(
+            ["private", "private"],
+            [r["visibility"] for r in first["rooms"]]
+        )
+
+        self.set_token("s2")
+        self.datastore.get_rooms.side_effect = (
+            lambda **kwargs: defer.succeed([{"room_id": self.room_a}])
+        )
+
+        second = yield self.snapshot()
+
+        self.assertEquals(
+            {self.room_a: "public", self.room_b: "private"},
+            {r["room_id"]: r["visibility"] for r in second["rooms"]}
+        )
+        self.assertEquals(
+            1, self.datastore.get_rooms_for_user_where_membership_is.call_count
+        )
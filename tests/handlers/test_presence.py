@@ -17,7 +17,7 @@
 from tests import unittest
 from twisted.internet import defer, reactor
 
-from mock import Mock, call, ANY
+from mock import Mock, call, ANY, patch
 import json
 
 from tests.utils import (
@@ -26,7 +26,7 @@ from tests.utils import (
 
 from synapse.server import HomeServer
 from synapse.api.constants import PresenceState
-from synapse.api.errors import SynapseError
+from synapse.api.errors import SynapseError, StoreError
 from synapse.handlers.presence import PresenceHandler, UserPresenceCache
 
 
@@ -55,8 +55,8 @@ def _make_edu_json(origin, edu_type, content):
 
 
 class JustPresenceHandlers(object):
-    def __init__(self, hs):
-        self.presence_handler = PresenceHandler(hs)
+    def __init__(self, hs, **presence_args):
+        self.presence_handler = PresenceHandler(hs, **presence_args)
 
 
 class PresenceStateTestCase(unittest.TestCase):
@@ -67,8 +67,10 @@ class PresenceStateTestCase(unittest.TestCase):
         db_pool = SQLiteMemoryDbPool()
         yield db_pool.prepare()
 
+        self.clock = MockClock()
+
         hs = HomeServer("test",
-            clock=MockClock(),
+            clock=self.clock,
             db_pool=db_pool,
             handlers=None,
             resource_for_federation=Mock(),
@@ -200,6 +202,150 @@ class PresenceStateTestCase(unittest.TestCase):
 
         self.mock_stop.assert_called_with(self.u_apple)
 
+    @defer.inlineCallbacks
+    def test_idle_sweep(self):
+        writes = []
+        set_presence_states = self.store.set_presence_states
+
+        def record_write(states):
+            d = set_presence_states(states)
+            writes.append((states, d))
+            return d
+        self.store.set_presence_states = record_write
+
+        yield self.store.create_presence(self.u_banana.localpart)
+
+        for user in (self.u_apple, self.u_banana):
+            yield self.handler.set_state(target_user=user, auth_user=user,
+                    state={"presence": ONLINE})
+
+        self.clock.advance_time(PresenceHandler.IDLE_TIMEOUT)
+        self.clock.advance_time(PresenceHandler.IDLE_SWEEP_INTERVAL)
+
+        # Both users went idle together, so are written out together
+        self.assertEquals(1, len(writes))
+        states, d = writes[0]
+        yield d
+
+        self.assertEquals(
+            ["apple", "banana"], sorted(localpart for localpart, _ in states)
+        )
+        for user in (self.u_apple, self.u_banana):
+            self.assertEquals(
+                UNAVAILABLE,
+                (yield self.store.get_presence_state(user.localpart))["state"]
+            )
+
+        # Being active again brings apple back online
+        yield self.handler.bump_presence_active_time(self.u_apple)
+        self.assertEquals(
+            ONLINE,
+            self.handler._user_cachemap[self.u_apple].get_state()["presence"]
+        )
+
+        # Banana has now been idle for OFFLINE_TIMEOUT, apple hasn't
+        self.clock.advance_time(
+            PresenceHandler.OFFLINE_TIMEOUT - PresenceHandler.IDLE_TIMEOUT
+        )
+
+        self.assertEquals(
+            OFFLINE,
+            self.handler._user_cachemap[self.u_banana].get_state()["presence"]
+        )
+        self.mock_stop.assert_called_once_with(self.u_banana)
+
+    @defer.inlineCallbacks
+    def test_idle_sweep_write_fails(self):
+        self.store.set_presence_states = Mock(
+            side_effect=lambda states: defer.fail(StoreError(500, "Oops"))
+        )
+
+        yield self.handler.set_state(target_user=self.u_apple,
+                auth_user=self.u_apple, state={"presence": ONLINE})
+
+        with patch("synapse.handlers.presence.logger") as mock_logger:
+            self.clock.advance_time(PresenceHandler.IDLE_TIMEOUT)
+            self.clock.advance_time(PresenceHandler.IDLE_SWEEP_INTERVAL)
+
+        self.assertEquals(1, self.store.set_presence_states.call_count)
+        self.assertEquals(1, mock_logger.error.call_count)
+
+        # The user is still idle as far as everyone else is concerned
+        self.assertEquals(
+            UNAVAILABLE,
+            self.handler._user_cachemap[self.u_apple].get_state()["presence"]
+        )
+
+    @defer.inlineCallbacks
+    def test_idle_while_streaming(self):
+        yield self.handler.started_user_eventstream(self.u_apple)
+
+        self.clock.advance_time(PresenceHandler.OFFLINE_TIMEOUT)
+        self.clock.advance_time(PresenceHandler.IDLE_SWEEP_INTERVAL)
+
+        # Someone with an event stream open is never idle enough to go offline
+        self.assertEquals(
+            UNAVAILABLE,
+            self.handler._user_cachemap[self.u_apple].get_state()["presence"]
+        )
+        self.assertEquals(0, len(self.handler._idle_timer))
+
+
+class PresenceIdleConfigTestCase(unittest.TestCase):
+    """ Tests the idle timeouts can be changed. """
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        db_pool = SQLiteMemoryDbPool()
+        yield db_pool.prepare()
+
+        self.clock = MockClock()
+
+        hs = HomeServer("test",
+            clock=self.clock,
+            db_pool=db_pool,
+            handlers=None,
+            resource_for_federation=Mock(),
+            http_client=None,
+        )
+        hs.handlers = JustPresenceHandlers(hs,
+            idle_timeout=60, offline_timeout=120, idle_sweep_interval=10,
+        )
+        hs.handlers.room_member_handler = Mock(spec=["get_rooms_for_user"])
+        hs.handlers.room_member_handler.get_rooms_for_user.side_effect = (
+            lambda user: defer.succeed([])
+        )
+
+        self.store = hs.get_datastore()
+
+        self.u_apple = hs.parse_userid("@apple:test")
+        yield self.store.create_presence(self.u_apple.localpart)
+
+        self.handler = hs.get_handlers().presence_handler
+        self.handler.start_polling_presence = Mock()
+        self.handler.stop_polling_presence = Mock()
+
+    @defer.inlineCallbacks
+    def test_idle(self):
+        yield self.handler.set_state(target_user=self.u_apple,
+                auth_user=self.u_apple, state={"presence": ONLINE})
+
+        # Well short of the default IDLE_TIMEOUT
+        self.clock.advance_time(60)
+        self.clock.advance_time(10)
+
+        self.assertEquals(
+            UNAVAILABLE,
+            self.handler._user_cachemap[self.u_apple].get_state()["presence"]
+        )
+
+        self.clock.advance_time(60)
+
+        self.assertEquals(
+            OFFLINE,
+            self.handler._user_cachemap[self.u_apple].get_state()["presence"]
+        )
+
 
 class PresenceInvitesTestCase(unittest.TestCase):
     """ Tests presence management. """
@@ -532,6 +678,10 @@ class PresencePushTestCase(unittest.TestCase):
         self.handler = hs.get_handlers().presence_handler
         self.event_source = hs.get_event_sources().sources["presence"]
 
+        # Push to remote servers as soon as the clock is next advanced, so
+        # that the transactions' timestamps stay the same.
+        self.handler.REMOTE_PUSH_WINDOW = 0
+
         # Mock the RoomMemberHandler
         hs.handlers.room_member_handler = Mock(spec=[
             "get_rooms_for_user",
@@ -570,6 +720,16 @@ class PresencePushTestCase(unittest.TestCase):
             return defer.succeed(shared)
         self.datastore.user_rooms_intersect = user_rooms_intersect
 
+        def get_users_sharing_room_with(user_id):
+            room_member_ids = map(lambda u: u.to_string(), self.room_members)
+
+            if user_id not in room_member_ids:
+                return defer.succeed(set())
+            return defer.succeed(set(room_member_ids))
+        self.datastore.get_users_sharing_room_with = (
+            get_users_sharing_room_with
+        )
+
         @defer.inlineCallbacks
         def fetch_room_distributions_into(room_id, localusers=None,
                 remotedomains=None, ignore_user=None):
@@ -810,6 +970,8 @@ class PresencePushTestCase(unittest.TestCase):
             {"presence": ONLINE}
         )
 
+        self.clock.advance_time(0)
+
         yield put_json.await_calls()
 
     @defer.inlineCallbacks
@@ -907,22 +1069,10 @@ class PresencePushTestCase(unittest.TestCase):
                 path=ANY,  # Can't guarantee which txn ID will be which
                 data=_expect_edu("remote", "m.presence",
                     content={
+                        # Both states are batched into a single EDU
                         "push": [
                             {"user_id": "@apple:test",
                              "presence": "online"},
-                        ],
-                    }
-                ),
-                on_send_callback=ANY,
-            ),
-            defer.succeed((200, "OK"))
-        )
-        put_json.expect_call_and_return(
-            call("remote",
-                path=ANY,  # Can't guarantee which txn ID will be which
-                data=_expect_edu("remote", "m.presence",
-                    content={
-                        "push": [
                             {"user_id": "@banana:test",
                              "presence": "offline"},
                         ],
@@ -943,13 +1093,15 @@ class PresencePushTestCase(unittest.TestCase):
             "a-room"
         )
 
+        self.clock.advance_time(0)
+
         yield put_json.await_calls()
 
         ## Sending newly-joined local user state to remote users
 
         put_json.expect_call_and_return(
             call("remote",
-                path="/_matrix/federation/v1/send/1000002/",
+                path="/_matrix/federation/v1/send/1000001/",
                 data=_expect_edu("remote", "m.presence",
                     content={
                         "push": [
@@ -972,9 +1124,125 @@ class PresencePushTestCase(unittest.TestCase):
             "a-room"
         )
 
+        self.clock.advance_time(0)
+
         put_json.await_calls()
 
 
+    @defer.inlineCallbacks
+    def test_remote_pushes_batched(self):
+        self.handler.REMOTE_PUSH_WINDOW = 0.05
+        self.handler.federation = Mock(spec=["send_edu"])
+
+        yield self.handler._push_presence_remote(self.u_apple, "remote",
+                state={"presence": ONLINE})
+        yield self.handler._push_presence_remote(self.u_banana, "remote",
+                state={"presence": ONLINE})
+        yield self.handler._push_presence_remote(self.u_apple, "farm",
+                state={"presence": ONLINE})
+        # Replaces apple's earlier state rather than being sent as well
+        yield self.handler._push_presence_remote(self.u_apple, "remote",
+                state={"presence": UNAVAILABLE})
+
+        self.assertFalse(self.handler.federation.send_edu.called)
+
+        self.clock.advance_time(0.05)
+
+        sent = {
+            kwargs["destination"]: kwargs["content"]["push"]
+            for _, kwargs in self.handler.federation.send_edu.call_args_list
+        }
+        self.assertEquals(
+            {
+                "remote": [
+                    {"user_id": "@apple:test", "presence": UNAVAILABLE},
+                    {"user_id": "@banana:test", "presence": ONLINE},
+                ],
+                "farm": [
+                    {"user_id": "@apple:test", "presence": ONLINE},
+                ],
+            },
+            sent
+        )
+
+    @defer.inlineCallbacks
+    def test_remote_pushes_flush(self):
+        self.handler.REMOTE_PUSH_WINDOW = 0.05
+        self.handler.federation = Mock(spec=["send_edu"])
+
+        def send_edu(destination, edu_type, content):
+            if destination == "broken":
+                return defer.fail(Exception("Unreachable"))
+            return defer.succeed(None)
+        self.handler.federation.send_edu.side_effect = send_edu
+
+        yield self.handler._push_presence_remote(self.u_apple, "broken",
+                state={"presence": ONLINE})
+        yield self.handler._push_presence_remote(self.u_apple, "remote",
+                state={"presence": ONLINE})
+
+        # e.g. on shutdown, without waiting for the window to end
+        with patch("synapse.handlers.presence.logger") as mock_logger:
+            yield self.handler.flush_remote_pushes()
+
+        self.assertEquals(
+            ["broken", "remote"],
+            sorted(
+                kwargs["destination"] for _, kwargs
+                in self.handler.federation.send_edu.call_args_list
+            )
+        )
+        self.assertEquals(1, mock_logger.error.call_count)
+
+        # Nothing is left to be sent again when the window would have ended
+        self.clock.advance_time(0.05)
+        self.assertEquals(2, self.handler.federation.send_edu.call_count)
+
+    def test_updated_users(self):
+        for user in (self.u_apple, self.u_banana, self.u_clementine):
+            self.handler.changed_presencelike_data(user, {"presence": ONLINE})
+
+        # Banana's second update moves it after clementine
+        self.handler.changed_presencelike_data(self.u_banana,
+                {"presence": UNAVAILABLE})
+
+        self.assertEquals(
+            [self.u_banana, self.u_clementine, self.u_apple],
+            list(self.handler.get_updated_users(0))
+        )
+        self.assertEquals(
+            [self.u_banana],
+            list(self.handler.get_updated_users(3))
+        )
+        self.assertEquals(
+            [self.u_clementine],
+            list(self.handler.get_updated_users(1, 3))
+        )
+        self.assertEquals([], list(self.handler.get_updated_users(4)))
+
+    @defer.inlineCallbacks
+    def test_events_only_for_shared_rooms(self):
+        self.room_members = [self.u_apple, self.u_banana]
+
+        for user in (self.u_apple, self.u_banana, self.u_durian):
+            self.handler.changed_presencelike_data(user, {"presence": ONLINE})
+
+        (events, _) = yield self.event_source.get_new_events_for_user(
+            self.u_apple, 0, None
+        )
+
+        # Durian shares no room with apple
+        self.assertEquals(
+            set(["@apple:test", "@banana:test"]),
+            set(e["content"]["user_id"] for e in events)
+        )
+
+        (events, _) = yield self.event_source.get_new_events_for_user(
+            self.u_apple, 2, None
+        )
+        self.assertEquals([], events)
+
+
 class PresencePollingTestCase(unittest.TestCase):
     """ Tests presence status polling. """
 
@@ -990,13 +1258,15 @@ class PresencePollingTestCase(unittest.TestCase):
 
 
     def setUp(self):
+        self.clock = MockClock()
+
         self.mock_http_client = Mock(spec=[])
         self.mock_http_client.put_json = DeferredMockCallable()
 
         self.mock_federation_resource = MockHttpResource()
 
         hs = HomeServer("test",
-                clock=MockClock(),
+                clock=self.clock,
                 db_pool=None,
                 datastore=Mock(spec=[
                     # Bits that Federation needs
@@ -1029,6 +1299,10 @@ class PresencePollingTestCase(unittest.TestCase):
         self.handler = hs.get_handlers().presence_handler
         self.handler.push_update_to_clients = self.mock_update_client
 
+        # Push to remote servers as soon as the clock is next advanced, so
+        # that the transactions' timestamps stay the same.
+        self.handler.REMOTE_PUSH_WINDOW = 0
+
         hs.handlers.room_member_handler = Mock(spec=[
             "get_rooms_for_user",
         ])
@@ -1179,6 +1453,8 @@ class PresencePollingTestCase(unittest.TestCase):
             state={"presence": ONLINE}
         )
 
+        self.clock.advance_time(0)
+
         yield put_json.await_calls()
 
         # Gut-wrenching tests
@@ -1210,6 +1486,8 @@ class PresencePollingTestCase(unittest.TestCase):
 
         # reactor.iterate(delay=0)
 
+        self.clock.advance_time(0)
+
         yield put_json.await_calls()
 
         # fig goes offline
@@ -1276,6 +1554,8 @@ class PresencePollingTestCase(unittest.TestCase):
             )
         )
 
+        self.clock.advance_time(0)
+
         yield put_json.await_calls()
 
         # Gut-wrenching tests
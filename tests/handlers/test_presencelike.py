@@ -57,8 +57,10 @@ class PresenceAndProfileHandlers(object):
 class PresenceProfilelikeDataTestCase(unittest.TestCase):
 
     def setUp(self):
+        self.clock = MockClock()
+
         hs = HomeServer("test",
-                clock=MockClock(),
+                clock=self.clock,
                 db_pool=None,
                 datastore=Mock(spec=[
                     "set_presence_state",
@@ -270,6 +272,8 @@ class PresenceProfilelikeDataTestCase(unittest.TestCase):
             self.u_apple, {"presence": ONLINE}
         )
 
+        self.clock.advance_time(PresenceHandler.REMOTE_PUSH_WINDOW)
+
         self.replication.send_edu.assert_called_with(
                 destination="remote",
                 edu_type="m.presence",
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests REST events for /admin paths."""
+
+from tests import unittest
+from twisted.internet import defer
+
+from mock import Mock, NonCallableMock
+
+from ..utils import MockHttpResource
+
+from synapse.server import HomeServer
+
+PATH_PREFIX = "/_matrix/client/api/v1"
+
+
+class AdminStatsTestCase(unittest.TestCase):
+    """ Tests who may read the server's statistics. """
+
+    def setUp(self):
+        self.mock_resource = MockHttpResource(prefix=PATH_PREFIX)
+
+        hs = HomeServer("test",
+            db_pool=None,
+            http_client=None,
+            resource_for_client=self.mock_resource,
+            federation=Mock(),
+            replication_layer=Mock(),
+            datastore=None,
+            config=NonCallableMock(),
+        )
+        hs.config.admin_users = ["@admin:test"]
+
+        self.auth_user_id = "@admin:test"
+
+        def _get_user_by_token(token=None):
+            return hs.parse_userid(self.auth_user_id)
+
+        hs.get_auth().get_user_by_token = _get_user_by_token
+
+        hs.get_metrics().register("things", lambda: {"count": 3})
+
+        hs.register_servlets()
+
+    @defer.inlineCallbacks
+    def test_admin(self):
+        (code, response) = yield self.mock_resource.trigger_get(
+            "/admin/stats"
+        )
+
+        self.assertEquals(200, code)
+        self.assertEquals({"count": 3}, response["things"])
+
+    @defer.inlineCallbacks
+    def test_not_admin(self):
+        self.auth_user_id = "@someone:test"
+
+        (code, response) = yield self.mock_resource.trigger_get(
+            "/admin/stats"
+        )
+
+        self.assertEquals(403, code)
+        self.assertNotIn("things", response)
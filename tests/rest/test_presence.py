@@ -20,7 +20,7 @@ from twisted.internet import defer
 
 from mock import Mock
 
-from ..utils import MockHttpResource
+from ..utils import MockHttpResource, MockClock
 
 from synapse.api.constants import PresenceState
 from synapse.handlers.presence import PresenceHandler
@@ -47,6 +47,7 @@ class PresenceStateTestCase(unittest.TestCase):
         self.mock_resource = MockHttpResource(prefix=PATH_PREFIX)
 
         hs = HomeServer("test",
+            clock=MockClock(),
             db_pool=None,
             datastore=Mock(spec=[
                 "get_presence_state",
@@ -254,10 +255,12 @@ class PresenceEventStreamTestCase(unittest.TestCase):
                 "call_later",
                 "cancel_call_later",
                 "time_msec",
+                "time",
             ]),
         )
 
         hs.get_clock().time_msec.return_value = 1000000
+        hs.get_clock().time.return_value = 1000
 
         def _get_user_by_req(req=None):
             return hs.parse_userid(myid)
@@ -294,6 +297,16 @@ class PresenceEventStreamTestCase(unittest.TestCase):
             return defer.succeed(shared)
         self.mock_datastore.user_rooms_intersect = user_rooms_intersect
 
+        def get_users_sharing_room_with(user_id):
+            room_member_ids = map(lambda u: u.to_string(), self.room_members)
+
+            if user_id not in room_member_ids:
+                return defer.succeed(set())
+            return defer.succeed(set(room_member_ids))
+        self.mock_datastore.get_users_sharing_room_with = (
+            get_users_sharing_room_with
+        )
+
         def get_joined_hosts_for_room(room_id):
             return []
         self.mock_datastore.get_joined_hosts_for_room = get_joined_hosts_for_room
@@ -21,8 +21,10 @@ from mock import Mock, call
 
 from collections import OrderedDict
 
+import sqlite3
+
 from synapse.server import HomeServer
-from synapse.storage._base import SQLBaseStore
+from synapse.storage._base import SQLBaseStore, fingerprint_sql
 
 
 class SQLBaseStoreTestCase(unittest.TestCase):
@@ -71,6 +73,21 @@ class SQLBaseStoreTestCase(unittest.TestCase):
                 [1, 2, 3]
         )
 
+    def test_insert_many(self):
+        self.datastore._simple_insert_many_txn(
+                self.mock_txn,
+                table="tablename",
+                values=[
+                    OrderedDict([("colA", 1), ("colB", 2)]),
+                    OrderedDict([("colA", 3), ("colB", 4)]),
+                ]
+        )
+
+        self.mock_txn.executemany.assert_called_with(
+                "INSERT INTO tablename (colA, colB) VALUES(?, ?)",
+                [[1, 2], [3, 4]]
+        )
+
     @defer.inlineCallbacks
     def test_select_one_1col(self):
         self.mock_txn.rowcount = 1
@@ -139,6 +156,38 @@ class SQLBaseStoreTestCase(unittest.TestCase):
                 ["A set"]
         )
 
+    @defer.inlineCallbacks
+    def test_select_sql_cached(self):
+        self.mock_txn.fetchall.return_value = ()
+        self.mock_txn.description = (
+                ("colA", None, None, None, None, None, None),
+        )
+
+        for _ in range(2):
+            yield self.datastore._simple_select_list(
+                    table="tablename",
+                    keyvalues={"keycol": "A set"},
+                    retcols=["colA"],
+            )
+
+        first, second = self.mock_txn.execute.call_args_list
+        self.assertTrue(first[0][0] is second[0][0])
+
+    def test_cursor_to_rows(self):
+        cursor = sqlite3.connect(":memory:").cursor()
+        cursor.execute("SELECT 1 AS colA, 'two' AS colB")
+
+        rows = self.datastore.cursor_to_rows(cursor)
+
+        self.assertEquals(1, len(rows))
+        self.assertEquals(["colA", "colB"], rows[0].keys())
+        self.assertEquals(1, rows[0]["colA"])
+        self.assertEquals("two", rows[0]["colB"])
+
+        # Later queries in the same transaction get plain tuples back
+        cursor.execute("SELECT 1")
+        self.assertEquals([(1,)], cursor.fetchall())
+
     @defer.inlineCallbacks
     def test_update_one_1col(self):
         self.mock_txn.rowcount = 1
@@ -203,3 +252,78 @@ class SQLBaseStoreTestCase(unittest.TestCase):
                 "DELETE FROM tablename WHERE keycol = ?",
                 ["Go away"]
         )
+
+    @defer.inlineCallbacks
+    def test_statement_stats(self):
+        self.mock_txn.rowcount = 1
+
+        yield self.datastore._simple_insert(
+                table="tablename",
+                values={"columname": "Value"}
+        )
+        yield self.datastore._simple_insert(
+                table="tablename",
+                values={"columname": "Other value"}
+        )
+
+        stats = self.datastore._sql_stats.get_stats()
+
+        self.assertEquals(
+            2,
+            stats["statements"][
+                "INSERT INTO tablename (columname) VALUES(...)"
+            ]["count"]
+        )
+        self.assertEquals(2, stats["interactions"]["test_statement_stats"]["count"])
+
+    @defer.inlineCallbacks
+    def test_read_only_routing(self):
+        read_txn = Mock()
+        read_txn.fetchall.return_value = ()
+        read_txn.description = (
+                ("colA", None, None, None, None, None, None),
+        )
+
+        def runReadInteraction(func, *args, **kwargs):
+            return defer.succeed(func(read_txn, *args, **kwargs))
+        self.db_pool.runReadInteraction = runReadInteraction
+
+        self.mock_txn.rowcount = 1
+
+        yield self.datastore._simple_select_list(
+                table="tablename",
+                keyvalues={"keycol": "A set"},
+                retcols=["colA"],
+        )
+        yield self.datastore._simple_update_one(
+                table="tablename",
+                keyvalues={"keycol": "TheKey"},
+                updatevalues={"columnname": "New Value"}
+        )
+
+        read_txn.execute.assert_called_with(
+                "SELECT colA FROM tablename WHERE keycol = ?",
+                ["A set"]
+        )
+        self.mock_txn.execute.assert_called_with(
+                "UPDATE tablename SET columnname = ? WHERE keycol = ?",
+                ["New Value", "TheKey"]
+        )
+
+
+class FingerprintSQLTestCase(unittest.TestCase):
+
+    def test_literals(self):
+        self.assertEquals(
+            "SELECT * FROM events WHERE room_id = ? AND stream_ordering > ?",
+            fingerprint_sql(
+                "SELECT * FROM events WHERE room_id = 'abc'\n"
+                "    AND stream_ordering > 42"
+            )
+        )
+
+    def test_in_list(self):
+        self.assertEquals(
+            fingerprint_sql("SELECT a FROM t WHERE b IN (?)"),
+            fingerprint_sql("SELECT a FROM t WHERE b IN (?, ?, ?)"),
+        )
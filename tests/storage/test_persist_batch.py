@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from synapse.server import HomeServer
+from synapse.storage import DataStore
+from synapse.api.events.room import MessageEvent
+
+from tests.utils import SQLiteMemoryDbPool, MockClock
+
+
+class PersistBatchTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        db_pool = SQLiteMemoryDbPool()
+        yield db_pool.prepare()
+
+        self.clock = MockClock()
+
+        hs = HomeServer("test",
+            clock=self.clock,
+            db_pool=db_pool,
+        )
+
+        self.store = DataStore(hs,
+            persist_batch_window=1,
+            persist_batch_size=3,
+        )
+        self.event_factory = hs.get_event_factory()
+
+        # Wait for the store to finish loading before counting transactions
+        yield self.store.min_token_deferred
+
+        # The names of the functions run in each transaction from now on
+        self.transactions = []
+        run_interaction = self.store.runInteraction
+
+        def counting_run_interaction(func, *args, **kwargs):
+            self.transactions.append(func.__name__)
+            return run_interaction(func, *args, **kwargs)
+
+        self.store.runInteraction = counting_run_interaction
+
+        self.u_alice = "@alice:test"
+        self.room = "!room:test"
+
+    def create_message(self, body):
+        return self.event_factory.create_event(
+            etype=MessageEvent.TYPE,
+            room_id=self.room,
+            user_id=self.u_alice,
+            content={"msgtype": u"m.text", "body": body},
+            depth=1,
+        )
+
+    def assert_no_timers(self):
+        self.assertEquals(
+            [], [timer for timer in self.clock.timers if not timer[2]]
+        )
+
+    @defer.inlineCallbacks
+    def assert_persisted(self, *events):
+        for event in events:
+            self.assertIsNotNone(
+                (yield self.store.get_event(event.event_id, allow_none=True))
+            )
+
+    @defer.inlineCallbacks
+    def test_timer_flush(self):
+        msg1 = self.create_message(u"one")
+        msg2 = self.create_message(u"two")
+
+        d1 = self.store.persist_event(msg1)
+        d2 = self.store.persist_event(msg2)
+
+        self.assertFalse(d1.called)
+        self.assertFalse(d2.called)
+        self.assertEquals([], self.transactions)
+
+        self.clock.advance_time(1)
+
+        yield d1
+        yield d2
+
+        self.assertEquals(["persist_batch_txn"], self.transactions)
+        yield self.assert_persisted(msg1, msg2)
+
+    @defer.inlineCallbacks
+    def test_size_flush(self):
+        msgs = [self.create_message(u"msg %d" % i) for i in range(3)]
+
+        # The batch is full, so is written without waiting for the clock
+        ds = [self.store.persist_event(msg) for msg in msgs]
+        for d in ds:
+            yield d
+
+        self.assertEquals(["persist_batch_txn"], self.transactions)
+        self.assert_no_timers()
+        yield self.assert_persisted(*msgs)
+
+    @defer.inlineCallbacks
+    def test_flush_now(self):
+        msg = self.create_message(u"one")
+
+        d = self.store.persist_event(msg)
+
+        yield self.store.flush_persist_queue()
+        yield d
+
+        self.assertEquals(["persist_batch_txn"], self.transactions)
+        self.assert_no_timers()
+        yield self.assert_persisted(msg)
+
+    @defer.inlineCallbacks
+    def test_duplicate_in_batch(self):
+        msg1 = self.create_message(u"one")
+        msg2 = self.create_message(u"two")
+
+        d = self.store.persist_event(msg1)
+        self.clock.advance_time(1)
+        yield d
+
+        self.transactions = []
+
+        # msg1 is a duplicate, which rolls back the batch along with msg2,
+        # so each is written again on its own.
+        d1 = self.store.persist_event(msg1)
+        d2 = self.store.persist_event(msg2)
+        self.clock.advance_time(1)
+
+        yield d1
+        yield d2
+
+        self.assertEquals(
+            [
+                "persist_batch_txn",
+                "_persist_pdu_event_txn",
+                "_persist_pdu_event_txn",
+            ],
+            self.transactions
+        )
+        yield self.assert_persisted(msg1, msg2)
@@ -17,6 +17,7 @@
 from tests import unittest
 from twisted.internet import defer
 
+from synapse.api.errors import StoreError
 from synapse.server import HomeServer
 from synapse.storage.presence import PresenceStore
 
@@ -30,10 +31,13 @@ class PresenceStoreTestCase(unittest.TestCase):
         db_pool = SQLiteMemoryDbPool()
         yield db_pool.prepare()
 
+        self.clock = MockClock()
+
         hs = HomeServer("test",
-            clock=MockClock(),
+            clock=self.clock,
             db_pool=db_pool,
         )
+        self.hs = hs
 
         self.store = PresenceStore(hs)
 
@@ -66,6 +70,92 @@ class PresenceStoreTestCase(unittest.TestCase):
             {"state": "online", "status_msg": "Here", "mtime": 1000000}, state
         )
 
+    @defer.inlineCallbacks
+    def test_write_behind(self):
+        self.store._presence_flush_interval = 1
+
+        yield self.store.create_presence(self.u_apple.localpart)
+
+        yield self.store.set_presence_state(
+            self.u_apple.localpart, {"state": "online", "status_msg": "Here"}
+        )
+        yield self.store.set_presence_state(
+            self.u_apple.localpart,
+            {"state": "unavailable", "status_msg": "Away"}
+        )
+
+        self.assertEquals(
+            {"state": "unavailable", "status_msg": "Away", "mtime": 1000000},
+            (yield self.store.get_presence_state(self.u_apple.localpart))
+        )
+
+        # A server starting up again from the database, e.g. after a crash,
+        # only sees what has been flushed so far.
+        restarted = PresenceStore(self.hs)
+
+        self.assertEquals(
+            {"state": None, "status_msg": None, "mtime": None},
+            (yield restarted.get_presence_state(self.u_apple.localpart))
+        )
+
+        self.clock.advance_time(1)
+
+        self.assertEquals(
+            {"state": "unavailable", "status_msg": "Away", "mtime": 1000000},
+            (yield restarted.get_presence_state(self.u_apple.localpart))
+        )
+
+    @defer.inlineCallbacks
+    def test_write_behind_during_flush(self):
+        self.store._presence_flush_interval = 1
+
+        yield self.store.create_presence(self.u_apple.localpart)
+
+        yield self.store.set_presence_state(
+            self.u_apple.localpart, {"state": "online", "status_msg": "Here"}
+        )
+
+        # Hold the flush's transaction back until we say so
+        run_interaction = self.store.runInteraction
+        write_allowed = defer.Deferred()
+
+        def slow_run_interaction(func, *args, **kwargs):
+            if func == self.store._set_presence_states_txn:
+                return write_allowed.addCallback(
+                    lambda _: run_interaction(func, *args, **kwargs)
+                )
+            return run_interaction(func, *args, **kwargs)
+
+        self.store.runInteraction = slow_run_interaction
+
+        flushed = self.store.flush_presence()
+
+        self.assertEquals(
+            {"state": "online", "status_msg": "Here", "mtime": 1000000},
+            (yield self.store.get_presence_state(self.u_apple.localpart))
+        )
+
+        write_allowed.callback(None)
+        yield flushed
+
+        self.assertFalse(self.store._presence_flushing)
+        self.assertEquals(
+            {"state": "online", "status_msg": "Here", "mtime": 1000000},
+            (yield self.store.get_presence_state(self.u_apple.localpart))
+        )
+
+    @defer.inlineCallbacks
+    def test_write_behind_unknown_user(self):
+        self.store._presence_flush_interval = 1
+
+        yield self.assertFailure(
+            self.store.set_presence_state(
+                self.u_banana.localpart,
+                {"state": "online", "status_msg": "Here"}
+            ),
+            StoreError
+        )
+
     @defer.inlineCallbacks
     def test_visibility(self):
         self.assertFalse((yield self.store.is_presence_visible(
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from synapse.server import HomeServer
+from synapse.api.constants import Membership
+from synapse.api.events.room import (
+    MessageEvent, RoomMemberEvent, RoomTopicEvent,
+)
+
+from tests.utils import SQLiteMemoryDbPool
+
+
+# Queries which are allowed to scan a table or sort into a temporary b-tree,
+# keyed by a fragment of their SQL.
+ALLOWED_PLANS = {
+    # Merges the events from each of the user's rooms with their membership
+    # events, so has to sort the (LIMITed) result by stream_ordering.
+    "(room_id IN (SELECT m.room_id FROM room_memberships":
+        "stream merges events from several rooms",
+    # Counts the rooms the users have in common.
+    "GROUP BY m.room_id HAVING COUNT(m.room_id)":
+        "user_rooms_intersect aggregates over all of the users' rooms",
+    # Run once at startup to load the membership graph.
+    "SELECT m.user_id, m.room_id FROM room_memberships":
+        "loads every joined membership",
+}
+
+
+class _RecordingTransaction(object):
+    """ Wraps a DB-API cursor, recording every statement executed on it. """
+
+    def __init__(self, txn, statements):
+        self._txn = txn
+        self._statements = statements
+
+    def execute(self, sql, *args):
+        self._statements.append((sql, tuple(args[0]) if args else ()))
+        return self._txn.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._txn, name)
+
+
+class RecordingDbPool(SQLiteMemoryDbPool):
+    def __init__(self):
+        super(RecordingDbPool, self).__init__()
+        self.statements = []
+
+    def runInteraction(self, func, *args, **kwargs):
+        def interaction(txn, *args, **kwargs):
+            return func(
+                _RecordingTransaction(txn, self.statements), *args, **kwargs
+            )
+
+        return super(RecordingDbPool, self).runInteraction(
+            interaction, *args, **kwargs
+        )
+
+    def explain(self, sql, args):
+        def explain(conn):
+            c = conn.cursor()
+            c.execute("EXPLAIN QUERY PLAN " + sql, args)
+            return [r[-1] for r in c.fetchall()]
+
+        return self.runWithConnection(explain)
+
+
+class QueryPlanTestCase(unittest.TestCase):
+    """ Runs EXPLAIN QUERY PLAN on the SELECTs the store makes and checks
+    that none of them scan a whole table or sort their results into a
+    temporary b-tree, i.e. that there is an index for each of them.
+    """
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.db_pool = RecordingDbPool()
+        yield self.db_pool.prepare()
+
+        hs = HomeServer("test",
+            db_pool=self.db_pool,
+        )
+
+        self.store = hs.get_datastore()
+        self.event_factory = hs.get_event_factory()
+
+        self.room_id = "!abc123:test"
+        self.u_alice = "@alice:test"
+        self.u_bob = "@bob:test"
+
+    def inject_event(self, **kwargs):
+        return self.store.persist_event(
+            self.event_factory.create_event(room_id=self.room_id, **kwargs)
+        )
+
+    @defer.inlineCallbacks
+    def inject_room(self):
+        for user_id in [self.u_alice, self.u_bob]:
+            yield self.inject_event(
+                etype=RoomMemberEvent.TYPE,
+                user_id=user_id,
+                state_key=user_id,
+                membership=Membership.JOIN,
+                content={"membership": Membership.JOIN},
+                depth=1,
+            )
+
+        for i in range(3):
+            yield self.inject_event(
+                etype=MessageEvent.TYPE,
+                user_id=self.u_alice,
+                content={"msgtype": u"m.text", "body": u"Message %d" % i},
+                depth=2 + i,
+            )
+
+        yield self.inject_event(
+            etype=RoomTopicEvent.TYPE,
+            user_id=self.u_alice,
+            state_key="",
+            content={"topic": u"A topic"},
+            depth=5,
+        )
+
+    @defer.inlineCallbacks
+    def assert_indexed(self):
+        explained = set()
+        for sql, args in list(self.db_pool.statements):
+            if not sql.lstrip().upper().startswith("SELECT"):
+                continue
+            if sql in explained:
+                continue
+            explained.add(sql)
+
+            if any(fragment in sql for fragment in ALLOWED_PLANS):
+                continue
+
+            plan = yield self.db_pool.explain(sql, args)
+            for line in plan:
+                # Older versions of sqlite say "SCAN TABLE". Reading back the
+                # rows of a subquery in FROM is fine; the subquery's own plan
+                # gets checked too.
+                if line.startswith(("SCAN (subquery", "SCAN SUBQUERY")):
+                    continue
+                if line.startswith("SCAN") or "TEMP B-TREE" in line:
+                    self.fail("%r has plan %r" % (sql, plan))
+
+    @defer.inlineCallbacks
+    def test_room_queries(self):
+        yield self.inject_room()
+
+        yield self.store.get_room_member(self.u_alice, self.room_id)
+        yield self.store.get_room_members(self.room_id)
+        yield self.store.get_rooms_for_user_where_membership_is(
+            self.u_alice, [Membership.JOIN]
+        )
+        yield self.store.get_rooms_for_user(self.u_alice)
+        yield self.store.get_users_in_room(self.room_id)
+        yield self.store.get_joined_hosts_for_room(self.room_id)
+        yield self.store.user_rooms_intersect([self.u_alice, self.u_bob])
+
+        yield self.store.get_current_state(self.room_id)
+        yield self.store.get_current_state_for_rooms([self.room_id])
+        yield self.store.get_current_state(
+            self.room_id, RoomTopicEvent.TYPE, ""
+        )
+        yield self.store.snapshot_room(
+            self.room_id, self.u_alice, RoomTopicEvent.TYPE, ""
+        )
+
+        yield self.assert_indexed()
+
+    @defer.inlineCallbacks
+    def test_stream_queries(self):
+        yield self.inject_room()
+
+        max_id = yield self.store.get_room_events_max_id()
+
+        yield self.store.get_room_events_stream(
+            self.u_alice, "s0", max_id, None
+        )
+        yield self.store.paginate_room_events(
+            self.room_id, max_id, "s0", "b", 10
+        )
+        yield self.store.paginate_room_events(
+            self.room_id, "t2-3", None, "f", 10
+        )
+        yield self.store.get_recent_events_for_room(
+            self.room_id, limit=10, with_feedback=False, end_token=max_id
+        )
+        yield self.store.get_recent_events_for_rooms(
+            [self.room_id, "!other:test"], limit=10, end_token=max_id
+        )
+
+        yield self.assert_indexed()
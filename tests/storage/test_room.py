@@ -172,5 +172,31 @@ class RoomEventsStoreTestCase(unittest.TestCase):
             state[0]
         )
 
+    @defer.inlineCallbacks
+    def test_current_state_for_rooms(self):
+        topic = u"A place for things"
+
+        yield self.inject_room_event(
+            etype=RoomTopicEvent.TYPE,
+            topic=topic,
+            content={"topic": topic},
+            depth=1,
+        )
+
+        other_room = "!other:test"
+
+        states = yield self.store.get_current_state_for_rooms(
+            [self.room.to_string(), other_room]
+        )
+
+        self.assertEquals([], states[other_room])
+        self.assertEquals(1, len(states[self.room.to_string()]))
+        self.assertObjectHasAttributes(
+            {"type": "m.room.topic",
+             "room_id": self.room.to_string(),
+             "topic": topic},
+            states[self.room.to_string()][0]
+        )
+
     # Not testing the various 'level' methods for now because there's lots
     # of them and need coalescing; see JIRA SPEC-11
@@ -17,6 +17,8 @@
 from tests import unittest
 from twisted.internet import defer
 
+from mock import Mock
+
 from synapse.server import HomeServer
 from synapse.api.constants import Membership
 from synapse.api.events.room import RoomMemberEvent
@@ -34,6 +36,7 @@ class RoomMemberStoreTestCase(unittest.TestCase):
         hs = HomeServer("test",
             db_pool=db_pool,
         )
+        self.hs = hs
 
         # We can't test the RoomMemberStore on its own without the other event
         # storage logic
@@ -49,7 +52,7 @@ class RoomMemberStoreTestCase(unittest.TestCase):
         self.room = hs.parse_roomid("!abc123:test")
 
     @defer.inlineCallbacks
-    def inject_room_member(self, room, user, membership):
+    def inject_room_member(self, room, user, membership, **kwargs):
         # Have to create a join event using the eventfactory
         yield self.store.persist_event(
             self.event_factory.create_event(
@@ -60,7 +63,8 @@ class RoomMemberStoreTestCase(unittest.TestCase):
                 membership=membership,
                 content={"membership": membership},
                 depth=1,
-            )
+            ),
+            **kwargs
         )
 
     @defer.inlineCallbacks
@@ -111,6 +115,58 @@ class RoomMemberStoreTestCase(unittest.TestCase):
             ))
         )
 
+    @defer.inlineCallbacks
+    def test_membership_graph(self):
+        yield self.inject_room_member(self.room, self.u_alice, Membership.JOIN)
+        yield self.inject_room_member(self.room, self.u_bob, Membership.JOIN)
+
+        self.assertTrue(self.store._membership_graph.loaded)
+        self.assertEquals(
+            set([self.u_alice.to_string(), self.u_bob.to_string()]),
+            (yield self.store.get_users_sharing_room_with(
+                self.u_alice.to_string()
+            ))
+        )
+
+        yield self.inject_room_member(self.room, self.u_bob, Membership.LEAVE)
+
+        self.assertFalse(
+            (yield self.store.user_rooms_intersect(
+                [self.u_alice.to_string(), self.u_bob.to_string()]
+            ))
+        )
+        self.assertEquals(
+            set(),
+            (yield self.store.get_users_sharing_room_with(
+                self.u_bob.to_string()
+            ))
+        )
+
+    @defer.inlineCallbacks
+    def test_membership_graph_ignores_old_state(self):
+        yield self.inject_room_member(self.room, self.u_alice, Membership.JOIN)
+        yield self.inject_room_member(self.room, self.u_bob, Membership.JOIN)
+
+        # Neither of these is the current membership
+        yield self.inject_room_member(
+            self.room, self.u_bob, Membership.LEAVE, backfilled=True
+        )
+        yield self.inject_room_member(
+            self.room, self.u_alice, Membership.LEAVE, is_new_state=False
+        )
+
+        self.assertEquals(
+            frozenset([self.u_alice.to_string(), self.u_bob.to_string()]),
+            self.store._membership_graph.get_users_in_room(
+                self.room.to_string()
+            )
+        )
+        self.assertTrue(
+            (yield self.store.user_rooms_intersect(
+                [self.u_alice.to_string(), self.u_bob.to_string()]
+            ))
+        )
+
     @defer.inlineCallbacks
     def test_room_hosts(self):
         yield self.inject_room_member(self.room, self.u_alice, Membership.JOIN)
@@ -155,3 +211,92 @@ class RoomMemberStoreTestCase(unittest.TestCase):
             ["test"],
             (yield self.store.get_joined_hosts_for_room(self.room.to_string()))
         )
+
+    @defer.inlineCallbacks
+    def test_rooms_for_user(self):
+        room2 = self.hs.parse_roomid("!def456:test")
+
+        self.assertEquals(
+            frozenset(),
+            (yield self.store.get_rooms_for_user(self.u_alice.to_string()))
+        )
+
+        yield self.inject_room_member(self.room, self.u_alice, Membership.JOIN)
+        yield self.inject_room_member(room2, self.u_alice, Membership.JOIN)
+
+        self.assertEquals(
+            {self.room.to_string(), room2.to_string()},
+            (yield self.store.get_rooms_for_user(self.u_alice.to_string()))
+        )
+
+        # A cache hit doesn't touch the database
+        self.store.runInteraction = Mock()
+        self.assertEquals(
+            {self.room.to_string(), room2.to_string()},
+            (yield self.store.get_rooms_for_user(self.u_alice.to_string()))
+        )
+        self.assertFalse(self.store.runInteraction.called)
+        del self.store.runInteraction
+
+        yield self.inject_room_member(self.room, self.u_alice, Membership.LEAVE)
+
+        self.assertEquals(
+            {room2.to_string()},
+            (yield self.store.get_rooms_for_user(self.u_alice.to_string()))
+        )
+
+    @defer.inlineCallbacks
+    def test_users_in_room(self):
+        room_id = self.room.to_string()
+
+        yield self.inject_room_member(self.room, self.u_alice, Membership.JOIN)
+        yield self.inject_room_member(self.room, self.u_charlie, Membership.JOIN)
+
+        self.assertEquals(
+            {self.u_alice.to_string(), self.u_charlie.to_string()},
+            (yield self.store.get_users_in_room(room_id))
+        )
+
+        # The hosts come from the same cache entry as the users
+        self.store.runInteraction = Mock()
+        self.assertEquals(
+            {"test", "elsewhere"},
+            set((yield self.store.get_joined_hosts_for_room(room_id)))
+        )
+        self.assertFalse(self.store.runInteraction.called)
+        del self.store.runInteraction
+
+        # A remote user leaving updates both
+        yield self.inject_room_member(
+            self.room, self.u_charlie, Membership.LEAVE
+        )
+
+        self.assertEquals(
+            {self.u_alice.to_string()},
+            (yield self.store.get_users_in_room(room_id))
+        )
+        self.assertEquals(
+            ["test"],
+            (yield self.store.get_joined_hosts_for_room(room_id))
+        )
+
+    @defer.inlineCallbacks
+    def test_users_in_room_eviction(self):
+        room2 = self.hs.parse_roomid("!def456:test")
+
+        self.store._room_members_cache.max_size = 2
+
+        yield self.inject_room_member(self.room, self.u_alice, Membership.JOIN)
+        yield self.inject_room_member(self.room, self.u_bob, Membership.JOIN)
+        yield self.inject_room_member(room2, self.u_alice, Membership.JOIN)
+
+        yield self.store.get_users_in_room(self.room.to_string())
+        self.assertIn(self.room.to_string(), self.store._room_members_cache)
+
+        # Both rooms together have too many members to keep cached, so the
+        # colder one goes.
+        yield self.store.get_users_in_room(room2.to_string())
+        self.assertIn(room2.to_string(), self.store._room_members_cache)
+        self.assertNotIn(
+            self.room.to_string(), self.store._room_members_cache
+        )
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from mock import Mock, patch
+
+from synapse.server import HomeServer
+from synapse.api.constants import Membership
+from synapse.api.events.room import MessageEvent, RoomMemberEvent
+
+from tests.utils import SQLiteMemoryDbPool
+
+
+class StreamStoreTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        db_pool = SQLiteMemoryDbPool()
+        yield db_pool.prepare()
+
+        hs = HomeServer("test",
+            db_pool=db_pool,
+        )
+
+        self.store = hs.get_datastore()
+        self.event_factory = hs.get_event_factory()
+
+        self.u_alice = "@alice:test"
+        self.u_bob = "@bob:test"
+
+        self.room1 = "!room1:test"
+        self.room2 = "!room2:test"
+
+    @defer.inlineCallbacks
+    def inject_event(self, **kwargs):
+        event = self.event_factory.create_event(**kwargs)
+        yield self.store.persist_event(event)
+        defer.returnValue(event)
+
+    def inject_join(self, room_id, user_id):
+        return self.inject_event(
+            etype=RoomMemberEvent.TYPE,
+            room_id=room_id,
+            user_id=user_id,
+            state_key=user_id,
+            membership=Membership.JOIN,
+            content={"membership": Membership.JOIN},
+            depth=1,
+        )
+
+    def inject_message(self, room_id, user_id, body):
+        return self.inject_event(
+            etype=MessageEvent.TYPE,
+            room_id=room_id,
+            user_id=user_id,
+            content={"msgtype": u"m.text", "body": body},
+            depth=1,
+        )
+
+    @defer.inlineCallbacks
+    def test_stream_for_many(self):
+        yield self.inject_join(self.room1, self.u_alice)
+        yield self.inject_join(self.room2, self.u_alice)
+
+        start = yield self.store.get_room_events_max_id()
+
+        msg1 = yield self.inject_message(self.room1, self.u_alice, u"one")
+        middle = yield self.store.get_room_events_max_id()
+
+        invite = yield self.inject_event(
+            etype=RoomMemberEvent.TYPE,
+            room_id=self.room1,
+            user_id=self.u_alice,
+            state_key=self.u_bob,
+            membership=Membership.INVITE,
+            content={"membership": Membership.INVITE},
+            depth=2,
+        )
+        msg2 = yield self.inject_message(self.room2, self.u_alice, u"two")
+
+        end = yield self.store.get_room_events_max_id()
+
+        def in_rooms(*room_ids):
+            return lambda event: event.room_id in room_ids
+
+        def invites_for(user_id):
+            return lambda event: getattr(event, "state_key", None) == user_id
+
+        requests = [
+            (self.u_alice, start, 10, in_rooms(self.room1)),
+            (self.u_alice, middle, 10, in_rooms(self.room1, self.room2)),
+            (self.u_bob, start, 10, invites_for(self.u_bob)),
+            (self.u_alice, end, 10, in_rooms(self.room1)),
+            (self.u_alice, "not a token", 10, in_rooms(self.room1)),
+        ]
+        expected = [
+            ([msg1.event_id, invite.event_id], end),
+            ([invite.event_id, msg2.event_id], end),
+            ([invite.event_id], end),
+            ([], end),
+            ([], "not a token"),
+        ]
+
+        results = yield self.store.get_room_events_stream_for_many(
+            requests, to_key=end,
+        )
+        self.assertEquals(
+            expected,
+            [([e.event_id for e in events], key) for events, key in results]
+        )
+
+        # The same, with alice's and bob's requests from the same token
+        # split between queries.
+        with patch("synapse.storage.stream._USERS_PER_STREAM_QUERY", 1):
+            results = yield self.store.get_room_events_stream_for_many(
+                requests, to_key=end,
+            )
+        self.assertEquals(
+            expected,
+            [([e.event_id for e in events], key) for events, key in results]
+        )
+
+    @defer.inlineCallbacks
+    def test_stream_for_many_slow_listener(self):
+        yield self.inject_join(self.room1, self.u_alice)
+
+        slow = yield self.store.get_room_events_max_id()
+
+        for i in range(4):
+            yield self.inject_message(self.room1, self.u_alice, u"old %d" % i)
+
+        fast = yield self.store.get_room_events_max_id()
+
+        new = []
+        for i in range(2):
+            event = yield self.inject_message(
+                self.room1, self.u_alice, u"new %d" % i
+            )
+            new.append(event.event_id)
+
+        end = yield self.store.get_room_events_max_id()
+
+        def everything(event):
+            return True
+
+        with patch("synapse.storage.stream.MAX_STREAM_SIZE", 2):
+            results = yield self.store.get_room_events_stream_for_many(
+                [
+                    (self.u_alice, slow, 2, everything),
+                    (self.u_alice, fast, 2, everything),
+                    (self.u_alice, fast, 2, everything),
+                ],
+                to_key=end,
+            )
+
+        slow_events, slow_key = results[0]
+        self.assertEquals(2, len(slow_events))
+        self.assertTrue(int(slow_key[1:]) < int(fast[1:]))
+
+        # The slow listener's backlog doesn't hide the new events from the
+        # listeners that are up to date.
+        for events, key in results[1:]:
+            self.assertEquals(new, [e.event_id for e in events])
+            self.assertEquals(end, key)
+
+    @defer.inlineCallbacks
+    def test_stream_for_many_busy_other_room(self):
+        yield self.inject_join(self.room1, self.u_alice)
+        yield self.inject_join(self.room2, self.u_bob)
+
+        start = yield self.store.get_room_events_max_id()
+
+        for i in range(4):
+            yield self.inject_message(self.room2, self.u_bob, u"busy %d" % i)
+        msg = yield self.inject_message(self.room1, self.u_alice, u"hi")
+
+        end = yield self.store.get_room_events_max_id()
+
+        def in_room1(event):
+            return event.room_id == self.room1
+
+        # Bob's room has more new events than fit in a query, but they
+        # aren't fetched for alice at all, so don't hide hers.
+        with patch("synapse.storage.stream.MAX_STREAM_SIZE", 2):
+            results = yield self.store.get_room_events_stream_for_many(
+                [(self.u_alice, start, 2, in_room1)],
+                to_key=end,
+            )
+
+        self.assertEquals(
+            [([msg.event_id], end)],
+            [([e.event_id for e in events], key) for events, key in results]
+        )
+
+    @defer.inlineCallbacks
+    def test_may_have_changed(self):
+        # Let the store find out where the stream starts
+        yield self.store._init_stream_change_caches()
+
+        start = yield self.store.get_room_events_max_id()
+
+        self.assertFalse(
+            self.store.room_events_may_have_changed(self.u_alice, start)
+        )
+
+        yield self.inject_message(self.room1, self.u_bob, u"one")
+
+        self.assertTrue(
+            self.store.room_events_may_have_changed(self.u_alice, start)
+        )
+        self.assertTrue(self.store.room_events_may_have_changed(
+            self.u_alice, start, room_ids=[self.room1]
+        ))
+        self.assertFalse(self.store.room_events_may_have_changed(
+            self.u_alice, start, room_ids=[self.room2]
+        ))
+
+        # Tokens from before the cache knew about the stream go to the DB
+        self.assertTrue(self.store.room_events_may_have_changed(
+            self.u_alice, "s-10", room_ids=[self.room2]
+        ))
+
+        # Invites for a user are changes for them, whatever their rooms
+        yield self.inject_event(
+            etype=RoomMemberEvent.TYPE,
+            room_id=self.room1,
+            user_id=self.u_bob,
+            state_key=self.u_alice,
+            membership=Membership.INVITE,
+            content={"membership": Membership.INVITE},
+            depth=2,
+        )
+
+        self.assertTrue(self.store.room_events_may_have_changed(
+            self.u_alice, start, room_ids=[self.room2]
+        ))
+
+    @defer.inlineCallbacks
+    def test_stream_short_circuits(self):
+        yield self.store._init_stream_change_caches()
+
+        yield self.inject_message(self.room1, self.u_alice, u"one")
+        end = yield self.store.get_room_events_max_id()
+
+        self.store._execute_and_decode = Mock()
+
+        events, key = yield self.store.get_room_events_stream(
+            self.u_alice, end, "s%d" % (int(end[1:]) + 1), None
+        )
+
+        self.assertEquals([], events)
+        self.assertEquals(end, key)
+        self.assertFalse(self.store._execute_and_decode.called)
+
+    @defer.inlineCallbacks
+    def test_max_id_tracked(self):
+        yield self.store._init_stream_change_caches()
+
+        yield self.inject_message(self.room1, self.u_alice, u"one")
+        yield self.inject_message(self.room2, self.u_alice, u"two")
+
+        from_db = yield self.store.runInteraction(
+            self.store._get_room_events_max_id_txn
+        )
+
+        self.store.runInteraction = Mock()
+        max_id = yield self.store.get_room_events_max_id()
+
+        self.assertEquals(from_db, max_id)
+        self.assertFalse(self.store.runInteraction.called)
+
+    @defer.inlineCallbacks
+    def test_recent_events_for_rooms(self):
+        msgs1 = []
+        for body in (u"one", u"two", u"three"):
+            msgs1.append((yield self.inject_message(
+                self.room1, self.u_alice, body
+            )))
+        msg2 = yield self.inject_message(self.room2, self.u_alice, u"four")
+
+        end = yield self.store.get_room_events_max_id()
+        room3 = "!room3:test"
+
+        results = yield self.store.get_recent_events_for_rooms(
+            [self.room1, self.room2, room3], limit=2, end_token=end
+        )
+
+        self.assertEquals(
+            [m.event_id for m in msgs1[1:]],
+            [e.event_id for e in results[self.room1][0]]
+        )
+        self.assertEquals(end, results[self.room1][1][1])
+
+        self.assertEquals(
+            [msg2.event_id], [e.event_id for e in results[self.room2][0]]
+        )
+        self.assertEquals(([], (end, end)), results[room3])
+
+        # The single room version gives the same answer
+        single = yield self.store.get_recent_events_for_room(
+            self.room1, limit=2, end_token=end
+        )
+        self.assertEquals(results[self.room1][1], single[1])
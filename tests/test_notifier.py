@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tests import unittest
+from twisted.internet import defer
+
+from mock import Mock
+
+from synapse.api.errors import SynapseError
+from synapse.notifier import Notifier
+from synapse.streams.events import EventSources
+from synapse.types import StreamToken
+
+
+class NotifierTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sources = {}
+        for name in ("room", "presence", "typing"):
+            source = Mock(spec=[
+                "get_current_key",
+                "get_new_events_for_user",
+                "may_have_new_events_for_user",
+            ])
+            source.get_new_events_for_user.return_value = defer.Deferred()
+            source.may_have_new_events_for_user.return_value = True
+            self.sources[name] = source
+
+        event_sources = Mock(spec=["sources", "get_current_token"])
+        event_sources.sources = self.sources
+
+        hs = Mock(spec=[
+            "get_event_sources",
+            "get_clock",
+            "get_metrics",
+            "get_distributor",
+        ])
+        hs.get_event_sources.return_value = event_sources
+
+        self.notifier = Notifier(hs)
+
+        self.from_token = StreamToken("s1", "1", "1")
+
+    def get_events(self, limit):
+        deferred = defer.Deferred()
+
+        self.notifier._get_events(
+            deferred, "@alice:test", ["!room:test"], self.from_token,
+            limit, timeout=0,
+        ).addErrback(deferred.errback)
+
+        return deferred
+
+    def test_sources_polled_concurrently(self):
+        d = self.get_events(limit=10)
+
+        # Every source has been asked before any of them has answered.
+        for source in self.sources.values():
+            self.assertTrue(source.get_new_events_for_user.called)
+
+        # Each is asked for up to the whole limit.
+        for source in self.sources.values():
+            self.assertEquals(
+                10, source.get_new_events_for_user.call_args[0][2]
+            )
+
+        self.assertFalse(d.called)
+
+        self.sources["room"].get_new_events_for_user.return_value.callback(
+            (["room event"], "s2")
+        )
+        self.sources["presence"].get_new_events_for_user.return_value.callback(
+            ([], "1")
+        )
+        self.sources["typing"].get_new_events_for_user.return_value.callback(
+            (["typing event"], "2")
+        )
+
+        self.assertTrue(d.called)
+
+        events, (start, end) = d.result
+        self.assertEquals(
+            set(["room event", "typing event"]), set(events)
+        )
+        self.assertEquals(self.from_token, start)
+        self.assertEquals(StreamToken("s2", "1", "2"), end)
+
+    def test_unchanged_room_source_skipped(self):
+        self.sources["room"].may_have_new_events_for_user.return_value = False
+
+        self.get_events(limit=10)
+
+        self.assertFalse(self.sources["room"].get_new_events_for_user.called)
+        for name in ("presence", "typing"):
+            self.assertTrue(
+                self.sources[name].get_new_events_for_user.called
+            )
+
+    def answer(self, **results):
+        for name, result in results.items():
+            self.sources[name].get_new_events_for_user.return_value.callback(
+                result
+            )
+
+    def test_limit_below_sources(self):
+        d = self.get_events(limit=1)
+
+        # Everything is asked, even though only one event can be returned
+        for source in self.sources.values():
+            self.assertEquals(
+                1, source.get_new_events_for_user.call_args[0][2]
+            )
+
+        # The room has nothing new, so presence isn't held back by it
+        self.answer(
+            room=([], "s1"),
+            presence=(["presence event"], "2"),
+            typing=([], "1"),
+        )
+
+        events, (start, end) = d.result
+        self.assertEquals(["presence event"], events)
+        self.assertEquals(StreamToken("s1", "2", "1"), end)
+
+    def test_limit_leaves_sources_that_dont_fit(self):
+        d = self.get_events(limit=2)
+
+        self.answer(
+            room=(["room 1", "room 2"], "s3"),
+            presence=(["presence event"], "2"),
+            typing=(["typing event"], "2"),
+        )
+
+        # The room's events don't fit alongside the others, so it stays at
+        # its old key to be fetched again next time.
+        events, (start, end) = d.result
+        self.assertEquals(
+            set(["presence event", "typing event"]), set(events)
+        )
+        self.assertEquals(StreamToken("s1", "2", "2"), end)
+
+    def test_limit_first_source_always_sent(self):
+        d = self.get_events(limit=1)
+
+        # More than the limit, but nothing else has anything to send
+        self.answer(
+            room=(["room 1", "room 2"], "s3"),
+            presence=([], "1"),
+            typing=([], "1"),
+        )
+
+        events, (start, end) = d.result
+        self.assertEquals(["room 1", "room 2"], events)
+        self.assertEquals(StreamToken("s3", "1", "1"), end)
+
+    def test_source_error_not_wrapped(self):
+        d = self.get_events(limit=10)
+
+        self.sources["presence"].get_new_events_for_user.return_value.errback(
+            SynapseError(400, "Bad token")
+        )
+        for name in ("room", "typing"):
+            self.sources[name].get_new_events_for_user.return_value.callback(
+                ([], "1")
+            )
+
+        errors = []
+        d.addErrback(errors.append)
+
+        self.assertEquals(1, len(errors))
+        self.assertTrue(errors[0].check(SynapseError))
+
+
+class CoalescingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.pending_calls = []
+
+        clock = Mock(spec=["call_later", "cancel_call_later", "time"])
+        clock.time.return_value = 0
+        clock.call_later.side_effect = (
+            lambda delay, callback: self.pending_calls.append(
+                (delay, callback)
+            )
+        )
+
+        self.room_source = Mock(spec=[
+            "get_new_events_for_user",
+            "get_new_events_for_users",
+            "may_have_new_events_for_user",
+        ])
+        self.room_source.get_new_events_for_user.return_value = (
+            defer.succeed(([], "s1"))
+        )
+        self.room_source.may_have_new_events_for_user.return_value = True
+
+        event_sources = Mock(spec=["sources", "get_current_token"])
+        event_sources.sources = {"room": self.room_source}
+
+        hs = Mock(spec=[
+            "get_event_sources",
+            "get_clock",
+            "get_metrics",
+            "get_distributor",
+        ])
+        hs.get_event_sources.return_value = event_sources
+        hs.get_clock.return_value = clock
+
+        self.window = 0.01
+        self.notifier = Notifier(hs, coalesce_window=self.window)
+
+        self.room_id = "!room:test"
+
+    def coalescing_calls(self):
+        # Ignore the calls the notifier makes to time out its listeners.
+        return [
+            callback for delay, callback in self.pending_calls
+            if delay == self.window
+        ]
+
+    def run_coalescing_calls(self):
+        for callback in self.coalescing_calls():
+            self.pending_calls.remove((self.window, callback))
+            callback()
+
+    def test_burst_coalesced(self):
+        deferred = defer.Deferred()
+        self.notifier._get_events(
+            deferred, "@alice:test", [self.room_id],
+            StreamToken("s1", "1", "1"), 10, timeout=30000,
+        )
+
+        self.room_source.get_new_events_for_users.return_value = (
+            defer.succeed([(["one", "two", "three"], "s4")])
+        )
+
+        for _ in range(3):
+            self.notifier.on_new_room_event(
+                Mock(room_id=self.room_id), extra_users=[]
+            )
+
+        # Nothing is woken up, or fetched, until the window has passed.
+        self.assertFalse(deferred.called)
+        self.assertFalse(self.room_source.get_new_events_for_users.called)
+        self.assertEquals(1, len(self.coalescing_calls()))
+
+        self.run_coalescing_calls()
+
+        self.assertEquals(
+            1, self.room_source.get_new_events_for_users.call_count
+        )
+
+        events, (start, end) = deferred.result
+        self.assertEquals(["one", "two", "three"], events)
+        self.assertEquals("s4", end.room_key)
+
+    def test_extra_users_woken(self):
+        deferred = defer.Deferred()
+        self.notifier._get_events(
+            deferred, "@bob:test", [], StreamToken("s1", "1", "1"), 10,
+            timeout=30000,
+        )
+
+        self.room_source.get_new_events_for_users.return_value = (
+            defer.succeed([(["invite"], "s2")])
+        )
+
+        self.notifier.on_new_room_event(
+            Mock(room_id=self.room_id), extra_users=["@bob:test"]
+        )
+        self.notifier.on_new_room_event(
+            Mock(room_id=self.room_id), extra_users=[]
+        )
+
+        self.run_coalescing_calls()
+
+        events, _ = deferred.result
+        self.assertEquals(["invite"], events)
+
+
+class EventSourcesTestCase(unittest.TestCase):
+
+    def test_current_token_concurrent(self):
+        event_sources = EventSources(Mock())
+
+        deferreds = {}
+        for name in ("room", "presence", "typing"):
+            deferreds[name] = defer.Deferred()
+            event_sources.sources[name] = Mock(spec=["get_current_key"])
+            event_sources.sources[name].get_current_key.return_value = (
+                deferreds[name]
+            )
+
+        d = event_sources.get_current_token()
+
+        for source in event_sources.sources.values():
+            self.assertTrue(source.get_current_key.called)
+
+        deferreds["typing"].callback("3")
+        deferreds["room"].callback("s1")
+        deferreds["presence"].callback("2")
+
+        self.assertEquals(StreamToken("s1", "2", "3"), d.result)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+
+from synapse.util.frozenutils import freeze, unfreeze
+
+import copy
+import json
+
+
+class FreezeTestCase(unittest.TestCase):
+
+    def test_immutable(self):
+        frozen = freeze({"a": {"b": [1, 2]}})
+
+        self.assertRaises(TypeError, frozen.__setitem__, "c", 3)
+        self.assertRaises(TypeError, frozen["a"].update, {"c": 3})
+        self.assertRaises(TypeError, frozen["a"]["b"].append, 3)
+
+    def test_equality(self):
+        d = {"a": {"b": [1, 2]}, "c": u"d"}
+        frozen = freeze(d)
+
+        self.assertEquals(d, frozen)
+        self.assertEquals(json.dumps(d, sort_keys=True),
+                          json.dumps(frozen, sort_keys=True))
+
+    def test_shared(self):
+        frozen = freeze({"a": [1]})
+
+        self.assertTrue(freeze(frozen) is frozen)
+        self.assertTrue(copy.deepcopy(frozen) is frozen)
+
+    def test_unfreeze(self):
+        thawed = unfreeze(freeze({"a": {"b": [1, 2]}}))
+
+        thawed["a"]["b"].append(3)
+        self.assertEquals({"a": {"b": [1, 2, 3]}}, thawed)
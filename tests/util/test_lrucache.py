@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+
+from synapse.util.lrucache import LruCache
+
+
+class LruCacheTestCase(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = LruCache(max_entries=10)
+        cache.set("key", "value")
+
+        self.assertEquals("value", cache.get("key"))
+        self.assertEquals(None, cache.get("other"))
+        self.assertEquals("default", cache.get("other", "default"))
+
+    def test_evict_entries(self):
+        cache = LruCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        # Touch "a" so that "b" is the least recently used
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEquals(2, len(cache))
+        self.assertTrue("a" in cache)
+        self.assertFalse("b" in cache)
+        self.assertTrue("c" in cache)
+
+    def test_evict_size(self):
+        cache = LruCache(max_entries=10, max_size=100)
+        cache.set("a", 1, size=60)
+        cache.set("b", 2, size=30)
+        cache.set("c", 3, size=30)
+
+        self.assertFalse("a" in cache)
+        self.assertEquals(60, cache.get_stats()["size"])
+
+        # Replacing an entry shouldn't count its old size
+        cache.set("b", 4, size=40)
+        self.assertEquals(70, cache.get_stats()["size"])
+
+    def test_pop(self):
+        cache = LruCache(max_entries=10)
+        cache.set("a", 1, size=5)
+
+        self.assertEquals(1, cache.pop("a"))
+        self.assertEquals(None, cache.pop("a"))
+        self.assertEquals(0, cache.get_stats()["size"])
+
+    def test_stats(self):
+        cache = LruCache(max_entries=1)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+        cache.set("b", 2)
+
+        stats = cache.get_stats()
+        self.assertEquals(1, stats["hits"])
+        self.assertEquals(1, stats["misses"])
+        self.assertEquals(1, stats["evictions"])
+        self.assertEquals(0.5, stats["hit_rate"])
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+
+from synapse.util.membershipgraph import MembershipGraph
+
+
+class MembershipGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = MembershipGraph()
+        self.graph.load([
+            ("@alice:test", "!a:test"),
+            ("@bob:test", "!a:test"),
+            ("@bob:test", "!b:test"),
+            ("@carol:test", "!b:test"),
+        ])
+
+    def test_share_room(self):
+        self.assertTrue(self.graph.users_share_room(
+            ["@alice:test", "@bob:test"]
+        ))
+        self.assertFalse(self.graph.users_share_room(
+            ["@alice:test", "@carol:test"]
+        ))
+        self.assertFalse(self.graph.users_share_room(
+            ["@alice:test", "@bob:test", "@carol:test"]
+        ))
+        self.assertFalse(self.graph.users_share_room(
+            ["@alice:test", "@nobody:test"]
+        ))
+
+    def test_sharing_room_with(self):
+        self.assertEquals(
+            set(["@alice:test", "@bob:test", "@carol:test"]),
+            self.graph.get_users_sharing_room_with("@bob:test")
+        )
+        self.assertEquals(
+            set(["@alice:test", "@bob:test"]),
+            self.graph.get_users_sharing_room_with("@alice:test")
+        )
+        self.assertEquals(
+            set(), self.graph.get_users_sharing_room_with("@nobody:test")
+        )
+
+    def test_changes(self):
+        self.graph.membership_changed("@carol:test", "!a:test", True)
+        self.graph.membership_changed("@bob:test", "!a:test", False)
+        self.graph.membership_changed("@bob:test", "!b:test", False)
+
+        self.assertTrue(self.graph.users_share_room(
+            ["@alice:test", "@carol:test"]
+        ))
+        self.assertEquals(
+            frozenset(["@alice:test", "@carol:test"]),
+            self.graph.get_users_in_room("!a:test")
+        )
+        self.assertEquals(
+            frozenset(), self.graph.get_rooms_for_user("@bob:test")
+        )
+
+        stats = self.graph.get_stats()
+        self.assertEquals(2, stats["users"])
+        self.assertEquals(2, stats["rooms"])
+        self.assertEquals(3, stats["memberships"])
+
+    def test_changes_before_load(self):
+        graph = MembershipGraph()
+
+        graph.membership_changed("@alice:test", "!a:test", False)
+        graph.membership_changed("@bob:test", "!a:test", True)
+        self.assertFalse(graph.loaded)
+
+        # The load may or may not include the changes made while it ran.
+        graph.load([("@alice:test", "!a:test")])
+
+        self.assertTrue(graph.loaded)
+        self.assertEquals(
+            frozenset(["@bob:test"]), graph.get_users_in_room("!a:test")
+        )
+        self.assertEquals(1, graph.get_stats()["memberships"])
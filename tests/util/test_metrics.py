@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+
+from synapse.util.metrics import Metrics, LatencyHistogram
+
+
+class LatencyHistogramTestCase(unittest.TestCase):
+
+    def test_empty(self):
+        hist = LatencyHistogram()
+
+        self.assertEquals(0, hist.count)
+        self.assertEquals(0, hist.percentile(50))
+
+    def test_percentiles(self):
+        hist = LatencyHistogram()
+
+        for _ in range(98):
+            hist.add(0.0008)  # 0.8ms, in the 1ms bucket
+        hist.add(0.2)  # 200ms
+        hist.add(0.3)  # 300ms
+
+        self.assertEquals(100, hist.count)
+        self.assertEquals(1, hist.percentile(50))
+        self.assertEquals(250, hist.percentile(99))
+        self.assertEquals(300, hist.percentile(100))
+
+    def test_over_largest_bucket(self):
+        hist = LatencyHistogram()
+        hist.add(20)
+
+        self.assertEquals(20000, hist.percentile(50))
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_collect(self):
+        metrics = Metrics()
+        metrics.register("a", lambda: {"x": 1})
+
+        self.assertEquals({"a": {"x": 1}}, metrics.collect())
+
+    def test_failing_source(self):
+        metrics = Metrics()
+        metrics.register("a", lambda: 1 / 0)
+        metrics.register("b", lambda: 2)
+
+        self.assertEquals({"b": 2}, metrics.collect())
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+from tests import unittest
+
+from synapse.util.streamchangecache import StreamChangeCache
+
+
+class StreamChangeCacheTestCase(unittest.TestCase):
+
+    def test_unknown_position(self):
+        cache = StreamChangeCache(max_size=10)
+
+        # Until we know where the cache starts we can't answer anything
+        self.assertTrue(cache.has_entity_changed("a", 10))
+        self.assertTrue(cache.has_any_entity_changed(10))
+
+        cache.set_earliest_known_position(5)
+
+        self.assertFalse(cache.has_entity_changed("a", 10))
+        self.assertFalse(cache.has_any_entity_changed(5))
+        self.assertTrue(cache.has_any_entity_changed(4))
+
+    def test_changes(self):
+        cache = StreamChangeCache(max_size=10)
+        cache.set_earliest_known_position(1)
+
+        cache.entity_has_changed("a", 2)
+        cache.entity_has_changed("b", 3)
+
+        self.assertTrue(cache.has_entity_changed("a", 1))
+        self.assertFalse(cache.has_entity_changed("a", 2))
+        self.assertTrue(cache.has_entity_changed("b", 2))
+        self.assertFalse(cache.has_entity_changed("c", 1))
+
+        self.assertTrue(cache.has_any_entity_changed(2))
+        self.assertFalse(cache.has_any_entity_changed(3))
+
+    def test_eviction(self):
+        cache = StreamChangeCache(max_size=2)
+        cache.set_earliest_known_position(1)
+
+        cache.entity_has_changed("a", 2)
+        cache.entity_has_changed("b", 3)
+        cache.entity_has_changed("c", 4)
+
+        # We've forgotten when "a" changed, so can't answer for before then
+        self.assertTrue(cache.has_entity_changed("d", 1))
+        self.assertFalse(cache.has_entity_changed("d", 2))
+        self.assertFalse(cache.has_entity_changed("a", 2))
+        self.assertTrue(cache.has_entity_changed("b", 2))
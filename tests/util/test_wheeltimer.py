@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+from tests import unittest
+
+from synapse.util.wheeltimer import WheelTimer
+
+
+class MockClock(object):
+    def __init__(self):
+        self.now = 1000.
+        self.timers = []
+
+    def time(self):
+        return self.now
+
+    def call_later(self, delay, callback):
+        self.timers.append((self.now + delay, callback))
+
+    def advance_time(self, secs):
+        self.now += secs
+
+        due = [t for t in self.timers if t[0] <= self.now]
+        self.timers = [t for t in self.timers if t[0] > self.now]
+        for _, callback in due:
+            callback()
+
+
+class WheelTimerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = MockClock()
+        self.expired = []
+        self.timer = WheelTimer(
+            self.clock, self.expired.append, bucket_size=1.
+        )
+
+    def test_expire(self):
+        self.timer.insert("a", 1.5)
+        self.timer.insert("b", 1.8)
+        self.timer.insert("c", 5)
+
+        # "a" and "b" share a bucket, and so a delayed call
+        self.assertEquals(2, len(self.clock.timers))
+        self.assertEquals(3, len(self.timer))
+
+        self.clock.advance_time(1.5)
+        self.assertEquals([], self.expired)
+
+        self.clock.advance_time(0.5)
+        self.assertEquals(["a", "b"], sorted(self.expired))
+        self.assertFalse("a" in self.timer)
+
+        self.clock.advance_time(3)
+        self.assertEquals(["a", "b", "c"], sorted(self.expired))
+        self.assertEquals(0, len(self.timer))
+
+    def test_remove(self):
+        self.timer.insert("a", 1)
+        self.timer.insert("b", 1)
+
+        self.assertTrue(self.timer.remove("a"))
+        self.assertFalse(self.timer.remove("a"))
+
+        self.clock.advance_time(1)
+        self.assertEquals(["b"], self.expired)
+
+    def test_reinsert(self):
+        self.timer.insert("a", 1)
+        self.timer.insert("a", 3)
+
+        self.clock.advance_time(1)
+        self.assertEquals([], self.expired)
+
+        self.clock.advance_time(2)
+        self.assertEquals(["a"], self.expired)
+
+    def test_batched(self):
+        batches = []
+        timer = WheelTimer(
+            self.clock, batches.append, bucket_size=1., batched=True
+        )
+
+        timer.insert("a", 0.5)
+        timer.insert("b", 0.8)
+        timer.insert("c", 0.9)
+        timer.remove("c")
+        timer.insert("d", 2)
+
+        self.clock.advance_time(1)
+        self.assertEquals([["a", "b"]], [sorted(b) for b in batches])
+
+        self.clock.advance_time(1)
+        self.assertEquals(["d"], batches[1])
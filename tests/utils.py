@@ -111,16 +111,40 @@ class MockHttpResource(HttpServer):
 class MockClock(object):
     now = 1000
 
+    def __init__(self):
+        # [time, callback, cancelled] for each pending call_later
+        self.timers = []
+
     def time(self):
         return self.now
 
     def time_msec(self):
         return self.time() * 1000
 
+    def call_later(self, delay, callback):
+        timer = [self.time() + delay, callback, False]
+        self.timers.append(timer)
+        return timer
+
+    def cancel_call_later(self, timer):
+        timer[2] = True
+
     # For unit testing
     def advance_time(self, secs):
         self.now += secs
 
+        timers = self.timers
+        self.timers = []
+
+        for timer in timers:
+            when, callback, cancelled = timer
+            if cancelled:
+                continue
+            if when <= self.now:
+                callback()
+            else:
+                self.timers.append(timer)
+
 
 class SQLiteMemoryDbPool(ConnectionPool, object):
     def __init__(self):
@@ -207,10 +231,25 @@ class MemoryDataStore(object):
                 self.members[r][user_id].membership in membership_list
         ]
 
+    def get_rooms_for_user(self, user_id):
+        return frozenset(
+            r for r in self.members
+            if user_id in self.members[r] and
+                self.members[r][user_id].membership == Membership.JOIN
+        )
+
+    def get_users_in_room(self, room_id):
+        return frozenset(
+            m.user_id for m in self.get_room_members(room_id, Membership.JOIN)
+        )
+
     def get_room_events_stream(self, user_id=None, from_key=None, to_key=None,
                             room_id=None, limit=0, with_feedback=False):
         return ([], from_key)  # TODO
 
+    def room_events_may_have_changed(self, user_id, from_key, room_ids=None):
+        return True
+
     def get_joined_hosts_for_room(self, room_id):
         return defer.succeed([])
 